@@ -1,7 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
+import collections
 import logging
 import math
+import threading
+
+import numpy
 
 from cctbx import crystal
 from cctbx import uctbx
@@ -21,6 +25,33 @@
 
 logger = logging.getLogger(__name__)
 
+# FFT plans and grid buffers are expensive to set up for large grids, so keep
+# those for the few most recently used griddings for the next call, e.g. the
+# next macro-cycle of indexing or the next still in dials.stills_process. The
+# grid buffers are overwritten by every call, so each thread has its own cache.
+_fft_cache = threading.local()
+_fft_cache_size = 4
+
+
+def _cached(gridding, name, factory):
+    """Return the cached object called name for a gridding, creating it if needed.
+
+    Only the objects for the _fft_cache_size most recently used griddings of the
+    calling thread are kept.
+    """
+    cache = getattr(_fft_cache, "griddings", None)
+    if cache is None:
+        cache = _fft_cache.griddings = collections.OrderedDict()
+    buffers = cache.pop(gridding, None)
+    if buffers is None:
+        buffers = {}
+        while len(cache) >= _fft_cache_size:
+            cache.popitem(last=False)
+    cache[gridding] = buffers
+    if name not in buffers:
+        buffers[name] = factory()
+    return buffers[name]
+
 
 fft3d_phil_str = """\
 b_iso = Auto
@@ -58,7 +89,7 @@ class FFT3D(Strategy):
 
     phil_scope = phil.parse(fft3d_phil_str)
 
-    def __init__(self, max_cell, min_cell=3, params=None, *args, **kwargs):
+    def __init__(self, max_cell, min_cell=3, params=None, nproc=1, *args, **kwargs):
         """Construct an FFT3D object.
 
         Args:
@@ -78,6 +109,8 @@ def __init__(self, max_cell, min_cell=3, params=None, *args, **kwargs):
                 map.
             min_cell (float): A conservative lower bound on the minimum possible
                 primitive unit cell dimension.
+            nproc (int): The number of threads to use for the FFT. If greater than
+                one then a multithreaded real-to-complex FFT is used.
         """
         super(FFT3D, self).__init__(max_cell, params=params, *args, **kwargs)
         n_points = self._params.reciprocal_space_grid.n_points
@@ -86,6 +119,7 @@ def __init__(self, max_cell, min_cell=3, params=None, *args, **kwargs):
         )
         self._n_points = self._gridding[0]
         self._min_cell = min_cell
+        self._nproc = nproc
 
     def find_basis_vectors(self, reciprocal_lattice_vectors):
         """Find a list of likely basis vectors.
@@ -205,23 +239,67 @@ def _fft(self, reciprocal_lattice_vectors, d_min):
         # (512**3)*8*2*bytes_to_gb
         # 2.0
 
-        fft = fftpack.complex_to_complex_3d(self._gridding)
-        grid_complex = flex.complex_double(
-            reals=reciprocal_space_grid,
-            imags=flex.double(reciprocal_space_grid.size(), 0),
+        if self._nproc > 1:
+            return self._fft_real_to_complex(reciprocal_space_grid), used_in_indexing
+
+        fft = _cached(
+            self._gridding,
+            "plan",
+            lambda: fftpack.complex_to_complex_3d(self._gridding),
         )
+        imags = _cached(
+            self._gridding,
+            "imags",
+            lambda: flex.double(flex.grid(self._gridding).size_1d(), 0),
+        )
+        grid_complex = flex.complex_double(reals=reciprocal_space_grid, imags=imags)
         grid_transformed = fft.forward(grid_complex)
         grid_real = flex.pow2(flex.real(grid_transformed))
         del grid_transformed
 
         return grid_real, used_in_indexing
 
+    def _fft_real_to_complex(self, reciprocal_space_grid):
+        """Multithreaded real-to-complex equivalent of the complex-to-complex FFT.
+
+        The input grid is real, so the transform is Hermitian, F(-h) = F*(h), and
+        only half of it needs to be calculated. The other half of the squared real
+        part is then filled in from the relation Re F(-h) = Re F(h).
+        """
+        try:
+            import scipy.fft
+
+            transformed = scipy.fft.rfftn(
+                reciprocal_space_grid.as_numpy_array(), workers=self._nproc
+            )
+        except ImportError:
+            transformed = numpy.fft.rfftn(reciprocal_space_grid.as_numpy_array())
+        half = numpy.square(transformed.real)
+        del transformed
+
+        n0, n1, n2 = self._gridding
+        nc = half.shape[2]
+        grid_real = numpy.empty(self._gridding)
+        grid_real[:, :, :nc] = half
+        i0 = (-numpy.arange(n0)) % n0
+        i1 = (-numpy.arange(n1)) % n1
+        i2 = n2 - numpy.arange(nc, n2)
+        grid_real[:, :, nc:] = half[numpy.ix_(i0, i1, i2)]
+        del half
+
+        grid_real = flex.double(grid_real.ravel())
+        grid_real.reshape(flex.grid(self._gridding))
+        return grid_real
+
     def _map_centroids_to_reciprocal_space_grid(
         self, reciprocal_lattice_vectors, d_min
     ):
         logger.info("FFT gridding: (%i,%i,%i)" % self._gridding)
 
-        grid = flex.double(flex.grid(self._gridding), 0)
+        grid = _cached(
+            self._gridding, "grid", lambda: flex.double(flex.grid(self._gridding))
+        )
+        grid.fill(0)
 
         if self._params.b_iso is libtbx.Auto:
             self._params.b_iso = -4 * d_min ** 2 * math.log(0.05)
@@ -3,6 +3,7 @@
 import logging
 import math
 
+import numpy
 from libtbx import phil
 from scitbx import matrix
 from rstbx.array_family import (
@@ -24,8 +25,26 @@
 max_vectors = 30
     .help = "The maximum number of unique vectors to find in the grid search."
     .type = int(value_min=3)
+coarse_to_fine
+    .expert_level = 1
+{
+    enable = False
+        .type = bool
+        .help = "First search a coarse grid of directions, then search the
+                 characteristic_grid around the best of the coarse directions."
+    coarse_grid = 0.06
+        .type = float(value_min=0)
+        .help = "The sampling of the coarse grid of directions in radians."
+    n_refine = 100
+        .type = int(value_min=1)
+        .help = "The number of the highest scoring coarse directions to refine."
+}
 """
 
+# The maximum number of elements in a block of the vectors x reciprocal lattice
+# points matrix when computing the functional
+max_block_elements = 2 ** 22
+
 
 class RealSpaceGridSearch(Strategy):
     """Basis vector search using a real space grid search.
@@ -37,18 +56,22 @@ class RealSpaceGridSearch(Strategy):
 
     phil_scope = phil.parse(real_space_grid_search_phil_str)
 
-    def __init__(self, max_cell, target_unit_cell, params=None, *args, **kwargs):
+    def __init__(
+        self, max_cell, target_unit_cell, params=None, nproc=1, *args, **kwargs
+    ):
         """Construct a real_space_grid_search object.
 
         Args:
             max_cell (float): An estimate of the maximum cell dimension of the primitive
                 cell.
             target_unit_cell (cctbx.uctbx.unit_cell): The target unit cell.
+            nproc (int): The number of threads to use to compute the functional.
         """
         super(RealSpaceGridSearch, self).__init__(
             max_cell, params=params, *args, **kwargs
         )
         self._target_unit_cell = target_unit_cell
+        self._nproc = nproc
 
     @property
     def search_directions(self):
@@ -85,6 +108,83 @@ def compute_functional(vector, reciprocal_lattice_vectors):
         two_pi_S_dot_v = 2 * math.pi * reciprocal_lattice_vectors.dot(vector)
         return flex.sum(flex.cos(two_pi_S_dot_v))
 
+    def compute_functional_batch(self, vectors, reciprocal_lattice_vectors):
+        """Compute the functional for many vectors at once.
+
+        The functional is computed from the product of blocks of the vectors
+        with all the reciprocal lattice vectors. numpy releases the GIL for
+        these operations so the blocks are shared between nproc threads.
+
+        Args:
+            vectors (numpy.ndarray): An (n, 3) array of the search vectors.
+            reciprocal_lattice_vectors (scitbx.array_family.flex.vec3_double):
+                The list of reciprocal lattice vectors.
+
+        Returns:
+            A numpy array of the functional for each vector.
+        """
+        two_pi_S = (
+            2
+            * math.pi
+            * numpy.column_stack(
+                [x.as_numpy_array() for x in reciprocal_lattice_vectors.parts()]
+            )
+        )
+        block_size = max(1, max_block_elements // max(1, len(two_pi_S)))
+        blocks = [
+            vectors[i : i + block_size] for i in range(0, len(vectors), block_size)
+        ]
+
+        def score_block(block):
+            return numpy.cos(block.dot(two_pi_S.T)).sum(axis=1)
+
+        if self._nproc > 1 and len(blocks) > 1:
+            import concurrent.futures
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self._nproc) as pool:
+                scores = list(pool.map(score_block, blocks))
+        else:
+            scores = [score_block(block) for block in blocks]
+        if not scores:
+            return numpy.zeros(0)
+        return numpy.concatenate(scores)
+
+    @staticmethod
+    def _direction_grid(characteristic_grid):
+        """The hemisphere grid of unit directions as an (n, 3) array."""
+        SST = SimpleSamplerTool(characteristic_grid)
+        SST.construct_hemisphere_grid(SST.incr)
+        return numpy.array([direction.dvec for direction in SST.angles])
+
+    @staticmethod
+    def _local_directions(directions, half_width, step):
+        """A fine grid of unit directions around each of the given directions.
+
+        Args:
+            directions (numpy.ndarray): An (n, 3) array of unit directions.
+            half_width (float): The half width of each local grid in radians.
+            step (float): The sampling of each local grid in radians.
+
+        Returns:
+            An (m, 3) array of unit directions.
+        """
+        # Two unit vectors perpendicular to each direction
+        axis = numpy.zeros_like(directions)
+        axis[numpy.arange(len(directions)), numpy.abs(directions).argmin(axis=1)] = 1
+        u = numpy.cross(directions, axis)
+        u /= numpy.linalg.norm(u, axis=1)[:, numpy.newaxis]
+        w = numpy.cross(directions, u)
+
+        n = int(math.ceil(half_width / step))
+        offsets = numpy.tan(numpy.arange(-n, n + 1) * step)
+        a, b = [x.ravel() for x in numpy.meshgrid(offsets, offsets)]
+        local = (
+            directions[:, numpy.newaxis, :]
+            + a[numpy.newaxis, :, numpy.newaxis] * u[:, numpy.newaxis, :]
+            + b[numpy.newaxis, :, numpy.newaxis] * w[:, numpy.newaxis, :]
+        ).reshape(-1, 3)
+        return local / numpy.linalg.norm(local, axis=1)[:, numpy.newaxis]
+
     def score_vectors(self, reciprocal_lattice_vectors):
         """Compute the functional for the given directions.
 
@@ -95,13 +195,46 @@ def score_vectors(self, reciprocal_lattice_vectors):
         Returns:
             A tuple containing the list of search vectors and their scores.
         """
-        vectors = flex.vec3_double()
-        scores = flex.double()
-        for i, v in enumerate(self.search_vectors):
-            f = self.compute_functional(v.elems, reciprocal_lattice_vectors)
-            vectors.append(v.elems)
-            scores.append(f)
-        return vectors, scores
+        lengths = numpy.array(list(set(self._target_unit_cell.parameters()[:3])))
+
+        def vectors_for(directions):
+            return (
+                directions[:, numpy.newaxis, :]
+                * lengths[numpy.newaxis, :, numpy.newaxis]
+            ).reshape(-1, 3)
+
+        params = self._params.coarse_to_fine
+        if params.enable and params.coarse_grid > self._params.characteristic_grid:
+            # Score a coarse grid, then a fine grid around the best directions
+            coarse = self._direction_grid(params.coarse_grid)
+            coarse_vectors = vectors_for(coarse)
+            coarse_scores = self.compute_functional_batch(
+                coarse_vectors, reciprocal_lattice_vectors
+            )
+            best = coarse_scores.reshape(len(coarse), len(lengths)).max(axis=1)
+            best = numpy.argsort(best)[::-1][: params.n_refine]
+            fine_vectors = vectors_for(
+                self._local_directions(
+                    coarse[best],
+                    0.5 * params.coarse_grid,
+                    self._params.characteristic_grid,
+                )
+            )
+            fine_scores = self.compute_functional_batch(
+                fine_vectors, reciprocal_lattice_vectors
+            )
+            vectors = numpy.concatenate([coarse_vectors, fine_vectors])
+            scores = numpy.concatenate([coarse_scores, fine_scores])
+        else:
+            vectors = vectors_for(
+                self._direction_grid(self._params.characteristic_grid)
+            )
+            scores = self.compute_functional_batch(vectors, reciprocal_lattice_vectors)
+
+        vectors = flex.vec3_double(
+            *(flex.double(numpy.ascontiguousarray(x)) for x in vectors.T)
+        )
+        return vectors, flex.double(numpy.ascontiguousarray(scores))
 
     def find_basis_vectors(self, reciprocal_lattice_vectors):
         """Find a list of likely basis vectors.
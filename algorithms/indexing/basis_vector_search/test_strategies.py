@@ -1,10 +1,14 @@
 from __future__ import absolute_import, division
 
+import itertools
+
+import numpy
 import pytest
 
 from . import RealSpaceGridSearch
 from . import FFT1D
 from . import FFT3D
+from . import fft3d
 
 
 class TestStrategies(object):
@@ -29,6 +33,33 @@ def test_fft3d(self, setup_rlp):
         basis_vectors, used = strategy.find_basis_vectors(setup_rlp["rlp"])
         self.check_results(setup_rlp["crystal_symmetry"].unit_cell(), basis_vectors)
 
+    def test_fft3d_real_to_complex(self, setup_rlp):
+        max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
+        strategy = FFT3D(max_cell, nproc=2)
+        basis_vectors, used = strategy.find_basis_vectors(setup_rlp["rlp"])
+        self.check_results(setup_rlp["crystal_symmetry"].unit_cell(), basis_vectors)
+
+        # The threaded real-to-complex FFT should match the complex-to-complex FFT
+        grid_r2c, _ = strategy._fft(setup_rlp["rlp"], 3)
+        grid_c2c, _ = FFT3D(max_cell)._fft(setup_rlp["rlp"], 3)
+        assert grid_r2c.all() == grid_c2c.all()
+        r2c = grid_r2c.as_numpy_array()
+        c2c = grid_c2c.as_numpy_array()
+        assert numpy.allclose(r2c, c2c, atol=1e-8 * c2c.max())
+
+    def test_fft3d_shares_plan(self, setup_rlp):
+        max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
+        first = FFT3D(max_cell)
+        first._fft(setup_rlp["rlp"], 3)
+        plan = fft3d._cached(first._gridding, "plan", lambda: None)
+        assert plan is not None
+
+        # A second instance with the same gridding reuses the plan
+        second = FFT3D(max_cell)
+        assert second._gridding == first._gridding
+        second._fft(setup_rlp["rlp"], 3)
+        assert fft3d._cached(second._gridding, "plan", lambda: None) is plan
+
     def test_real_space_grid_search(self, setup_rlp):
         max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
         strategy = RealSpaceGridSearch(
@@ -36,3 +67,29 @@ def test_real_space_grid_search(self, setup_rlp):
         )
         basis_vectors, used = strategy.find_basis_vectors(setup_rlp["rlp"])
         self.check_results(setup_rlp["crystal_symmetry"].unit_cell(), basis_vectors)
+
+    def test_real_space_grid_search_coarse_to_fine(self, setup_rlp):
+        max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
+        params = RealSpaceGridSearch.phil_scope.extract()
+        params.coarse_to_fine.enable = True
+        strategy = RealSpaceGridSearch(
+            max_cell,
+            target_unit_cell=setup_rlp["crystal_symmetry"].unit_cell(),
+            params=params,
+            nproc=2,
+        )
+        basis_vectors, used = strategy.find_basis_vectors(setup_rlp["rlp"])
+        self.check_results(setup_rlp["crystal_symmetry"].unit_cell(), basis_vectors)
+
+    def test_real_space_grid_search_functional(self, setup_rlp):
+        strategy = RealSpaceGridSearch(
+            100, target_unit_cell=setup_rlp["crystal_symmetry"].unit_cell()
+        )
+        vectors = list(itertools.islice(strategy.search_vectors, 20))
+        scores = strategy.compute_functional_batch(
+            numpy.array([v.elems for v in vectors]), setup_rlp["rlp"]
+        )
+        for v, score in zip(vectors, scores):
+            assert score == pytest.approx(
+                strategy.compute_functional(v.elems, setup_rlp["rlp"])
+            )
@@ -29,6 +29,11 @@
         .help = "Maximum number of putative crystal models to test. Default"
                 "for rotation sweeps: 50, for still images: 5"
         .expert_level = 1
+    early_stop = None
+        .type = int(value_min=1)
+        .help = "Stop testing putative crystal models once the best model has
+                 not changed for this many further models."
+        .expert_level = 1
     sys_absent_threshold = 0.9
         .type = float(value_min=0.0, value_max=1.0)
     solution_scorer = filter *weighted
@@ -154,6 +159,83 @@ def find_lattices(self):
                 )
         return experiments
 
+    def _prepare_candidate(self, cm, sel):
+        """Index the reflections with a candidate crystal model.
+
+        Args:
+            cm (dxtbx.model.Crystal): The candidate crystal model.
+            sel (scitbx.array_family.flex.bool): The reflections to index.
+
+        Returns:
+            A tuple of the experiments and indexed reflections, or None if the
+            candidate model should not be refined.
+        """
+        from rstbx.dps_core.cell_assessment import SmallUnitCellVolume
+        from dials.algorithms.indexing import non_primitive_basis
+
+        experiments = ExperimentList()
+        for expt in self.experiments:
+            experiments.append(
+                Experiment(
+                    imageset=expt.imageset,
+                    beam=expt.beam,
+                    detector=expt.detector,
+                    goniometer=expt.goniometer,
+                    scan=expt.scan,
+                    crystal=cm,
+                )
+            )
+        refl = self.reflections.select(sel)
+        self.index_reflections(experiments, refl)
+        if refl.get_flags(refl.flags.indexed).count(True) == 0:
+            return None
+
+        threshold = self.params.basis_vector_combinations.sys_absent_threshold
+        if threshold and (
+            self._symmetry_handler.target_symmetry_primitive is None
+            or self._symmetry_handler.target_symmetry_primitive.unit_cell() is None
+        ):
+            try:
+                non_primitive_basis.correct(
+                    experiments, refl, self._assign_indices, threshold
+                )
+                if refl.get_flags(refl.flags.indexed).count(True) == 0:
+                    return None
+            except SmallUnitCellVolume:
+                logger.debug(
+                    "correct_non_primitive_basis SmallUnitCellVolume error for unit cell %s:"
+                    % experiments[0].crystal.get_unit_cell()
+                )
+                return None
+            except RuntimeError as e:
+                if "Krivy-Gruber iteration limit exceeded" in str(e):
+                    logger.debug(
+                        "correct_non_primitive_basis Krivy-Gruber iteration limit exceeded error for unit cell %s:"
+                        % experiments[0].crystal.get_unit_cell()
+                    )
+                    return None
+                raise
+            if (
+                experiments[0].crystal.get_unit_cell().volume()
+                < self.params.min_cell_volume
+            ):
+                return None
+
+        if self.params.known_symmetry.space_group is not None:
+            new_crystal, cb_op_to_primitive = self._symmetry_handler.apply_symmetry(
+                experiments[0].crystal
+            )
+            if new_crystal is None:
+                return None
+            experiments[0].crystal.update(new_crystal)
+            if not cb_op_to_primitive.is_identity_op():
+                indexed_sel = refl["id"] > -1
+                miller_indices = refl["miller_index"].select(indexed_sel)
+                miller_indices = cb_op_to_primitive.apply(miller_indices)
+                refl["miller_index"].set_selected(indexed_sel, miller_indices)
+
+        return experiments, refl
+
     def choose_best_orientation_matrix(self, candidate_orientation_matrices):
 
         from dials.algorithms.indexing import model_evaluation
@@ -176,107 +258,80 @@ def choose_best_orientation_matrix(self, candidate_orientation_matrices):
                 n_indexed_cutoff=filter_params.n_indexed_cutoff,
             )
 
-        args = []
-
-        for cm in candidate_orientation_matrices:
-            sel = self.reflections["id"] == -1
-            if self.d_min is not None:
-                sel &= 1 / self.reflections["rlp"].norms() > self.d_min
-            xo, yo, zo = self.reflections["xyzobs.mm.value"].parts()
-            imageset_id = self.reflections["imageset_id"]
-            experiments = ExperimentList()
-            for i_expt, expt in enumerate(self.experiments):
-                # XXX Not sure if we still need this loop over self.experiments
-                if expt.scan is not None:
-                    start, end = expt.scan.get_oscillation_range()
-                    if (end - start) > 360:
-                        # only use reflections from the first 360 degrees of the scan
-                        sel.set_selected(
-                            (imageset_id == i_expt)
-                            & (zo > ((start * math.pi / 180) + 2 * math.pi)),
-                            False,
-                        )
-                experiments.append(
-                    Experiment(
-                        imageset=expt.imageset,
-                        beam=expt.beam,
-                        detector=expt.detector,
-                        goniometer=expt.goniometer,
-                        scan=expt.scan,
-                        crystal=cm,
-                    )
-                )
-            refl = self.reflections.select(sel)
-            self.index_reflections(experiments, refl)
-            if refl.get_flags(refl.flags.indexed).count(True) == 0:
-                continue
-
-            from rstbx.dps_core.cell_assessment import SmallUnitCellVolume
-            from dials.algorithms.indexing import non_primitive_basis
-
-            threshold = self.params.basis_vector_combinations.sys_absent_threshold
-            if threshold and (
-                self._symmetry_handler.target_symmetry_primitive is None
-                or self._symmetry_handler.target_symmetry_primitive.unit_cell() is None
-            ):
-                try:
-                    non_primitive_basis.correct(
-                        experiments, refl, self._assign_indices, threshold
-                    )
-                    if refl.get_flags(refl.flags.indexed).count(True) == 0:
-                        continue
-                except SmallUnitCellVolume:
-                    logger.debug(
-                        "correct_non_primitive_basis SmallUnitCellVolume error for unit cell %s:"
-                        % experiments[0].crystal.get_unit_cell()
+        # The reflections to index are the same for every candidate model
+        sel = self.reflections["id"] == -1
+        if self.d_min is not None:
+            sel &= 1 / self.reflections["rlp"].norms() > self.d_min
+        xo, yo, zo = self.reflections["xyzobs.mm.value"].parts()
+        imageset_id = self.reflections["imageset_id"]
+        for i_expt, expt in enumerate(self.experiments):
+            # XXX Not sure if we still need this loop over self.experiments
+            if expt.scan is not None:
+                start, end = expt.scan.get_oscillation_range()
+                if (end - start) > 360:
+                    # only use reflections from the first 360 degrees of the scan
+                    sel.set_selected(
+                        (imageset_id == i_expt)
+                        & (zo > ((start * math.pi / 180) + 2 * math.pi)),
+                        False,
                     )
-                    continue
-                except RuntimeError as e:
-                    if "Krivy-Gruber iteration limit exceeded" in str(e):
-                        logger.debug(
-                            "correct_non_primitive_basis Krivy-Gruber iteration limit exceeded error for unit cell %s:"
-                            % experiments[0].crystal.get_unit_cell()
-                        )
-                        continue
-                    raise
-                if (
-                    experiments[0].crystal.get_unit_cell().volume()
-                    < self.params.min_cell_volume
-                ):
-                    continue
-
-            if self.params.known_symmetry.space_group is not None:
-                new_crystal, cb_op_to_primitive = self._symmetry_handler.apply_symmetry(
-                    experiments[0].crystal
-                )
-                if new_crystal is None:
-                    continue
-                experiments[0].crystal.update(new_crystal)
-                if not cb_op_to_primitive.is_identity_op():
-                    sel = refl["id"] > -1
-                    miller_indices = refl["miller_index"].select(sel)
-                    miller_indices = cb_op_to_primitive.apply(miller_indices)
-                    refl["miller_index"].set_selected(sel, miller_indices)
-
-            args.append((experiments, refl))
-            if len(args) == self.params.basis_vector_combinations.max_refine:
-                break
-
-        from libtbx import easy_mp
 
         evaluator = model_evaluation.ModelEvaluation(self.all_params)
-        results = easy_mp.parallel_map(
-            evaluator.evaluate,
-            args,
-            iterable_type=easy_mp.posiargs,
-            processes=self.params.nproc,
-            preserve_exception_message=True,
-        )
 
-        for soln in results:
-            if soln is None:
-                continue
-            solutions.append(soln)
+        def evaluate(cm):
+            candidate = self._prepare_candidate(cm, sel)
+            if candidate is None:
+                return False, None
+            return True, evaluator.evaluate(*candidate)
+
+        # Index, correct and refine the candidate models in a single pool of
+        # worker processes, which share the reflections with this process. The
+        # results are handled in candidate order as soon as they are available,
+        # and no further candidates are submitted once the search is finished.
+        from dials.util.mp import streaming_parallel_map
+
+        max_refine = self.params.basis_vector_combinations.max_refine
+        early_stop = self.params.basis_vector_combinations.early_stop
+        state = {"n_refined": 0, "n_unchanged": 0, "best": None, "finished": False}
+
+        def candidates():
+            for cm in candidate_orientation_matrices:
+                if state["finished"]:
+                    return
+                yield cm
+
+        def process_result(result):
+            refined, soln = result
+            if state["finished"] or not refined:
+                return
+            state["n_refined"] += 1
+            if soln is not None:
+                solutions.append(soln)
+            if early_stop is not None and len(solutions):
+                if solutions.best_model() is state["best"]:
+                    state["n_unchanged"] += 1
+                else:
+                    state["best"] = solutions.best_model()
+                    state["n_unchanged"] = 0
+                if state["n_unchanged"] >= early_stop:
+                    logger.debug(
+                        "Best model unchanged after %d further models"
+                        % state["n_unchanged"]
+                    )
+                    state["finished"] = True
+            if state["n_refined"] == max_refine:
+                state["finished"] = True
+
+        if self.params.nproc > 1:
+            streaming_parallel_map(
+                evaluate,
+                candidates(),
+                processes=self.params.nproc,
+                callback=process_result,
+            )
+        else:
+            for cm in candidates():
+                process_result(evaluate(cm))
 
         if len(solutions):
             logger.info("Candidate solutions:")
@@ -319,6 +374,7 @@ def __init__(self, reflections, experiments, params=None):
             min_cell=self.params.min_cell,
             target_unit_cell=target_unit_cell,
             params=getattr(self.params, entry_point.name),
+            nproc=self.params.nproc,
         )
 
     def find_candidate_basis_vectors(self):
@@ -61,6 +61,28 @@ def test_BasisVectorSearch_i04_weak_data(
     )
 
 
+@pytest.mark.parametrize("nproc,early_stop", ((1, 2), (2, None), (2, 2)))
+def test_BasisVectorSearch_parallel_candidates_i04_weak_data(
+    i04_weak_data, nproc, early_stop
+):
+    reflections = i04_weak_data["reflections"]
+    experiments = i04_weak_data["experiments"]
+    params = phil_scope.fetch().extract()
+    params.indexing.refinement_protocol.n_macro_cycles = 2
+    params.indexing.basis_vector_combinations.max_refine = 5
+    params.indexing.basis_vector_combinations.early_stop = early_stop
+    params.indexing.method = "fft3d"
+    params.indexing.nproc = nproc
+    idxr = lattice_search.BasisVectorSearch(reflections, experiments, params)
+    idxr.index()
+
+    indexed_experiments = idxr.refined_experiments
+    assert len(indexed_experiments) == 1
+    assert indexed_experiments[0].crystal.get_unit_cell().parameters() == pytest.approx(
+        (57.752, 57.776, 150.013, 90.0101, 89.976, 90.008), rel=1e-3
+    )
+
+
 @pytest.mark.parametrize(
     "indexing_method,space_group,unit_cell",
     (
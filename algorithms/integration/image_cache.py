@@ -0,0 +1,196 @@
+#
+# image_cache.py
+#
+#  Copyright (C) 2019 Diamond Light Source
+#
+#  This code is distributed under the BSD license, a copy of which is
+#  included in the root directory of this package.
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import logging
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_directory():
+    """
+    Get the default directory in which to create the cache. On linux this is
+    the POSIX shared memory filesystem so that cached frames never touch disk.
+
+    :return: The directory name
+
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class ImageCache(object):
+    """
+    A node-local cache of corrected image data and masks.
+
+    Each frame is stored in its own file of raw panel buffers (the float64 data
+    for each panel followed by the uint8 mask for each panel) which is read back
+    through a memory map. Frames are written atomically so the cache can be
+    shared between all the integration processes running on a host: each frame
+    is then decoded once per host rather than once for every block that
+    overlaps it. When the total size of the cache exceeds max_size, the least
+    recently used frames are evicted.
+
+    The object only holds the cache directory and size limit so is cheap to
+    pickle and send to worker processes.
+
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Initialise the cache.
+
+        :param directory: The directory holding the cached frames
+        :param max_size: The maximum size of the cache in bytes
+
+        """
+        assert max_size > 0, "Cache size must be > 0"
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def create(cls, directory=None, max_size=4e9):
+        """
+        Create a new, empty cache in a unique sub-directory.
+
+        :param directory: The parent directory (default shared memory)
+        :param max_size: The maximum size of the cache in bytes
+        :return: The cache
+
+        """
+        if directory is None:
+            directory = default_cache_directory()
+        path = tempfile.mkdtemp(prefix="dials_image_cache_", dir=directory)
+        logger.debug("Created image cache in %s", path)
+        return cls(path, max_size)
+
+    def destroy(self):
+        """
+        Delete the cache and all the cached frames.
+
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def filename(self, imageset_id, index):
+        """
+        Get the filename for a frame.
+
+        :param imageset_id: The index of the imageset in the experiment list
+        :param index: The array index of the frame
+        :return: The filename
+
+        """
+        return os.path.join(self.directory, "frame_%d_%d.dat" % (imageset_id, index))
+
+    def get(self, imageset_id, index, image_size):
+        """
+        Get a frame from the cache.
+
+        :param imageset_id: The index of the imageset in the experiment list
+        :param index: The array index of the frame
+        :param image_size: The (fast, slow) image size of each panel
+        :return: A tuple of (data, mask) panel tuples or None if not cached
+
+        """
+        import numpy
+        from dials.array_family import flex
+
+        filename = self.filename(imageset_id, index)
+        try:
+            buf = numpy.memmap(filename, dtype=numpy.uint8, mode="r")
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Check the size matches what we expect, otherwise treat it as a miss
+        num_pixels = [fast * slow for fast, slow in image_size]
+        if len(buf) != 9 * sum(num_pixels):
+            return None
+
+        data = []
+        mask = []
+        offset = 0
+        for n, (fast, slow) in zip(num_pixels, image_size):
+            d = buf[offset : offset + 8 * n].view(numpy.float64)
+            data.append(flex.double(numpy.array(d)))
+            data[-1].reshape(flex.grid(slow, fast))
+            offset += 8 * n
+        for n, (fast, slow) in zip(num_pixels, image_size):
+            m = buf[offset : offset + n].view(numpy.bool_)
+            mask.append(flex.bool(numpy.array(m)))
+            mask[-1].reshape(flex.grid(slow, fast))
+            offset += n
+        del buf
+
+        # Mark the frame as recently used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return tuple(data), tuple(mask)
+
+    def put(self, imageset_id, index, data, mask):
+        """
+        Add a frame to the cache.
+
+        :param imageset_id: The index of the imageset in the experiment list
+        :param index: The array index of the frame
+        :param data: The tuple of panel data
+        :param mask: The tuple of panel masks
+
+        """
+        assert len(data) == len(mask), "Data and mask have different lengths"
+        filename = self.filename(imageset_id, index)
+        handle, tmp_filename = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as outfile:
+                for d in data:
+                    d.as_numpy_array().astype("float64").tofile(outfile)
+                for m in mask:
+                    m.as_numpy_array().astype("uint8").tofile(outfile)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            # A full shared memory filesystem is not fatal; just don't cache
+            logger.debug("Unable to cache frame %d: %s", index, e)
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used frames until the cache fits in max_size.
+
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".dat"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
@@ -69,6 +69,29 @@ def generate_phil_scope():
 
       }
 
+      image_cache
+        .expert_level = 2
+      {
+        enable = False
+          .type = bool
+          .help = "Cache corrected images and masks in a node-local shared"
+                  "memory cache so that frames in the overlap between"
+                  "processing blocks are only read and decompressed once per"
+                  "host. Useful when image decompression dominates the"
+                  "integration time, e.g. for HDF5 bitshuffle data."
+
+        directory = None
+          .type = path
+          .help = "The directory in which to create the cache. The default is"
+                  "/dev/shm if available, otherwise the temporary directory."
+
+        max_size = 4
+          .type = float(value_min=0.0)
+          .help = "The maximum size of the image cache in GB. The least"
+                  "recently used frames are evicted beyond this size. A size"
+                  "of 0 disables the cache."
+      }
+
       use_dynamic_mask = True
         .type = bool
         .help = "Use dynamic mask if available"
@@ -189,6 +212,15 @@ def generate_phil_scope():
         nproc = 1
           .type = int(value_min=1)
           .help = "The number of processes to use per cluster job"
+
+        max_in_flight = None
+          .type = int(value_min=1)
+          .help = "When running with a single job, the maximum number of"
+                  "integration tasks that are submitted to the process pool"
+                  "at any one time. Tasks are generated lazily so this bounds"
+                  "the memory used in the parent process. The default is"
+                  "twice the number of processes."
+          .expert_level = 2
       }
 
       summation {
@@ -348,6 +380,7 @@ def from_phil(params):
         mp.method = params.mp.method
         mp.nproc = params.mp.nproc
         mp.njobs = params.mp.njobs
+        mp.max_in_flight = params.mp.max_in_flight
 
         # Set the lookup parameters
         lookup = processor.Lookup()
@@ -361,10 +394,17 @@ def from_phil(params):
         block.force = params.block.force
         block.max_memory_usage = params.block.max_memory_usage
 
+        # Set the image cache parameters
+        image_cache = processor.ImageCache()
+        image_cache.enable = params.image_cache.enable
+        image_cache.directory = params.image_cache.directory
+        image_cache.max_size = params.image_cache.max_size
+
         # Set the modelling processor parameters
         result.modelling.mp = mp
         result.modelling.lookup = lookup
         result.modelling.block = block
+        result.modelling.image_cache = image_cache
         if params.debug.during == "modelling":
             result.modelling.debug.output = params.debug.output
         result.modelling.debug.select = params.debug.select
@@ -374,6 +414,7 @@ def from_phil(params):
         result.integration.mp = mp
         result.integration.lookup = lookup
         result.integration.block = block
+        result.integration.image_cache = image_cache
         if params.debug.during == "integration":
             result.integration.debug.output = params.debug.output
         result.integration.debug.select = params.debug.select
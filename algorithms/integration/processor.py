@@ -48,12 +48,14 @@ def __init__(self):
         self.nproc = 1
         self.njobs = 1
         self.nthreads = 1
+        self.max_in_flight = None
 
     def update(self, other):
         self.method = other.method
         self.nproc = other.nproc
         self.njobs = other.njobs
         self.nthreads = other.nthreads
+        self.max_in_flight = other.max_in_flight
 
 
 class Lookup(object):
@@ -90,6 +92,23 @@ def update(self, other):
         self.max_memory_usage = other.max_memory_usage
 
 
+class ImageCache(object):
+    """
+    Image cache parameters
+
+    """
+
+    def __init__(self):
+        self.enable = False
+        self.directory = None
+        self.max_size = 4.0
+
+    def update(self, other):
+        self.enable = other.enable
+        self.directory = other.directory
+        self.max_size = other.max_size
+
+
 class Shoebox(object):
     """
     Shoebox parameters
@@ -138,6 +157,7 @@ def __init__(self):
         self.mp = MultiProcessing()
         self.lookup = Lookup()
         self.block = Block()
+        self.image_cache = ImageCache()
         self.shoebox = Shoebox()
         self.debug = Debug()
 
@@ -149,6 +169,7 @@ def update(self, other):
         self.mp.update(other.mp)
         self.lookup.update(other.lookup)
         self.block.update(other.block)
+        self.image_cache.update(other.image_cache)
         self.shoebox.update(other.shoebox)
         self.debug.update(other.debug)
 
@@ -244,7 +265,7 @@ def process(self):
         :return: The processing results
 
         """
-        from dials.util.mp import multi_node_parallel_map
+        from dials.util.mp import multi_node_parallel_map, streaming_parallel_map
         import platform
 
         start_time = time()
@@ -278,28 +299,46 @@ def process(self):
             )
         else:
             logger.info(" Using multiprocessing with %d parallel job(s)\n" % (mp_nproc))
-        if mp_njobs * mp_nproc > 1:
-
-            def process_output(result):
-                for message in result[1]:
-                    logger.log(message.levelno, message.msg)
-                self.manager.accumulate(result[0])
-                result[0].reflections = None
-                result[0].data = None
-
-            multi_node_parallel_map(
-                func=ExecuteParallelTask(),
-                iterable=list(self.manager.tasks()),
-                njobs=mp_njobs,
-                nproc=mp_nproc,
-                callback=process_output,
-                cluster_method=mp_method,
-                preserve_order=True,
-                preserve_exception_message=True,
-            )
-        else:
-            for task in self.manager.tasks():
-                self.manager.accumulate(task())
+        try:
+            if mp_njobs * mp_nproc > 1:
+
+                def process_output(result):
+                    for message in result[1]:
+                        logger.log(message.levelno, message.msg)
+                    self.manager.accumulate(result[0])
+                    result[0].reflections = None
+                    result[0].data = None
+
+                if mp_njobs == 1:
+                    # Generate the tasks lazily so that only a bounded number of
+                    # split reflection tables are held in memory at any time and
+                    # the workers can start before all the blocks have been split
+                    streaming_parallel_map(
+                        func=ExecuteParallelTask(),
+                        iterable=self.manager.tasks(),
+                        processes=mp_nproc,
+                        max_in_flight=self.manager.params.mp.max_in_flight,
+                        callback=process_output,
+                    )
+                else:
+                    multi_node_parallel_map(
+                        func=ExecuteParallelTask(),
+                        iterable=list(self.manager.tasks()),
+                        njobs=mp_njobs,
+                        nproc=mp_nproc,
+                        callback=process_output,
+                        cluster_method=mp_method,
+                        preserve_order=True,
+                        preserve_exception_message=True,
+                    )
+            else:
+                for task in self.manager.tasks():
+                    self.manager.accumulate(task())
+        except Exception:
+            # Don't leave cached frames behind in shared memory
+            if self.manager.image_cache is not None:
+                self.manager.image_cache.destroy()
+            raise
         self.manager.finalize()
         end_time = time()
         self.manager.time.user_time = end_time - start_time
@@ -366,7 +405,16 @@ class Task(object):
 
     """
 
-    def __init__(self, index, job, experiments, reflections, params, executor=None):
+    def __init__(
+        self,
+        index,
+        job,
+        experiments,
+        reflections,
+        params,
+        executor=None,
+        image_cache=None,
+    ):
         """
         Initialise the task.
 
@@ -378,6 +426,7 @@ def __init__(self, index, job, experiments, reflections, params, executor=None):
         :param flatten: Flatten the shoeboxes
         :param save_shoeboxes: Save the shoeboxes to file
         :param executor: The executor class
+        :param image_cache: An optional shared image cache
 
         """
         assert executor is not None, "No executor given"
@@ -390,6 +439,7 @@ def __init__(self, index, job, experiments, reflections, params, executor=None):
         self.reflections = reflections
         self.params = params
         self.executor = executor
+        self.image_cache = image_cache
 
     def __call__(self):
         """
@@ -415,6 +465,9 @@ def __call__(self):
             assert (
                 self.experiments[i].imageset == imageset
             ), "Task can only handle 1 imageset"
+        if self.image_cache is not None:
+            imageset_id = self.experiments.imagesets().index(imageset)
+            image_size = [p.get_image_size() for p in imageset.get_detector()]
 
         # Get the sub imageset
         frame00, frame01 = self.job
@@ -499,19 +552,27 @@ def __call__(self):
         read_time = 0.0
         for i in range(len(imageset)):
             st = time()
-            image = imageset.get_corrected_data(i)
-            if imageset.is_marked_for_rejection(i):
-                mask = tuple(flex.bool(im.accessor(), False) for im in image)
+            cached = None
+            if self.image_cache is not None:
+                cached = self.image_cache.get(imageset_id, frame0 + i, image_size)
+            if cached is not None:
+                image, mask = cached
             else:
-                mask = imageset.get_mask(i)
-                if self.params.lookup.mask is not None:
-                    assert len(mask) == len(self.params.lookup.mask), (
-                        "Mask/Image are incorrect size %d %d"
-                        % (len(mask), len(self.params.lookup.mask))
-                    )
-                    mask = tuple(
-                        m1 & m2 for m1, m2 in zip(self.params.lookup.mask, mask)
-                    )
+                image = imageset.get_corrected_data(i)
+                if imageset.is_marked_for_rejection(i):
+                    mask = tuple(flex.bool(im.accessor(), False) for im in image)
+                else:
+                    mask = imageset.get_mask(i)
+                    if self.params.lookup.mask is not None:
+                        assert len(mask) == len(self.params.lookup.mask), (
+                            "Mask/Image are incorrect size %d %d"
+                            % (len(mask), len(self.params.lookup.mask))
+                        )
+                        mask = tuple(
+                            m1 & m2 for m1, m2 in zip(self.params.lookup.mask, mask)
+                        )
+                if self.image_cache is not None:
+                    self.image_cache.put(imageset_id, frame0 + i, image, mask)
 
             read_time += time() - st
             processor.next(make_image(image, mask), self.executor)
@@ -567,6 +628,9 @@ def __init__(self, experiments, reflections, params):
         # Initialise the callbacks
         self.executor = None
 
+        # The shared image cache, created on initialization
+        self.image_cache = None
+
         # Save some data
         self.experiments = experiments
         self.reflections = reflections
@@ -577,6 +641,10 @@ def __init__(self, experiments, reflections, params):
         # Save some parameters
         self.params = params
 
+        # The smallest block size (in frames) the memory planner may choose.
+        # This is only set if the block size is computed automatically
+        self.min_block_size = None
+
         # Set the finalized flag to False
         self.finalized = False
 
@@ -597,12 +665,29 @@ def initialize(self):
         # Compute the block size and processors
         self.compute_blocks()
         self.compute_jobs()
+        self.plan_blocks_for_memory()
         self.split_reflections()
         self.compute_processors()
 
         # Create the reflection manager
         self.manager = ReflectionManager(self.jobs, self.reflections)
 
+        # Create the shared image cache. The cache is node-local and is only
+        # worthwhile when there are overlapping blocks since otherwise each
+        # frame is read once anyway
+        if (
+            self.params.image_cache.enable
+            and self.params.image_cache.max_size > 0
+            and self.params.mp.njobs == 1
+            and len(self) > 1
+        ):
+            from dials.algorithms.integration.image_cache import ImageCache
+
+            self.image_cache = ImageCache.create(
+                directory=self.params.image_cache.directory,
+                max_size=self.params.image_cache.max_size * 1e9,
+            )
+
         # Parallel reading of HDF5 from the same handle is not allowed. Python
         # multiprocessing is a bit messed up and used fork on linux so need to
         # close and reopen file.
@@ -637,6 +722,7 @@ def task(self, index):
                 reflections=reflections,
                 params=self.params,
                 executor=self.executor,
+                image_cache=self.image_cache,
             )
         return task
 
@@ -668,6 +754,11 @@ def finalize(self):
         # Check manager is finished
         assert self.manager.finished(), "Manager is not finished"
 
+        # Remove the shared image cache
+        if self.image_cache is not None:
+            self.image_cache.destroy()
+            self.image_cache = None
+
         # Update the time and finalized flag
         self.time.finalize = time() - start_time
         self.finalized = True
@@ -721,6 +812,7 @@ def compute_blocks(self):
                 block_size = nframes[cutoff] * 2
                 self.params.block.size = block_size
                 self.params.block.units = "frames"
+                self.min_block_size = nframes[cutoff]
 
     def compute_jobs(self):
         """
@@ -760,6 +852,87 @@ def compute_jobs(self):
             self.jobs.add((i0, i1), array_range, block_size_frames)
         assert len(self.jobs) > 0, "Invalid number of jobs"
 
+    def compute_max_shoebox_memory(self):
+        """
+        Compute the maximum shoebox memory required by any job for the current
+        job list without modifying the reflection table.
+
+        :return: The maximum shoebox memory in bytes
+
+        """
+        from dials.array_family import flex
+
+        # Split a lightweight copy of the reflections in the same way as
+        # split_reflections so that the memory estimate matches the jobs
+        reflections = flex.reflection_table()
+        for key in ("bbox", "id", "flags"):
+            reflections[key] = self.reflections[key].deep_copy()
+        if self.params.shoebox.partials:
+            reflections.split_partials()
+        else:
+            self.jobs.split(reflections)
+        return flex.max(
+            self.jobs.shoebox_memory(reflections, self.params.shoebox.flatten)
+        )
+
+    def plan_blocks_for_memory(self):
+        """
+        Jointly choose the block size and number of processes.
+
+        If the block size was computed automatically, the shoebox memory
+        required by each job limits how many processes can run at once within
+        the memory budget. Rather than reducing the number of processes after
+        the fact, try successively smaller blocks (down to the size which still
+        contains 100*threshold % of the reflections) and pick the largest block
+        size which allows all the requested processes to run. If no block size
+        allows this, pick the one which allows the most processes.
+
+        """
+        from libtbx.introspection import machine_memory_info
+
+        if self.min_block_size is None or not self.uses_local_multiprocessing():
+            return
+
+        # Get the memory budget. On windows this is not available
+        total_memory = machine_memory_info().memory_total()
+        if total_memory is None:
+            return
+        assert total_memory > 0, "Your system appears to have no memory!"
+        limit_memory = total_memory * self.params.block.max_memory_usage
+
+        # The candidate block sizes, from the largest down
+        block_size = int(self.params.block.size)
+        min_block_size = max(1, self.min_block_size)
+        candidates = [block_size]
+        while candidates[-1] > min_block_size:
+            candidates.append(max(min_block_size, int(candidates[-1] * 0.8)))
+
+        # Find the largest block size allowing the most processes
+        nproc = self.params.mp.nproc
+        best_size, best_nproc = None, 0
+        for size in candidates:
+            self.params.block.size = size
+            self.compute_jobs()
+            max_memory = self.compute_max_shoebox_memory()
+            nfit = min(nproc, int(math.floor(limit_memory / max(max_memory, 1))))
+            if nfit > best_nproc:
+                best_size, best_nproc = size, nfit
+            if nfit >= nproc:
+                break
+
+        # If nothing fits, keep the original block size and let
+        # compute_processors report the problem
+        if best_size is None:
+            best_size = block_size
+        self.params.block.size = best_size
+        self.compute_jobs()
+        if best_size != block_size:
+            logger.info(
+                " Reduced block size from %d to %d frames to allow %d of %d"
+                " processes within the memory limit\n"
+                % (block_size, best_size, best_nproc, nproc)
+            )
+
     def split_reflections(self):
         """
         Split the reflections into partials or over job boundaries
@@ -792,6 +965,17 @@ def split_reflections(self):
         # Compute the partiality
         self.reflections.compute_partiality(self.experiments)
 
+    def uses_local_multiprocessing(self):
+        """
+        Check if the tasks will be run by multiple processes on this machine.
+
+        :return: True/False more than one local process is used
+
+        """
+        return self.params.mp.nproc > 1 and (
+            self.params.mp.njobs == 1 or self.params.mp.method == "multiprocessing"
+        )
+
     def compute_processors(self):
         """
         Compute the number of processors
@@ -801,7 +985,7 @@ def compute_processors(self):
         from dials.array_family import flex
 
         # Set the memory usage per processor
-        if self.params.mp.method == "multiprocessing" and self.params.mp.nproc > 1:
+        if self.uses_local_multiprocessing():
 
             # Get the maximum shoebox memory
             max_memory = flex.max(
@@ -42,8 +42,11 @@
   .help = "Parameters to configure the refinery"
   .expert_level = 1
 {
-  engine = SimpleLBFGS LBFGScurvs GaussNewton *LevMar SparseLevMar
-    .help = "The minimisation engine to use"
+  engine = SimpleLBFGS LBFGScurvs GaussNewton *LevMar SparseLevMar SchurLevMar
+    .help = "The minimisation engine to use. SchurLevMar exploits the block"
+            "structure of joint refinement of many crystals against shared"
+            "detector and beam models, but does not support restraints or"
+            "constraints"
     .type = choice
 
   max_iterations = None
@@ -151,6 +154,28 @@ def from_json_file(cls, filename):
             setattr(j, key, d["attributes"][key])
         return j
 
+    @classmethod
+    def combine(cls, journals):
+        """Combine the journals of separate refinement runs into a single journal.
+        The rows of each journal are added in turn, with a column 'group' to
+        identify the run. Cells for columns missing from a journal are None"""
+
+        j = cls()
+        keys = set()
+        for journal in journals:
+            keys.update(journal.keys())
+        j["group"] = []
+        for key in keys:
+            j[key] = []
+        for i, journal in enumerate(journals):
+            nrows = journal.get_nrows()
+            j["group"].extend([i] * nrows)
+            for key in keys:
+                j[key].extend(journal.get(key, [None] * nrows))
+            j._nrows += nrows
+        j.reason_for_termination = [e.reason_for_termination for e in journals]
+        return j
+
 
 class Refinery(object):
     """Interface for Refinery objects. This should be subclassed and the run
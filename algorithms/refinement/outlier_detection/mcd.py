@@ -76,6 +76,7 @@ def _detect_outliers(self, cols):
             k1=self._k1,
             k2=self._k2,
             k3=self._k3,
+            random_generator=self._random_generator,
         )
 
         # get location and MCD scatter estimate
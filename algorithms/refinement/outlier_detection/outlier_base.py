@@ -1,9 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import time
 from math import pi
 
 from dials.array_family import flex
+from libtbx import easy_mp
 from libtbx.phil import parse
 from libtbx.table_utils import simple_table
 
@@ -44,6 +46,16 @@ def __init__(
         # the number of rejections
         self.nreject = 0
 
+        # the number of processes over which to spread the jobs
+        self._nproc = 1
+
+        # the random seed for the first job, incremented for each further job
+        self._random_seed = 42
+
+        # the random number generator of the current job, for algorithms that
+        # use random sampling
+        self._random_generator = None
+
         return
 
     def get_block_width(self, exp_id=None):
@@ -62,6 +74,16 @@ def set_block_width(self, block_width):
         to mean that the dataset will not be split into blocks."""
         self._block_width = block_width
 
+    def set_nproc(self, nproc):
+        """Set the number of processes over which to spread the outlier detection
+        jobs"""
+        self._nproc = nproc
+
+    def set_random_seed(self, random_seed):
+        """Set the random seed for the first outlier detection job. Each further
+        job uses the next seed, so results do not depend on nproc"""
+        self._random_seed = random_seed
+
     def _detect_outliers(self, cols):
         """Perform outlier detection using the input cols and return a flex.bool
         indicating which rows in the cols are considered outlying. cols should be
@@ -70,6 +92,35 @@ def _detect_outliers(self, cols):
         # to be implemented by derived classes
         raise NotImplementedError()
 
+    def _run_job(self, job, seed=None):
+        """Perform outlier detection for a single job and return the positions of
+        outliers in the original reflections, and the time taken"""
+
+        start_time = time.time()
+        # each job has its own generator, so the global random state of the
+        # caller is left untouched
+        if seed is not None:
+            self._random_generator = flex.mersenne_twister(seed=seed)
+
+        data = job["data"]
+        indices = job["indices"]
+        if len(indices) >= self._min_num_obs:
+
+            # get the subset of data as a list of columns
+            cols = [data[col] for col in self._cols]
+
+            # determine the position of outliers on this sub-dataset
+            outliers = self._detect_outliers(cols)
+
+            # get positions of outliers from the original matches
+            ioutliers = indices.select(outliers)
+
+        else:
+            # too few or no reflections in the job
+            ioutliers = indices
+
+        return ioutliers, time.time() - start_time
+
     def __call__(self, reflections):
         """Identify outliers in the input and set the centroid_outlier flag.
         Return True if any outliers were detected, otherwise False"""
@@ -84,8 +135,17 @@ def __call__(self, reflections):
         for col in self._cols:
             assert col in reflections
 
+        # select only the columns needed to split the data into jobs and detect
+        # outliers, rather than copying the whole table for each split
         sel = reflections.get_flags(reflections.flags.predicted)
-        all_data = reflections.select(sel)
+        cols = set(self._cols) | {"id"}
+        if self._separate_panels:
+            cols.add("panel")
+        if self.get_block_width() is not None:
+            cols.add("xyzobs.mm.value")
+        all_data = flex.reflection_table()
+        for col in cols:
+            all_data[col] = reflections[col].select(sel)
         all_data_indices = sel.iselection()
         nexp = flex.max(all_data["id"]) + 1
 
@@ -194,41 +254,44 @@ def __call__(self, reflections):
             header.append("Panel\nid")
         if self.get_block_width() is not None:
             header.append("Block range\n(deg)")
-        header.extend(["Nref", "Nout", "%out"])
+        header.extend(["Nref", "Nout", "%out", "Time\n(s)"])
         rows = []
 
-        # now loop over the lowest level of splits
-        for i, job in enumerate(jobs3):
+        # run the jobs at the lowest level of splits. Each job gets its own
+        # random seed, so that results do not depend on the order in which jobs
+        # are run, nor on the number of processes
+        start_time = time.time()
+        seeds = [self._random_seed + i for i in range(len(jobs3))]
+        if self._nproc > 1 and len(jobs3) > 1:
+            results = easy_mp.parallel_map(
+                func=lambda i: self._run_job(jobs3[i], seeds[i]),
+                iterable=range(len(jobs3)),
+                processes=self._nproc,
+                method="multiprocessing",
+                preserve_exception_message=True,
+            )
+        else:
+            results = [self._run_job(job, seed) for job, seed in zip(jobs3, seeds)]
+        logger.debug(
+            "Outlier detection for {} jobs took {:.2f} s".format(
+                len(jobs3), time.time() - start_time
+            )
+        )
+
+        # now loop over the results of the lowest level of splits
+        for i, (job, (ioutliers, job_time)) in enumerate(zip(jobs3, results)):
 
-            data = job["data"]
-            indices = job["indices"]
             iexp = job["id"]
             ipanel = job["panel"]
-            nref = len(indices)
-
-            if nref >= self._min_num_obs:
+            nref = len(job["indices"])
 
-                # get the subset of data as a list of columns
-                cols = [data[col] for col in self._cols]
-
-                # determine the position of outliers on this sub-dataset
-                outliers = self._detect_outliers(cols)
-
-                # get positions of outliers from the original matches
-                ioutliers = indices.select(outliers)
-
-            elif nref > 0:
+            if 0 < nref < self._min_num_obs:
                 # too few reflections in the job
                 msg = "For job {0}, fewer than {1} reflections are present.".format(
                     i + 1, self._min_num_obs
                 )
                 msg += " All reflections flagged as possible outliers."
                 logger.debug(msg)
-                ioutliers = indices
-
-            else:
-                # no reflections in the job
-                ioutliers = indices
 
             # set the centroid_outlier flag in the original reflection table
             nout = len(ioutliers)
@@ -257,7 +320,7 @@ def __call__(self, reflections):
                         " {1}"
                     ).format(p100, i + 1)
                     logger.debug(msg)
-            row.extend([str(nref), str(nout), "%3.1f" % p100])
+            row.extend([str(nref), str(nout), "%3.1f" % p100, "%.3f" % job_time])
             rows.append(row)
 
         if self.nreject == 0:
@@ -318,6 +381,20 @@ def __call__(self, reflections):
     .type = float(value_min=1.0)
     .expert_level = 1
 
+  nproc = 1
+    .help = "The number of processes over which to spread the outlier"
+            "rejection jobs, which are the blocks of reflections for each"
+            "experiment, panel and phi range."
+    .type = int(value_min=1)
+    .expert_level = 2
+
+  random_seed = 42
+    .help = "The random seed for the first outlier rejection job, which is"
+            "incremented for each further job, so that algorithms using random"
+            "sampling, such as mcd, give the same results for any nproc."
+    .type = int(value_min=0)
+    .expert_level = 2
+
   tukey
     .help = "Options for the tukey outlier rejector"
     .expert_level = 1
@@ -451,6 +528,8 @@ def from_parameters_and_colnames(cls, params, colnames):
             block_width=params.outlier.block_width,
             **kwargs
         )
+        od.set_nproc(params.outlier.nproc)
+        od.set_random_seed(params.outlier.random_seed)
         return od
 
 
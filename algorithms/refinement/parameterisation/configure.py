@@ -860,3 +860,73 @@ def build_prediction_parameterisation(
             )
 
     return pred_param
+
+
+def independent_experiment_groups(options, experiments):
+    """Find groups of experiments that can be refined independently, because
+    they do not share any models that would be refined.
+
+    Params:
+        options: The input parameters for the parameterisation
+        experiments: An ExperimentList object
+
+    Returns:
+        A list of sorted lists of experiment indices, one list for each group.
+        If restraints or constraints link the experiments then a single group
+        containing all the experiments is returned.
+    """
+
+    all_experiments = [list(range(len(experiments)))]
+
+    # restraints and constraints are set up in terms of experiment ids, which may
+    # also link parameters of different models, so do not split the experiments
+    if any(
+        [
+            options.crystal.unit_cell.restraints.tie_to_target,
+            options.crystal.unit_cell.restraints.tie_to_group,
+        ]
+    ):
+        return all_experiments
+    if any(
+        [
+            options.detector.constraints,
+            options.beam.constraints,
+            options.crystal.orientation.constraints,
+            options.crystal.unit_cell.constraints,
+        ]
+    ):
+        return all_experiments
+
+    # models of each type that will have refined parameters
+    refined_models = []
+    if "all" not in options.beam.fix:
+        refined_models.extend(experiments.beams())
+    if options.crystal.fix != "all":
+        refined_models.extend(experiments.crystals())
+    if options.detector.fix != "all":
+        refined_models.extend(experiments.detectors())
+    if "all" not in options.goniometer.fix:
+        refined_models.extend(experiments.goniometers())
+
+    # join the experiments that share each refined model, using a disjoint-set
+    # forest to keep track of the groups
+    parent = list(range(len(experiments)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for model in refined_models:
+        if model is None:
+            continue
+        exp_ids = experiments.indices(model)
+        root = find(exp_ids[0])
+        for i in exp_ids[1:]:
+            parent[find(i)] = root
+
+    groups = {}
+    for i in range(len(experiments)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values())
@@ -132,6 +132,10 @@ def __init__(
             for i, _ in enumerate(experiments)
         }
 
+        # Record of experiments whose models have changed since the last call to
+        # pop_changed_experiment_ids. None indicates that this is not known
+        self._changed_experiment_ids = None
+
     # accessors for the lists of parameterisations of different types
     def get_detector_parameterisations(self):
         return self._detector_parameterisations
@@ -247,8 +251,20 @@ def _set_param_vals_or_esds(self, vals, is_esds=False):
             if is_esds:
                 model.set_param_esds(tmp)
             else:
+                changed = tmp != model.get_param_vals()
+                if changed and self._changed_experiment_ids is not None:
+                    self._changed_experiment_ids.update(model.get_experiment_ids())
                 model.set_param_vals(tmp)
 
+    def pop_changed_experiment_ids(self):
+        """Return the set of ids of experiments for which the parameterised models
+        have changed since the last call to this method, then start a new record.
+        If this is not known (i.e. on the first call) then return None."""
+
+        changed = self._changed_experiment_ids
+        self._changed_experiment_ids = set()
+        return changed
+
     def set_param_vals(self, vals):
         """Set the parameter values of the contained models to the values in
         vals. This list must be of the same length as the result of get_param_vals
@@ -402,10 +402,13 @@ def config_sparse(params, experiments):
                 params.refinement.parameterisation.sparse = True
             else:
                 params.refinement.parameterisation.sparse = False
-            if params.refinement.refinery.engine == "SparseLevMar":
+            if params.refinement.refinery.engine in ("SparseLevMar", "SchurLevMar"):
                 params.refinement.parameterisation.sparse = True
             if params.refinement.mp.nproc > 1:
-                if params.refinement.refinery.engine != "SparseLevMar":
+                if params.refinement.refinery.engine not in (
+                    "SparseLevMar",
+                    "SchurLevMar",
+                ):
                     # sparse vectors cannot be pickled, so can't use easy_mp here
                     params.refinement.parameterisation.sparse = False
                 else:
@@ -558,6 +561,10 @@ def config_refinery(params, target, pred_param, constraints_manager):
             from dials.algorithms.refinement.sparse_engine import (
                 SparseLevenbergMarquardtIterations as refinery,
             )
+        elif options.engine == "SchurLevMar":
+            from dials.algorithms.refinement.schur_engine import (
+                SchurLevenbergMarquardtIterations as refinery,
+            )
         else:
             raise RuntimeError(
                 "Refinement engine " + options.engine + " not recognised"
@@ -0,0 +1,379 @@
+"""Contains a Levenberg-Marquardt refinery for joint refinement of many
+crystals, which solves the normal equations using the Schur complement of the
+block-diagonal part of the normal matrix for the crystal parameters"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+
+import numpy
+
+from dials.algorithms.refinement import DialsRefineConfigError
+from dials.algorithms.refinement import DialsRefineRuntimeError
+from dials.algorithms.refinement.engine import (
+    DisableMPmixin,
+    Refinery,
+    DOF_TOO_LOW,
+    MAX_ITERATIONS,
+    MAX_TRIAL_ITERATIONS,
+    RMSD_CONVERGED,
+    STEP_TOO_SMALL,
+    TARGET_ACHIEVED,
+)
+from scitbx.array_family import flex
+
+logger = logging.getLogger(__name__)
+
+
+class _LocalBlock(object):
+    """The parts of the normal equations for the parameters of one crystal"""
+
+    def __init__(self, indices, n_global, experiment_ids):
+        self.indices = numpy.array(indices)
+        self.experiment_ids = experiment_ids
+        k = len(indices)
+        self.B = numpy.zeros((n_global, k))
+        self.D = numpy.zeros((k, k))
+
+
+class SchurLevenbergMarquardtIterations(DisableMPmixin, Refinery):
+    """Levenberg-Marquardt refinery that exploits the block-arrow structure of
+    the normal matrix in joint refinement of many crystals.
+
+    The parameters of each crystal only affect the reflections of the
+    experiments of that crystal, whereas parameters of the other models
+    (detector, beam and goniometer) are global. The normal matrix then consists
+    of a dense block for the global parameters, a block-diagonal part for the
+    crystal parameters and the coupling between these. Only those parts are
+    stored, and the normal equations are solved by first eliminating the crystal
+    parameters using the Schur complement, so that memory use and time scale
+    linearly with the number of crystals. The sparse Jacobian is calculated in
+    blocks of at most gradient_calculation_blocksize reflections. The rows of
+    each crystal, in blocks of at most row_blocksize rows, are then extracted
+    as a dense matrix of their global and crystal parameter columns only, and
+    contribute to the normal equations with a single matrix product.
+
+    Restraints and constraints are not supported, and as for the
+    SparseLevenbergMarquardtIterations refinery no attempt is made to calculate
+    ESDs of the parameters."""
+
+    tau = 1e-3
+    step_threshold = None
+    row_blocksize = 10000
+
+    def __init__(
+        self,
+        target,
+        prediction_parameterisation,
+        constraints_manager=None,
+        log=None,
+        tracking=None,
+        max_iterations=None,
+    ):
+
+        if constraints_manager is not None:
+            raise DialsRefineConfigError(
+                "Constraints are not supported by the SchurLevMar engine"
+            )
+
+        Refinery.__init__(
+            self,
+            target,
+            prediction_parameterisation,
+            constraints_manager,
+            log=log,
+            tracking=tracking,
+            max_iterations=max_iterations,
+        )
+
+        if target.compute_restraints_residuals_and_gradients() is not None:
+            raise DialsRefineConfigError(
+                "Restraints are not supported by the SchurLevMar engine"
+            )
+
+        # add attributes to the journal
+        self.history.add_column("reduced_chi_squared")
+        self.history.add_column("mu")
+        self.history.add_column("nu")
+
+        self._global_indices, self._blocks = self._partition_parameters()
+        logger.debug(
+            "Partitioned parameters into %d global parameters and %d crystal blocks",
+            len(self._global_indices),
+            len(self._blocks),
+        )
+
+        self._objective = None
+        self._gradient = None
+        self._normal_global = None
+        self._dof = None
+
+    def _partition_parameters(self):
+        """Split the parameter vector into the indices of global parameters, and
+        blocks of local parameters for each crystal"""
+
+        p = self._parameters
+        global_indices = []
+        local_indices = {}
+        i = 0
+        for models, local in (
+            (p.get_detector_parameterisations(), False),
+            (p.get_beam_parameterisations(), False),
+            (p.get_crystal_orientation_parameterisations(), True),
+            (p.get_crystal_unit_cell_parameterisations(), True),
+            (p.get_goniometer_parameterisations(), False),
+        ):
+            for model in models:
+                n = model.num_free()
+                if local:
+                    key = tuple(sorted(model.get_experiment_ids()))
+                    local_indices.setdefault(key, []).extend(range(i, i + n))
+                else:
+                    global_indices.extend(range(i, i + n))
+                i += n
+
+        n_global = len(global_indices)
+        blocks = [
+            _LocalBlock(local_indices[key], n_global, key)
+            for key in sorted(local_indices)
+        ]
+        return numpy.array(global_indices, dtype=int), blocks
+
+    def build_up(self, objective_only=False):
+        """Calculate the objective and, unless objective_only is True, the parts
+        of the normal equations at the current parameter values"""
+
+        # set current parameter values
+        self.prepare_for_step()
+
+        if objective_only:
+            residuals, weights = self._target.compute_residuals()
+            self._objective = 0.5 * flex.sum(weights * residuals * residuals)
+            return
+
+        n_global = len(self._global_indices)
+        normal_global = numpy.zeros((n_global, n_global))
+        gradient = numpy.zeros(len(self.x))
+        for block in self._blocks:
+            block.B[:] = 0
+            block.D[:] = 0
+
+        # experiments without crystal parameters form a last group of residuals
+        # that only depend on the global parameters
+        groups = self._blocks + [None]
+        experiment_ids = [i for block in self._blocks for i in block.experiment_ids]
+        group_ids = [i for i, b in enumerate(self._blocks) for _ in b.experiment_ids]
+
+        objective = 0.0
+        n_equations = 0
+        for matches in self._target.split_matches_into_blocks(nproc=1):
+            residuals, jacobian, weights = self._target.compute_residuals_and_gradients(
+                matches
+            )
+            objective += 0.5 * flex.sum(weights * residuals * residuals)
+            n_equations += len(residuals)
+            residuals = residuals.as_numpy_array()
+            weights = weights.as_numpy_array()
+
+            # the rows of the Jacobian are the columns of its transpose
+            jacobian_t = jacobian.transpose()
+
+            # the residuals are ordered by dimension (X, Y and, for scans, phi),
+            # with one row per reflection for each dimension
+            ids = matches["id"].as_numpy_array()
+            ids = numpy.tile(ids, len(residuals) // len(ids))
+            group_of_experiment = numpy.full(
+                max([ids.max()] + experiment_ids) + 1, len(self._blocks), dtype=int
+            )
+            group_of_experiment[experiment_ids] = group_ids
+            group_of_row = group_of_experiment[ids]
+            order = numpy.argsort(group_of_row, kind="stable")
+            bounds = numpy.searchsorted(
+                group_of_row[order], numpy.arange(len(groups) + 1)
+            )
+
+            for i_group, block in enumerate(groups):
+                if block is None:
+                    cols = self._global_indices
+                else:
+                    cols = numpy.concatenate([self._global_indices, block.indices])
+                flex_cols = flex.size_t(cols.tolist())
+                for start in range(
+                    bounds[i_group], bounds[i_group + 1], self.row_blocksize
+                ):
+                    end = min(start + self.row_blocksize, bounds[i_group + 1])
+                    rows = order[start:end]
+                    a = (
+                        jacobian_t.select_columns(flex.size_t(rows.tolist()))
+                        .transpose()
+                        .select_columns(flex_cols)
+                        .as_dense_matrix()
+                        .as_numpy_array()
+                        .reshape(len(rows), len(cols))
+                    )
+                    w_a_t = a.T * weights[rows]
+                    normal = numpy.dot(w_a_t, a)
+                    gradient[cols] += numpy.dot(w_a_t, residuals[rows])
+                    normal_global += normal[:n_global, :n_global]
+                    if block is not None:
+                        block.B += normal[:n_global, n_global:]
+                        block.D += normal[n_global:, n_global:]
+
+        self._objective = objective
+        self._gradient = gradient
+        self._normal_global = normal_global
+        self._dof = n_equations - len(self.x)
+
+    def solve(self, mu):
+        """Solve the damped normal equations (N + mu I) h = -g for the step h,
+        eliminating the crystal parameters using the Schur complement"""
+
+        n_global = len(self._global_indices)
+        rhs = -self._gradient
+        schur = self._normal_global + mu * numpy.identity(n_global)
+        rhs_global = rhs[self._global_indices]
+
+        try:
+            inverses = []
+            for block in self._blocks:
+                d_inv = numpy.linalg.inv(block.D + mu * numpy.identity(len(block.D)))
+                b_d_inv = numpy.dot(block.B, d_inv)
+                schur -= numpy.dot(b_d_inv, block.B.T)
+                rhs_global -= numpy.dot(b_d_inv, rhs[block.indices])
+                inverses.append(d_inv)
+
+            step = numpy.zeros(len(self.x))
+            if n_global:
+                step[self._global_indices] = numpy.linalg.solve(schur, rhs_global)
+            step_global = step[self._global_indices]
+            for block, d_inv in zip(self._blocks, inverses):
+                step[block.indices] = numpy.dot(
+                    d_inv, rhs[block.indices] - numpy.dot(block.B.T, step_global)
+                )
+        except numpy.linalg.LinAlgError:
+            raise DialsRefineRuntimeError(
+                "The normal equations are singular, so the parameters are not all "
+                "independent and there is no unique solution."
+            )
+        return step
+
+    def max_diagonal(self):
+        """Return the largest diagonal element of the normal matrix"""
+
+        diagonals = [numpy.diag(self._normal_global)]
+        diagonals.extend(numpy.diag(block.D) for block in self._blocks)
+        return max(d.max() for d in diagonals if len(d))
+
+    def step_forward(self, step):
+        self.old_x = self.x.deep_copy()
+        self.x += flex.double(step)
+
+    def step_backward(self):
+        if self.old_x is None:
+            return False
+        else:
+            self.x, self.old_x = self.old_x, None
+            return True
+
+    def had_too_small_a_step(self, step):
+        if self.step_threshold is None:
+            return False
+        step_norm = numpy.linalg.norm(step)
+        x_norm = self.x.norm()
+        return step_norm <= self.step_threshold * (x_norm + self.step_threshold)
+
+    def run(self):
+
+        # set max iterations if not already.
+        if self._max_iterations is None:
+            self._max_iterations = 100
+
+        self.n_iterations = 0
+        nu = 2
+        self.build_up()
+
+        # early test for linear independence
+        if (self._gradient == 0.0).any():
+            raise DialsRefineRuntimeError(
+                "There is at least one normal equation with a right hand side of "
+                "zero, meaning that the parameters are not all independent, and "
+                "there is no unique solution."
+            )
+
+        # return early if refinement is not possible
+        if self._dof < 1:
+            self.history.reason_for_termination = DOF_TOO_LOW
+            return
+
+        self.mu = self.tau * self.max_diagonal()
+
+        while True:
+
+            # set functional and gradients for the step
+            self._f = self._objective
+            self._g = flex.double(self._gradient)
+
+            # cache some items for the journal prior to solve
+            pvn = self.x.norm()
+            gn = flex.max(flex.abs(self._g))
+
+            # solve the normal equations
+            h = self.solve(self.mu)
+
+            # standard journalling
+            self.update_journal()
+            logger.debug("Step %d", self.history.get_nrows() - 1)
+
+            # add cached items to the journal
+            self.history.set_last_cell("parameter_vector_norm", pvn)
+            self.history.set_last_cell("gradient_norm", gn)
+
+            # extra journalling post solve
+            self.history.set_last_cell("mu", self.mu)
+            self.history.set_last_cell("nu", nu)
+            if "solution" in self.history:
+                self.history.set_last_cell("solution", flex.double(h))
+            self.history.set_last_cell("solution_norm", numpy.linalg.norm(h))
+            self.history.set_last_cell(
+                "reduced_chi_squared", 2 * self._objective / self._dof
+            )
+
+            # test termination criteria before taking the next forward step
+            if self.had_too_small_a_step(h):
+                self.history.reason_for_termination = STEP_TOO_SMALL
+                break
+            if self.test_for_termination():
+                self.history.reason_for_termination = TARGET_ACHIEVED
+                break
+            if self.test_rmsd_convergence():
+                self.history.reason_for_termination = RMSD_CONVERGED
+                break
+            if self.n_iterations == self._max_iterations:
+                self.history.reason_for_termination = MAX_ITERATIONS
+                break
+
+            expected_decrease = 0.5 * numpy.dot(h, self.mu * h - self._gradient)
+            self.step_forward(h)
+            self.n_iterations += 1
+            self.build_up(objective_only=True)
+            objective_new = self._objective
+            logger.debug(
+                "Iteration: %5d Objective: %18.4f Mu: %12.7f"
+                % (self.n_iterations, objective_new, self.mu)
+            )
+            actual_decrease = self._f - objective_new
+            rho = actual_decrease / expected_decrease
+            if rho > 0:
+                self.mu *= max(1 / 3, 1 - (2 * rho - 1) ** 3)
+                nu = 2
+            else:
+                self.step_backward()
+                self.history.del_last_row()
+                if nu >= 8192:
+                    self.history.reason_for_termination = MAX_TRIAL_ITERATIONS
+                    break
+                self.mu *= nu
+                nu *= 2
+
+            # prepare for next step
+            self.build_up()
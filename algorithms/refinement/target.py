@@ -48,6 +48,14 @@
               "If there are more reflections than this in the manager then"
               "the minimiser must do the full calculation in blocks."
       .type = int(value_min=1)
+
+    incremental_prediction = False
+      .help = "At each step of refinement, only repeat reflection prediction"
+              "for experiments with models that have changed since the last"
+              "step. This can save a lot of time in joint refinement of many"
+              "experiments where most of the models are independent. Not"
+              "available for scan-varying refinement."
+      .type = bool
 """
 phil_scope = parse(phil_str)
 
@@ -118,6 +126,7 @@ def from_parameters_and_experiments(
             frac_binsize_cutoff=params.bin_size_fraction,
             absolute_cutoffs=absolute_cutoffs,
             gradient_calculation_blocksize=params.gradient_calculation_blocksize,
+            incremental_prediction=params.incremental_prediction,
         )
 
 
@@ -154,6 +163,7 @@ def __init__(
         prediction_parameterisation,
         restraints_parameterisation=None,
         gradient_calculation_blocksize=None,
+        incremental_prediction=False,
     ):
 
         self._experiments = experiments
@@ -170,6 +180,10 @@ def __init__(
         # a cutoff is required
         self._gradient_calculation_blocksize = gradient_calculation_blocksize
 
+        # Keep the reflections last predicted for, to allow incremental prediction
+        self._incremental_prediction = incremental_prediction
+        self._predicted_obs = None
+
     @property
     def dim(self):
         """Get the number of dimensions of the target function"""
@@ -209,19 +223,54 @@ def predict(self):
         # get the matches
         reflections = self._reflection_manager.get_obs()
 
-        # reset the 'use' flag for all observations
-        self._reflection_manager.reset_accepted_reflections()
-
-        # predict
-        reflections = self._predict_core(reflections)
-
-        # set used_in_refinement flag to all those that had predictions
-        mask = reflections.get_flags(reflections.flags.predicted)
-        reflections.set_flags(mask, reflections.flags.used_in_refinement)
+        changed = self._changed_experiment_ids(reflections)
+        if changed is None:
+            # reset the 'use' flag for all observations
+            self._reflection_manager.reset_accepted_reflections()
+
+            # predict
+            reflections = self._predict_core(reflections)
+
+            # set used_in_refinement flag to all those that had predictions
+            mask = reflections.get_flags(reflections.flags.predicted)
+            reflections.set_flags(mask, reflections.flags.used_in_refinement)
+
+        elif changed:
+            # as above, but only for the reflections of the changed experiments,
+            # keeping the predictions from the last step for all the others
+            sel = flex.bool(len(reflections), False)
+            for iexp in changed:
+                sel |= reflections["id"] == iexp
+            subset = reflections.select(sel)
+            self._reflection_manager.reset_accepted_reflections(subset)
+            subset = self._predict_core(subset)
+            mask = subset.get_flags(subset.flags.predicted)
+            subset.set_flags(mask, subset.flags.used_in_refinement)
+            reflections.set_selected(sel, subset)
 
         # collect the matches
         self.update_matches(force=True)
 
+    def _changed_experiment_ids(self, reflections):
+        """Return the ids of experiments that need new predictions for the
+        reflections, or None if all predictions must be recalculated"""
+
+        if not self._incremental_prediction:
+            return None
+
+        # scan-varying models are composed for the whole reflection table at once
+        if hasattr(self._prediction_parameterisation, "compose"):
+            return None
+
+        changed = self._prediction_parameterisation.pop_changed_experiment_ids()
+
+        # predictions can only be reused for the same table of observations
+        if reflections is not self._predicted_obs:
+            changed = None
+        self._predicted_obs = reflections
+
+        return changed
+
     def predict_for_free_reflections(self):
         """perform prediction for the reflections not used for refinement"""
 
@@ -335,6 +384,9 @@ def compute_functional_gradients_and_curvatures(self, block=None):
         # calculate target function
         L = 0.5 * flex.sum(weights * residuals2)
 
+        # arrange the weighted residuals and weights to match the gradients
+        w_resid, weights = self._split_by_residual_type(w_resid, weights, nref)
+
         def process_one_gradient(result):
             # copy gradients out of the result in the right order
             grads = [result[key] for key in self._grad_names]
@@ -344,9 +396,9 @@ def process_one_gradient(result):
                 result[k] = None
 
             # add new keys
-            grads = self._concatenate_gradients(grads)
-            result["dL_dp"] = flex.sum(w_resid * grads)
-            result["curvature"] = flex.sum(weights * grads * grads)
+            result["dL_dp"], result["curvature"] = self._gradient_and_curvature(
+                grads, w_resid, weights
+            )
             return result
 
         results = self.calculate_gradients(matches, callback=process_one_gradient)
@@ -505,6 +557,24 @@ def _concatenate_gradients(grads):
             result.extend(g)
         return result
 
+    @staticmethod
+    def _split_by_residual_type(w_resid, weights, nref):
+        """arrange the weighted residuals and weights in the form expected by
+        _gradient_and_curvature. This method may be overridden for the case where
+        the gradient vectors use sparse storage"""
+
+        return w_resid, weights
+
+    @classmethod
+    def _gradient_and_curvature(cls, grads, w_resid, weights):
+        """calculate the gradient of the target function and the least squares
+        approximation to the curvature for one parameter from the gradients of
+        each type of residual. This method may be overridden for the case where
+        these vectors use sparse storage"""
+
+        grads = cls._concatenate_gradients(grads)
+        return flex.sum(w_resid * grads), flex.sum(weights * grads * grads)
+
     @staticmethod
     @abc.abstractmethod
     def _extract_residuals_and_weights(matches):
@@ -588,6 +658,7 @@ def __init__(
         frac_binsize_cutoff=0.33333,
         absolute_cutoffs=None,
         gradient_calculation_blocksize=None,
+        incremental_prediction=False,
     ):
 
         Target.__init__(
@@ -598,6 +669,7 @@ def __init__(
             prediction_parameterisation,
             restraints_parameterisation,
             gradient_calculation_blocksize,
+            incremental_prediction,
         )
 
         # Set up the RMSD achieved criterion. For simplicity, we take models from
@@ -708,6 +780,30 @@ def _concatenate_gradients(grads):
             result.extend(g.as_dense_vector())
         return result
 
+    @staticmethod
+    def _split_by_residual_type(w_resid, weights, nref):
+        """split the weighted residuals and weights into separate vectors for
+        each type of residual, to match the sparse gradient vectors."""
+
+        ndim = len(w_resid) // nref
+        w_resid = [w_resid[i * nref : (i + 1) * nref] for i in range(ndim)]
+        weights = [weights[i * nref : (i + 1) * nref] for i in range(ndim)]
+        return w_resid, weights
+
+    @classmethod
+    def _gradient_and_curvature(cls, grads, w_resid, weights):
+        """calculate the gradient and curvature for one parameter directly from
+        the sparse gradient vectors, without expanding these to dense vectors.
+        The cost is then proportional to the number of non-zero elements, which
+        is small for parameters that affect only one of many experiments."""
+
+        dL_dp = 0.0
+        curvature = 0.0
+        for g, wr, w in zip(grads, w_resid, weights):
+            dL_dp += g * wr
+            curvature += sparse.weighted_dot(g, w, g)
+        return dL_dp, curvature
+
 
 class LeastSquaresPositionalResidualWithRmsdCutoffSparse(
     SparseGradientsMixin, LeastSquaresPositionalResidualWithRmsdCutoff
@@ -39,6 +39,7 @@ def __init__(
         frac_binsize_cutoff=0.33333,
         absolute_cutoffs=None,
         gradient_calculation_blocksize=None,
+        incremental_prediction=False,
     ):
 
         Target.__init__(
@@ -49,6 +50,7 @@ def __init__(
             prediction_parameterisation,
             restraints_parameterisation,
             gradient_calculation_blocksize,
+            incremental_prediction,
         )
 
         # Set up the RMSD achieved criterion. For simplicity, we take models from
@@ -6,10 +6,11 @@
 """
 from __future__ import absolute_import, division, print_function
 
+import numpy
 from orderedset import OrderedSet
 from dials.array_family import flex
 from cctbx import miller, crystal, uctbx
-from scitbx import sparse
+from dials_scaling_ext import create_h_index_matrix
 
 
 def map_indices_to_asu(miller_indices, space_group):
@@ -59,9 +60,6 @@ class IhTable(object):
             list for block i, dataset j.
         n_datasets: The number of input reflection tables used to make the Ih_table.
         size: The number of reflections across all blocks
-        asu_index_dict (dict): A dictionary, key: asu_miller_index, value tuple
-            containing group_id and block_id (where group id is the group index
-            within its block).
 
     """
 
@@ -94,7 +92,6 @@ def __init__(
         """
         if indices_lists:
             assert len(indices_lists) == len(reflection_tables)
-        self.asu_index_dict = {}
         self.space_group = space_group
         self.n_work_blocks = nblocks
         self.n_datasets = len(reflection_tables)
@@ -103,7 +100,6 @@ def __init__(
         self.properties_dict = {
             "n_unique_in_each_block": [],
             "n_reflections_in_each_block": {},
-            "miller_index_boundaries": [],
         }
         self._determine_required_block_structures(reflection_tables, self.n_work_blocks)
         self._create_empty_Ih_table_blocks()
@@ -214,7 +210,7 @@ def _determine_required_block_structures(self, reflection_tables, nblocks=1):
         Inspect the input to determine how to split into blocks.
 
         Extract the asu miller indices from the reflection table and
-        add data to the asu_index_dict and properties dict.
+        add data to the properties dict.
         """
         joint_asu_indices = flex.miller_index()
         for table in reflection_tables:
@@ -227,47 +223,36 @@ def _determine_required_block_structures(self, reflection_tables, nblocks=1):
             joint_asu_indices, self.space_group
         )
 
-        asu_index_set = OrderedSet(sorted_joint_asu_indices)
-        n_unique_groups = len(asu_index_set)
-        # also record how many unique groups go into each block
+        # The asu indices are sorted by their packed values, so record the sorted
+        # unique packed values and the group boundaries of the blocks, to look up
+        # the group and block of many reflections at once.
+        self._index_span = miller.index_span(sorted_joint_asu_indices)
+        self._unique_packed_indices = numpy.unique(
+            self._index_span.pack(sorted_joint_asu_indices).as_numpy_array()
+        )
+        n_unique_groups = len(self._unique_packed_indices)
         group_boundaries = [int(i * n_unique_groups / nblocks) for i in range(nblocks)]
         group_boundaries.append(n_unique_groups)
+        self._group_boundaries = numpy.array(group_boundaries)
 
-        next_boundary = group_boundaries[1]
-        block_id = 0
-        group_id_in_block_i = 0
-        for i, index in enumerate(asu_index_set):
-            if i == next_boundary:
-                self.properties_dict["n_unique_in_each_block"].append(
-                    group_id_in_block_i
-                )
-                self.properties_dict["miller_index_boundaries"].append(index)
-                block_id += 1
-                next_boundary = group_boundaries[block_id + 1]
-                group_id_in_block_i = 0
-            self.asu_index_dict[index] = (group_id_in_block_i, block_id)
-            group_id_in_block_i += 1
-        # record the number in the last block
-        self.properties_dict["n_unique_in_each_block"].append(group_id_in_block_i)
-        self.properties_dict["miller_index_boundaries"].append((10000, 10000, 10000))
-        # ^ to avoid bounds checking when in last group
-        # need to know how many reflections will be in each block also
-
-        block_id = 0
-        idx_prev = 0
-        boundary = self.properties_dict["miller_index_boundaries"][0]
-        for i, index in enumerate(sorted_joint_asu_indices):
-            if index == boundary:
-                n_in_prev_group = i - idx_prev
-                self.properties_dict["n_reflections_in_each_block"][
-                    block_id
-                ] = n_in_prev_group
-                block_id += 1
-                boundary = self.properties_dict["miller_index_boundaries"][block_id]
-                idx_prev = i
-        self.properties_dict["n_reflections_in_each_block"][block_id] = (
-            len(sorted_joint_asu_indices) - idx_prev
+        # record how many unique groups and reflections go into each block
+        self.properties_dict["n_unique_in_each_block"] = [
+            int(n) for n in numpy.diff(self._group_boundaries)
+        ]
+        _, block_ids = self._group_and_block_ids(sorted_joint_asu_indices)
+        n_reflections = numpy.bincount(block_ids, minlength=nblocks)
+        for block_id, n in enumerate(n_reflections):
+            self.properties_dict["n_reflections_in_each_block"][block_id] = int(n)
+
+    def _group_and_block_ids(self, asu_indices):
+        """Return the group ids within their blocks and the block ids of the asu
+        indices, as numpy arrays."""
+        packed = self._index_span.pack(asu_indices).as_numpy_array()
+        positions = numpy.searchsorted(self._unique_packed_indices, packed)
+        block_ids = (
+            numpy.searchsorted(self._group_boundaries, positions, side="right") - 1
         )
+        return positions - self._group_boundaries[block_ids], block_ids
 
     def _create_empty_Ih_table_blocks(self):
         for n in range(self.n_work_blocks):
@@ -302,25 +287,12 @@ def _add_dataset_to_blocks(
             r["loc_indices"] = flex.size_t(range(r.size()))
         r = r.select(perm)
         r["dataset_id"] = flex.int(r.size(), dataset_id)
-        # if data are sorted by asu_index, then up until boundary, should be in same
-        # block (still need to read group_id though)
-
-        # sort data, get group ids and block_ids
-        group_ids = flex.int([])
-        boundary = self.properties_dict["miller_index_boundaries"][0]
-        boundary_id = 0
-        boundaries_for_this_datset = [0]  # use to slice
-        # make this a c++ method for speed?
-        for i, index in enumerate(sorted_asu_indices):
-            while index >= boundary:
-                boundaries_for_this_datset.append(i)
-                boundary_id += 1
-                boundary = self.properties_dict["miller_index_boundaries"][boundary_id]
-            group_id, _ = self.asu_index_dict[index]
-            group_ids.append(group_id)
-        while len(boundaries_for_this_datset) < self.n_work_blocks + 1:
-            # catch case where last boundaries aren't reached
-            boundaries_for_this_datset.append(len(sorted_asu_indices))
+        # the data are sorted by asu index, so the block ids are in order
+        group_ids, block_ids = self._group_and_block_ids(sorted_asu_indices)
+        group_ids = flex.int(group_ids.astype(numpy.int32))
+        boundaries_for_this_datset = numpy.searchsorted(
+            block_ids, numpy.arange(self.n_work_blocks + 1)
+        ).tolist()
         # so now have group ids as well for individual dataset
         if self.n_work_blocks == 1:
             self.Ih_table_blocks[0].add_data(dataset_id, group_ids, r)
@@ -339,7 +311,7 @@ def extract_free_set(self, free_set_percentage, offset=0):
         free_reflection_table = flex.reflection_table()
         free_indices = flex.size_t()
         for j, block in enumerate(self.Ih_table_blocks):
-            n_groups = block.h_index_matrix.n_cols
+            n_groups = block.n_groups
             groups_for_free_set = flex.bool(n_groups, False)
             for_free = flex.size_t(
                 [i for i in range(0 + offset, n_groups, interval_between_groups)]
@@ -409,9 +381,10 @@ class IhTableBlock(object):
     A datastructure for efficient summations over symmetry equivalent reflections.
 
     This contains a reflection table, sorted by dataset, called the Ih_table,
-    a h_index_matrix (sparse) for efficiently calculating sums over symmetry
-    equivalent reflections as well as 'block_selections' which relate the order
-    of the data to the initial reflection tables used to initialise the (master)
+    the index of the group of symmetry equivalent reflections for each
+    reflection, for efficiently calculating sums over symmetry equivalent
+    reflections, as well as 'block_selections' which relate the order of the
+    data to the initial reflection tables used to initialise the (master)
     IhTable.
 
     Attributes:
@@ -420,10 +393,14 @@ class IhTableBlock(object):
         block_selections: A list of flex.size_t arrays of indices, that can be
             used to select and reorder data from the input reflection tables to
             match the order in the Ih_table.
+        group_index: A flex.int array of the group of symmetry equivalent
+            reflections to which each reflection belongs.
+        n_groups: The number of groups of symmetry equivalent reflections.
         h_index_matrix: A sparse matrix used to sum over groups of equivalent
             reflections by multiplication. Sum_h I = I * h_index_matrix. The
             dimension is n_refl by n_groups; each row has a single nonzero
-            entry with a value of 1.
+            entry with a value of 1. This is created from the group_index
+            when first needed.
         h_expand_matrix: The transpose of the h_index_matrix, used to expand an
             array of values for symmetry groups into an array of size n_refl.
         derivatives: A matrix of derivatives of the reflections wrt the model
@@ -435,11 +412,14 @@ def __init__(self, n_groups, n_refl, n_datasets=1):
         """Create empty datastructures to which data can later be added."""
         self.Ih_table = flex.reflection_table()
         self.block_selections = [None] * n_datasets
-        self.h_index_matrix = sparse.matrix(n_refl, n_groups)
+        self.group_index = flex.int()
+        self.n_groups = n_groups
+        self._n_refl = n_refl
+        self._h_index_matrix = None
+        self._h_expand_matrix = None
         self._setup_info = {"next_row": 0, "next_dataset": 0, "setup_complete": False}
         self.dataset_info = {}
         self.n_datasets = n_datasets
-        self.h_expand_matrix = None
         self.derivatives = None
         self.binner = None
 
@@ -447,7 +427,7 @@ def add_data(self, dataset_id, group_ids, reflections):
         """
         Add data to all blocks for a given dataset.
 
-        Add data to the Ih_table, write data to the h_index_matrix and
+        Add data to the Ih_table, add the group ids to the group_index and
         add the loc indices to the block_selections list.
         """
         assert not self._setup_info[
@@ -455,7 +435,7 @@ def add_data(self, dataset_id, group_ids, reflections):
         ], """
 No further data can be added to the IhTableBlock as setup marked complete."""
         assert (
-            self._setup_info["next_row"] + len(group_ids) <= self.h_index_matrix.n_rows
+            self._setup_info["next_row"] + len(group_ids) <= self._n_refl
         ), """
 Not enough space left to add this data, please check for correct block initialisation."""
         assert (
@@ -466,8 +446,7 @@ def add_data(self, dataset_id, group_ids, reflections):
             dataset_id,
         )
         assert "asu_miller_index" in reflections
-        for i, id_ in enumerate(group_ids):
-            self.h_index_matrix[i + self._setup_info["next_row"], id_] = 1.0
+        self.group_index.extend(group_ids)
         self.dataset_info[dataset_id] = {"start_index": self._setup_info["next_row"]}
         self._setup_info["next_row"] += len(group_ids)
         self._setup_info["next_dataset"] += 1
@@ -482,28 +461,29 @@ def add_data(self, dataset_id, group_ids, reflections):
 
     def _complete_setup(self):
         """Finish the setup of the Ih_table once all data has been added."""
-        self.h_index_matrix.compact()
         assert (
-            self._setup_info["next_row"] == self.h_index_matrix.n_rows
+            self._setup_info["next_row"] == self._n_refl
         ), """
-Not all rows of h_index_matrix appear to be filled in IhTableBlock setup."""
-        self.h_expand_matrix = self.h_index_matrix.transpose()
+Not all rows of the Ih_table appear to be filled in IhTableBlock setup."""
+        if self.group_index.size():
+            assert flex.min(self.group_index) >= 0
+            assert flex.max(self.group_index) < self.n_groups
         self.Ih_table["weights"] = 1.0 / self.Ih_table["variance"]
         self._setup_info["setup_complete"] = True
 
     def select(self, sel):
         """Select a subset of the data, returning a new IhTableBlock object."""
         Ih_table = self.Ih_table.select(sel)
-        h_idx_sel = self.h_expand_matrix.select_columns(sel.iselection())
-        reduced_h_idx = h_idx_sel.transpose()
-        unity = flex.double(reduced_h_idx.n_rows, 1.0)
-        nz_col_sel = (unity * reduced_h_idx) > 0
-        h_index_matrix = reduced_h_idx.select_columns(nz_col_sel.iselection())
-        h_expand = h_index_matrix.transpose()
+        # renumber the groups that still contain reflections, keeping their order
+        group_index = self.group_index.select(sel).as_numpy_array()
+        n_in_group = numpy.bincount(group_index, minlength=self.n_groups)
+        new_group_index = numpy.cumsum(n_in_group > 0) - 1
         newtable = IhTableBlock(n_groups=0, n_refl=0, n_datasets=self.n_datasets)
         newtable.Ih_table = Ih_table
-        newtable.h_expand_matrix = h_expand
-        newtable.h_index_matrix = h_index_matrix
+        newtable.group_index = flex.int(
+            new_group_index[group_index].astype(numpy.int32)
+        )
+        newtable.n_groups = int(numpy.count_nonzero(n_in_group))
         newtable.block_selections = []
         offset = 0
         for i in range(newtable.n_datasets):
@@ -519,27 +499,40 @@ def select(self, sel):
 
     def select_on_groups(self, sel):
         """Select a subset of the unique groups, returning a new IhTableBlock."""
-        reduced_h_idx = self.h_index_matrix.select_columns(sel.iselection())
-        unity = flex.double(reduced_h_idx.n_cols, 1.0)
-        nz_row_sel = (unity * reduced_h_idx.transpose()) > 0
-        return self.select(nz_row_sel)
+        group_sel = sel.as_numpy_array()[self.group_index.as_numpy_array()]
+        return self.select(flex.bool(group_sel))
 
     def select_on_groups_isel(self, isel):
         """Select a subset of the unique groups, returning a new IhTableBlock."""
-        reduced_h_idx = self.h_index_matrix.select_columns(isel)
-        unity = flex.double(reduced_h_idx.n_cols, 1.0)
-        nz_row_sel = (unity * reduced_h_idx.transpose()) > 0
-        return self.select(nz_row_sel)
+        sel = flex.bool(self.n_groups, False)
+        sel.set_selected(isel, True)
+        return self.select_on_groups(sel)
+
+    def sum_in_groups(self, values):
+        """Sum an array of values for each reflection over each group."""
+        return flex.double(
+            numpy.bincount(
+                self.group_index.as_numpy_array(),
+                weights=values.as_numpy_array(),
+                minlength=self.n_groups,
+            )
+        )
+
+    def expand_to_reflections(self, group_values):
+        """Expand an array of values for each group to each reflection."""
+        return flex.double(
+            group_values.as_numpy_array()[self.group_index.as_numpy_array()]
+        )
 
     def calc_Ih(self):
         """Calculate the current best estimate for Ih for each reflection group."""
         scale_factors = self.Ih_table["inverse_scale_factor"]
         gsq = (scale_factors ** 2) * self.Ih_table["weights"]
-        sumgsq = gsq * self.h_index_matrix
+        sumgsq = self.sum_in_groups(gsq)
         gI = (scale_factors * self.Ih_table["intensity"]) * self.Ih_table["weights"]
-        sumgI = gI * self.h_index_matrix
+        sumgI = self.sum_in_groups(gI)
         Ih = sumgI / sumgsq
-        self.Ih_table["Ih_values"] = Ih * self.h_expand_matrix
+        self.Ih_table["Ih_values"] = self.expand_to_reflections(Ih)
 
     def update_error_model(self, error_model):
         """Update the scaling weights based on an error model."""
@@ -556,9 +549,9 @@ def calc_nh(self):
         """Calculate the number of refls in the group to which the reflection belongs.
 
         This is a vector of length n_refl."""
-        return (
-            flex.double(self.size, 1.0) * self.h_index_matrix
-        ) * self.h_expand_matrix
+        return self.expand_to_reflections(
+            self.sum_in_groups(flex.double(self.size, 1.0))
+        )
 
     def match_Ih_values_to_target(self, target_Ih_table):
         """
@@ -580,8 +573,11 @@ def match_Ih_values_to_target(self, target_Ih_table):
         sorted_asu_indices, permuted = get_sorted_asu_indices(
             self.Ih_table["asu_miller_index"], target_Ih_table.space_group
         )
+        n_in_groups = numpy.bincount(
+            self.group_index.as_numpy_array(), minlength=self.n_groups
+        )
         for j, miller_idx in enumerate(OrderedSet(sorted_asu_indices)):
-            n_in_group = self.h_index_matrix.col(j).non_zeroes
+            n_in_group = int(n_in_groups[j])
             if miller_idx in target_asu_Ih_dict:
                 i = location_in_unscaled_array
                 new_Ih_values.set_selected(
@@ -594,10 +590,28 @@ def match_Ih_values_to_target(self, target_Ih_table):
         new_table = self.select(sel)
         # now set attributes to update object
         self.Ih_table = new_table.Ih_table
-        self.h_index_matrix = new_table.h_index_matrix
-        self.h_expand_matrix = new_table.h_expand_matrix
+        self.group_index = new_table.group_index
+        self.n_groups = new_table.n_groups
+        self._h_index_matrix = None
+        self._h_expand_matrix = None
         self.block_selections = new_table.block_selections
 
+    @property
+    def h_index_matrix(self):
+        """The sparse matrix for summing over groups of equivalent reflections."""
+        if self._h_index_matrix is None:
+            self._h_index_matrix = create_h_index_matrix(
+                self.group_index, self.n_groups
+            )
+        return self._h_index_matrix
+
+    @property
+    def h_expand_matrix(self):
+        """The sparse matrix for expanding group values to each reflection."""
+        if self._h_expand_matrix is None:
+            self._h_expand_matrix = self.h_index_matrix.transpose()
+        return self._h_expand_matrix
+
     @property
     def inverse_scale_factors(self):
         """The inverse scale factors of the reflections."""
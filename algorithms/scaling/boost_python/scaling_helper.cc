@@ -35,6 +35,22 @@ namespace dials_scaling { namespace boost_python {
          arg("sumgsq")));
   }
 
+  void export_create_h_index_matrix() {
+    def("create_h_index_matrix",
+        &create_h_index_matrix,
+        (arg("group_index"), arg("n_groups")));
+  }
+
+  void export_sparse_matrix_as_triplets() {
+    def("sparse_matrix_as_triplets", &sparse_matrix_as_triplets, (arg("m")));
+  }
+
+  void export_sparse_matrix_from_triplets() {
+    def("sparse_matrix_from_triplets",
+        &sparse_matrix_from_triplets,
+        (arg("n_rows"), arg("n_cols"), arg("rows"), arg("cols"), arg("values")));
+  }
+
   void export_sph_harm_table() {
     def("create_sph_harm_table",
         &create_sph_harm_table,
@@ -28,6 +28,9 @@
   parameter_values=      (values to test, only optional if parameter= selectes a
                           boolean command-line parameter)
 
+The runs for each fold and option are independent, so with nproc > 1 they are
+run in parallel processes, up to nproc at a time.
+
 For example
 cross_validation_mode=multi parameter=absorption_term
 cross_validation_mode=multi parameter=decay_interval parameter_values="5.0 10.0 15.0"
@@ -36,6 +39,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+import copy
 import logging
 import itertools
 import time
@@ -75,6 +79,11 @@
               "allowed is 1/free_set_percentage; if set greater than this then"
               "the repetition will finish afer 1/free_set_percentage folds."
       .expert_level = 2
+    nproc = 1
+      .type = int(value_min=1)
+      .help = "Number of processes to use to run the independent dials.scale "
+              "jobs for each fold and parameter value in parallel."
+      .expert_level = 2
   }
 """
 )
@@ -86,6 +95,8 @@ def cross_validate(params, cross_validator):
     start_time = time.time()
     free_set_percentage = cross_validator.get_free_set_percentage(params)
     options_dict = {}
+    # a list of (params, config_no) for each run of the script
+    jobs = []
 
     if params.cross_validation.cross_validation_mode == "single":
         # just run the setup nfolds times
@@ -93,7 +104,7 @@ def cross_validate(params, cross_validator):
         for n in range(params.cross_validation.nfolds):
             if n < 100.0 / free_set_percentage:
                 params = cross_validator.set_free_set_offset(params, n)
-                cross_validator.run_script(params, config_no=0)
+                jobs.append((copy.deepcopy(params), 0))
 
     elif params.cross_validation.cross_validation_mode == "multi":
         # run each option nfolds times
@@ -154,11 +165,13 @@ def cross_validate(params, cross_validator):
             for n in range(params.cross_validation.nfolds):
                 if n < 100.0 / free_set_percentage:
                     params = cross_validator.set_free_set_offset(params, n)
-                    cross_validator.run_script(params, config_no=i)
+                    jobs.append((copy.deepcopy(params), i))
 
     else:
         raise ValueError("Error in interpreting mode and options.")
 
+    cross_validator.run_scripts(jobs, nproc=params.cross_validation.nproc)
+
     st = cross_validator.interpret_results()
     logger.info("Summary of the cross validation analysis: \n %s", st.format())
 
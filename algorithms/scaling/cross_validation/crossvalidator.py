@@ -9,6 +9,7 @@
 from copy import deepcopy
 
 from dials.algorithms.scaling.observers import register_merging_stats_observers
+from libtbx import easy_mp
 from libtbx.table_utils import simple_table
 from scitbx.array_family import flex
 import six
@@ -41,6 +42,38 @@ def run_script(self, params, config_no):
         free/work set results and add to the results dict. Indicate the
         configuration number being run."""
 
+    def run_scripts(self, jobs, nproc=1):
+        """Run the script for each of a list of (params, config_no) jobs, adding
+        the results to the results dict in the order of the jobs.
+
+        If nproc > 1, the jobs are run in parallel in forked processes, which
+        share the experiments and reflections of this cross validator rather
+        than each receiving a pickled copy. Only the results are returned."""
+        nproc = min(nproc, len(jobs))
+        if nproc <= 1:
+            for params, config_no in jobs:
+                self.run_script(params, config_no)
+            return
+
+        def run_job(i):
+            params, config_no = jobs[i]
+            self.run_script(params, config_no)
+            return [
+                self.results_dict[config_no][name][-1]
+                for name in self.results_metadata["names"]
+            ]
+
+        results = easy_mp.parallel_map(
+            func=run_job,
+            iterable=list(range(len(jobs))),
+            processes=nproc,
+            method="multiprocessing",
+            preserve_order=True,
+            preserve_exception_message=True,
+        )
+        for (_, config_no), result in zip(jobs, results):
+            self.add_results_to_results_dict(config_no, result)
+
     @abc.abstractmethod
     def get_results_from_script(self, script):
         """Return the work/free results list from the command line script object"""
@@ -1,5 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
+import copy
+
 import mock
 import pytest
 from dials.util.options import OptionParser
@@ -183,6 +185,32 @@ def mock_script():
     # defer testing of run_script to command line tests
 
 
+class _OffsetCrossValidator(DialsScaleCrossValidator):
+
+    """A cross validator with results set from the free set offset."""
+
+    def run_script(self, params, config_no):
+        offset = params.scaling_options.free_set_offset
+        results = [float(offset + config_no)] * len(self.results_metadata["names"])
+        self.add_results_to_results_dict(config_no, results)
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_crossvalidator_run_scripts(nproc):
+    """Test that the results of the jobs are added in order."""
+    param = generated_param()
+    jobs = []
+    for config_no in range(2):
+        for n in range(3):
+            param.scaling_options.free_set_offset = n
+            jobs.append((copy.deepcopy(param), config_no))
+    crossvalidator = _OffsetCrossValidator([], [])
+    crossvalidator.create_results_dict(n_options=2)
+    crossvalidator.run_scripts(jobs, nproc=nproc)
+    assert crossvalidator.results_dict[0]["free Rpim"] == [0.0, 1.0, 2.0]
+    assert crossvalidator.results_dict[1]["free Rpim"] == [1.0, 2.0, 3.0]
+
+
 def test_cross_validate_script():
     """Test the script, mocking the run_script and interpret results calls"""
 
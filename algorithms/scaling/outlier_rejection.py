@@ -10,9 +10,9 @@
 from __future__ import absolute_import, division, print_function
 import abc
 import logging
+import numpy
 from scitbx.array_family import flex
 from dials.algorithms.scaling.Ih_table import IhTable
-from dials_scaling_ext import determine_outlier_indices
 
 logger = logging.getLogger("dials")
 
@@ -281,96 +281,86 @@ class NormDevOutlierRejection(OutlierRejectionBase):
     """Algorithm using normalised deviations from the weighted intensity means.
 
     In this case, the weighted mean is calculated from all reflections in
-    the symmetry group excluding the test reflection.
+    the symmetry group excluding the test reflection. In each round, the
+    reflection with the largest normalised deviation above zmax in each group
+    is rejected, and only the remaining reflections of the groups in which an
+    outlier was found are tested again in the next round.
     """
 
     def _do_outlier_rejection(self):
         """Add indices (w.r.t. the Ih_table data) to self._outlier_indices."""
-        outlier_indices, other_potential_outliers = self._round_of_outlier_rejection()
-        self._outlier_indices.extend(outlier_indices)
-        internal_potential_outliers = other_potential_outliers
-        while other_potential_outliers:
-            good_sel = flex.bool(self._Ih_table_block.Ih_table.size(), False)
-            good_sel.set_selected(internal_potential_outliers, True)
-            self._Ih_table_block = self._Ih_table_block.select(good_sel)
-            other_potential_outliers, internal_potential_outliers = self._check_for_more_outliers(
-                other_potential_outliers
-            )
-
-    def _check_for_more_outliers(self, other_potential_outliers):
+        Ih_table = self._Ih_table_block
+        self._group_index = Ih_table.group_index.as_numpy_array()
+        self._I = Ih_table.intensities.as_numpy_array()
+        self._g = Ih_table.inverse_scale_factors.as_numpy_array()
+        self._w = Ih_table.weights.as_numpy_array()
+        rows = numpy.arange(Ih_table.size)
+        while rows.size:
+            outliers = self._round_of_outlier_rejection(rows)
+            if not outliers.size:
+                break
+            self._outlier_indices.extend(flex.size_t(outliers.tolist()))
+            # only the groups with an outlier need testing again
+            retest = numpy.isin(
+                self._group_index[rows], self._group_index[outliers]
+            ) & ~numpy.isin(rows, outliers)
+            rows = rows[retest]
+
+    def _round_of_outlier_rejection(self, rows):
         """
-        Recursive check for further outliers.
+        Calculate normal deviations for a subset of the data in the Ih_table.
 
-        Each iteration creates a new reduced-size Ih_table_block, which retains
-        only symmetry groups that need further testing. Outlier indices must be
-        transformed to give indices with respect to the initial Ih_table_block.
+        The sums over each group are calculated over the given reflections only,
+        so the cost of a round is proportional to the number of reflections in
+        the groups still being tested, rather than the size of the Ih_table.
 
         Args:
-            other_potential_outliers: A flex.size_t array of indices with respect
-                to the initial Ih_table data
-
-        """
-        # Find outlier indices with respect to reduced Ih_table block
-        internal_outlier_indices, internal_other_potential_outliers = (
-            self._round_of_outlier_rejection()
-        )
-        outliers_wrt_original = other_potential_outliers.select(
-            internal_outlier_indices
-        )
-        self._outlier_indices.extend(outliers_wrt_original)
-        new_other_potential_outliers = other_potential_outliers.select(
-            internal_other_potential_outliers
-        )  # still wrt original Ih_table data
-        return new_other_potential_outliers, internal_other_potential_outliers
-
-    def _round_of_outlier_rejection(self):
-        """
-        Calculate normal deviations from the data in the Ih_table.
+            rows: A sorted numpy array of the indices (w.r.t. the Ih_table) of
+                the reflections to test, containing all remaining reflections
+                of each group to be tested.
 
         Returns:
-            (tuple): tuple containing:
-                outlier_indices: A flex.size_t array of outlier indices w.r.t
-                    the current Ih_table
-                other_potential_outliers: A flex.size_t array of indices from
-                    the symmetry groups where outliers were found, excluding the
-                    indices of the outliers themselves (indices w.r.t current
-                    Ih_table).
+            outlier_indices: A numpy array of the indices (w.r.t. the Ih_table)
+                of the reflection with the largest normalised deviation above
+                zmax in each group with more than two reflections, in group
+                order.
 
         """
-        Ih_table = self._Ih_table_block
-        I = Ih_table.intensities
-        g = Ih_table.inverse_scale_factors
-        w = Ih_table.weights
-        wgIsum = ((w * g * I) * Ih_table.h_index_matrix) * Ih_table.h_expand_matrix
-        wg2sum = ((w * g * g) * Ih_table.h_index_matrix) * Ih_table.h_expand_matrix
-        wgIsum_others = wgIsum - (w * g * I)
-        wg2sum_others = wg2sum - (w * g * g)
+        _, group_index = numpy.unique(self._group_index[rows], return_inverse=True)
+        I = self._I[rows]
+        g = self._g[rows]
+        w = self._w[rows]
+        wgI = w * g * I
+        wg2 = w * g * g
+        wgIsum_others = numpy.bincount(group_index, weights=wgI)[group_index] - wgI
+        wg2sum_others = numpy.bincount(group_index, weights=wg2)[group_index] - wg2
         # Now do the rejection analyis if n_in_group > 2
-        nh = Ih_table.calc_nh()
+        nh = numpy.bincount(group_index)[group_index]
         sel = nh > 2
-        wg2sum_others_sel = wg2sum_others.select(sel)
-        wgIsum_others_sel = wgIsum_others.select(sel)
+        wg2sum_others_sel = wg2sum_others[sel]
+        wgIsum_others_sel = wgIsum_others[sel]
 
         # guard against zero divison errors - can happen due to rounding errors
         # or bad data giving g values are very small
         zero_sel = wg2sum_others_sel == 0.0
         # set as one for now, then mark as outlier below. This will only affect if
         # g is near zero, if w is zero then throw an assertionerror.
-        wg2sum_others_sel.set_selected(zero_sel, 1.0)
-        g_sel = g.select(sel)
-        I_sel = I.select(sel)
-        w_sel = w.select(sel)
+        wg2sum_others_sel[zero_sel] = 1.0
+        g_sel = g[sel]
+        I_sel = I[sel]
+        w_sel = w[sel]
 
-        assert w_sel.all_gt(0)  # guard against division by zero
+        assert (w_sel > 0).all()  # guard against division by zero
         norm_dev = (I_sel - (g_sel * wgIsum_others_sel / wg2sum_others_sel)) / (
             ((1.0 / w_sel) + (g_sel ** 2 / wg2sum_others_sel)) ** 0.5
         )
-        norm_dev.set_selected(zero_sel, 1000)  # to trigger rejection
-        z_score = flex.abs(norm_dev)
-        # Want an array same size as Ih table.
-        all_z_scores = flex.double(Ih_table.size, 0.0)
-        all_z_scores.set_selected(sel.iselection(), z_score)
-        outlier_indices, other_potential_outliers = determine_outlier_indices(
-            Ih_table.h_index_matrix, all_z_scores, self._zmax
-        )
-        return outlier_indices, other_potential_outliers
+        norm_dev[zero_sel] = 1000  # to trigger rejection
+        z_score = numpy.abs(norm_dev)
+
+        # Find the first reflection with the largest z-score in each group
+        rows_sel = rows[sel]
+        groups_sel = group_index[sel]
+        order = numpy.lexsort((rows_sel, -z_score, groups_sel))
+        _, first = numpy.unique(groups_sel[order], return_index=True)
+        largest = order[first]
+        return rows_sel[largest[z_score[largest] > self._zmax]]
@@ -20,7 +20,9 @@
 
 import six
 from cctbx import crystal, sgtbx
+from libtbx import easy_mp
 from dials_scaling_ext import row_multiply
+from dials_scaling_ext import sparse_matrix_as_triplets, sparse_matrix_from_triplets
 from dials_scaling_ext import calc_sigmasq as cpp_calc_sigmasq
 from dials.array_family import flex
 from dials.algorithms.scaling.basis_functions import basis_function
@@ -739,36 +741,62 @@ def clean_reflection_tables(self):
             scaler.clean_reflection_tables()
 
     def update_for_minimisation(self, apm, block_id, calc_Ih=True):
-        """Update the scale factors and Ih for the next iteration of minimisation."""
-        scales = flex.double([])
-        derivs = []
-        for apm_i in apm.apm_list:
-            basis_fn = self._basis_function.calculate_scales_and_derivatives(
-                apm_i, block_id
+        """Update the scale factors and Ih for the next iteration of minimisation.
+
+        If nproc > 1, the scales and derivatives of the datasets are calculated
+        in separate processes. Sparse matrices are not pickleable, so the
+        derivatives are returned as the rows, columns and values of their
+        non-zero elements, from which the block-sparse derivative matrix of all
+        datasets is created in one step."""
+        nproc = min(self.params.scaling_options.nproc, len(apm.apm_list))
+        if nproc > 1:
+
+            def task_wrapper(i):
+                s, d = self._basis_function.calculate_scales_and_derivatives(
+                    apm.apm_list[i], block_id
+                )
+                return (s,) + sparse_matrix_as_triplets(d)
+
+            task_results = easy_mp.parallel_map(
+                func=task_wrapper,
+                iterable=range(len(apm.apm_list)),
+                processes=nproc,
+                method="multiprocessing",
+                preserve_exception_message=True,
+            )
+            scales = flex.double([])
+            rows = flex.size_t()
+            cols = flex.size_t()
+            values = flex.double()
+            for j, (s, r, c, v) in enumerate(task_results):
+                rows.extend(r + scales.size())
+                cols.extend(c + apm.apm_data[j]["start_idx"])
+                values.extend(v)
+                scales.extend(s)
+            deriv_matrix = sparse_matrix_from_triplets(
+                scales.size(), apm.n_active_params, rows, cols, values
             )
-            scales.extend(basis_fn[0])
-            derivs.append(basis_fn[1])
-        deriv_matrix = sparse.matrix(scales.size(), apm.n_active_params)
-        start_row_no = 0
-        for j, deriv in enumerate(derivs):
-            deriv_matrix.assign_block(deriv, start_row_no, apm.apm_data[j]["start_idx"])
-            start_row_no += deriv.n_rows
+        else:
+            scales = flex.double([])
+            derivs = []
+            for apm_i in apm.apm_list:
+                basis_fn = self._basis_function.calculate_scales_and_derivatives(
+                    apm_i, block_id
+                )
+                scales.extend(basis_fn[0])
+                derivs.append(basis_fn[1])
+            deriv_matrix = sparse.matrix(scales.size(), apm.n_active_params)
+            start_row_no = 0
+            for j, deriv in enumerate(derivs):
+                deriv_matrix.assign_block(
+                    deriv, start_row_no, apm.apm_data[j]["start_idx"]
+                )
+                start_row_no += deriv.n_rows
         self.Ih_table.set_inverse_scale_factors(scales, block_id)
         self.Ih_table.set_derivatives(deriv_matrix, block_id)
         self.Ih_table.update_weights(block_id)
         if calc_Ih:
             self.Ih_table.calc_Ih(block_id)
-        # The parallelisation below would work if sparse matrices were
-        # pickleable (I think!) - with more benefit for larger number of datasets.'''
-        """def task_wrapper(block):
-      bf = basis_function(block)
-      s, d = bf.calculate_scales_and_derivatives()
-      return s, d
-    blocks = apm.apm_list
-    task_results = easy_mp.parallel_map(func=task_wrapper, iterable=blocks,
-      processes=n_datasets, method="multiprocessing",
-      preserve_exception_message=True)
-    scales_list, derivs_list = zip(*task_results)"""
 
     def update_error_model(self, error_model, update_Ih=True):
         """Update the error model in Ih table."""
@@ -162,6 +162,70 @@ scitbx::sparse::matrix<double> row_multiply(scitbx::sparse::matrix<double> m,
   return result;
 }
 
+/**
+ * Create the sparse matrix used to sum over groups of symmetry equivalent
+ * reflections, from the group index of each reflection. The matrix has a row
+ * per reflection, a column per group and a single nonzero entry in each row.
+ */
+scitbx::sparse::matrix<double> create_h_index_matrix(
+  scitbx::af::const_ref<int> group_index,
+  std::size_t n_groups) {
+  scitbx::sparse::matrix<double> h_index_matrix(group_index.size(), n_groups);
+  for (std::size_t i = 0; i < group_index.size(); ++i) {
+    DIALS_ASSERT(group_index[i] >= 0);
+    DIALS_ASSERT(static_cast<std::size_t>(group_index[i]) < n_groups);
+    h_index_matrix(i, group_index[i]) = 1.0;
+  }
+  h_index_matrix.compact();
+  return h_index_matrix;
+}
+
+/**
+ * Return the row indices, column indices and values of the non-zero elements
+ * of a sparse matrix, column by column. Unlike the matrix itself, these arrays
+ * can be pickled, e.g. to return the matrix from another process.
+ */
+boost::python::tuple sparse_matrix_as_triplets(scitbx::sparse::matrix<double> m) {
+  // call compact to ensure that each elt of the matrix is only defined once
+  m.compact();
+
+  scitbx::af::shared<std::size_t> rows;
+  scitbx::af::shared<std::size_t> cols;
+  scitbx::af::shared<double> values;
+  for (std::size_t j = 0; j < m.n_cols(); j++) {
+    for (scitbx::sparse::matrix<double>::row_iterator p = m.col(j).begin();
+         p != m.col(j).end();
+         ++p) {
+      rows.push_back(p.index());
+      cols.push_back(j);
+      values.push_back(*p);
+    }
+  }
+  return boost::python::make_tuple(rows, cols, values);
+}
+
+/**
+ * Create a sparse matrix from the row indices, column indices and values of
+ * its non-zero elements.
+ */
+scitbx::sparse::matrix<double> sparse_matrix_from_triplets(
+  std::size_t n_rows,
+  std::size_t n_cols,
+  scitbx::af::const_ref<std::size_t> rows,
+  scitbx::af::const_ref<std::size_t> cols,
+  scitbx::af::const_ref<double> values) {
+  DIALS_ASSERT(rows.size() == values.size());
+  DIALS_ASSERT(cols.size() == values.size());
+  scitbx::sparse::matrix<double> m(n_rows, n_cols);
+  for (std::size_t k = 0; k < values.size(); ++k) {
+    DIALS_ASSERT(rows[k] < n_rows);
+    DIALS_ASSERT(cols[k] < n_cols);
+    m(rows[k], cols[k]) = values[k];
+  }
+  m.compact();
+  return m;
+}
+
 scitbx::af::shared<scitbx::vec2<double> > calc_theta_phi(
   scitbx::af::shared<scitbx::vec3<double> > xyz) {
   // theta from -pi to pi. phi from 0 to pi
@@ -246,8 +246,9 @@
     nproc = 1
       .type = int(value_min=1)
       .help = "Number of blocks to divide the data into for minimisation.
-              This also sets the number of processes to use if the option is
-              available."
+              This also sets the number of processes used to calculate the
+              scales and derivatives of the individual datasets, and to
+              evaluate the target function on the blocks."
       .expert_level = 2
     use_free_set = False
       .type = bool
@@ -12,8 +12,11 @@
     LBFGScurvs,
 )
 from dials.algorithms.scaling.scaling_utilities import log_memory_usage
+from dials_scaling_ext import sparse_matrix_as_triplets, sparse_matrix_from_triplets
+from libtbx import easy_mp
 from libtbx.phil import parse
 from libtbx.table_utils import simple_table
+from scitbx import sparse
 from scitbx.array_family import flex
 from iotbx import merging_statistics
 
@@ -200,6 +203,22 @@ def return_error_model(self):
         return self._target.error_model
 
 
+class _SparseTriplets(object):
+    """The non-zero elements of a sparse matrix as pickleable arrays, to return
+    the matrix from another process."""
+
+    def __init__(self, matrix):
+        self.n_rows = matrix.n_rows
+        self.n_cols = matrix.n_cols
+        self.rows, self.cols, self.values = sparse_matrix_as_triplets(matrix)
+
+    def as_sparse_matrix(self):
+        """Recreate the sparse matrix."""
+        return sparse_matrix_from_triplets(
+            self.n_rows, self.n_cols, self.rows, self.cols, self.values
+        )
+
+
 class ScalingRefinery(object):
     "mixin class to add extra return method"
 
@@ -238,6 +257,55 @@ def prepare_for_step(self):
 
         return
 
+    def evaluate_blocks(self, blocks, evaluate, clear_derivatives=False):
+        """Update the data in each block for the current parameters and evaluate
+        the target on it, returning the results in block order.
+
+        If scaling_options.nproc > 1, all blocks are first updated here, so that
+        the Ih table of this process stays current, and the target is then
+        evaluated on each block in a separate process. Sparse matrices are not
+        pickleable, so any sparse matrix in the result of a block is returned
+        as the rows, columns and values of its non-zero elements, and recreated
+        here. The results are reduced by the caller in block order, so that the
+        sums do not depend on the order in which the blocks finish."""
+
+        nproc = min(self._scaler.params.scaling_options.nproc, len(blocks))
+        if nproc < 2:
+            results = []
+            for block_id, block in enumerate(blocks):
+                self._scaler.update_for_minimisation(self._parameters, block_id)
+                results.append(evaluate(block))
+                if clear_derivatives:
+                    self._scaler.clear_memory_from_derivs(block_id)
+            return results
+
+        for block_id in range(len(blocks)):
+            self._scaler.update_for_minimisation(self._parameters, block_id)
+
+        def task_wrapper(block_id):
+            return tuple(
+                _SparseTriplets(r) if isinstance(r, sparse.matrix) else r
+                for r in evaluate(blocks[block_id])
+            )
+
+        results = easy_mp.parallel_map(
+            func=task_wrapper,
+            iterable=range(len(blocks)),
+            processes=nproc,
+            method="multiprocessing",
+            preserve_exception_message=True,
+        )
+        if clear_derivatives:
+            for block_id in range(len(blocks)):
+                self._scaler.clear_memory_from_derivs(block_id)
+        return [
+            tuple(
+                r.as_sparse_matrix() if isinstance(r, _SparseTriplets) else r
+                for r in result
+            )
+            for result in results
+        ]
+
     def update_journal(self):
         """Append latest step information to the journal attributes"""
 
@@ -381,37 +449,14 @@ def compute_functional_gradients_and_curvatures(self):
         else:
             blocks = self._scaler.Ih_table.blocked_data_list
 
-        # if self._scaler.params.scaling_options.nproc > 1:
-        f = []
-        gi = []
-        for block_id, block in enumerate(blocks):
-            self._scaler.update_for_minimisation(self._parameters, block_id)
-            fb, gb = self._target.compute_functional_gradients(block)
-            f.append(fb)
-            gi.append(gb)
-            self._scaler.clear_memory_from_derivs(block_id)
-        """task_results = easy_mp.parallel_map(
-      func=self._target.compute_functional_gradients,
-      iterable=blocks,
-      processes=self._scaler.params.scaling_options.nproc,
-      method="multiprocessing",
-      preserve_exception_message=True
-      )
-    f, gi = zip(*task_results)"""
+        task_results = self.evaluate_blocks(
+            blocks, self._target.compute_functional_gradients, clear_derivatives=True
+        )
+        f, gi = zip(*task_results)
         f = sum(f)
         g = gi[0]
         for i in range(1, len(gi)):
             g += gi[i]
-        """else:
-      f = 0.0
-      g = None
-      for block in blocks:
-        fi, gi = self._target.compute_functional_gradients(block)
-        f += fi
-        if g:
-          g += gi
-        else:
-          g = gi"""
 
         restraints = self._target.compute_restraints_functional_gradients_and_curvatures(
             self._parameters
@@ -502,29 +547,17 @@ def build_up(self, objective_only=False):
 
         # observation terms
         if objective_only:
-            # if self._scaler.params.scaling_options.nproc > 1: #no mp option yet
-            for block_id, block in enumerate(blocks):
-                self._scaler.update_for_minimisation(self._parameters, block_id)
-                residuals, weights = self._target.compute_residuals(block)
+            task_results = self.evaluate_blocks(blocks, self._target.compute_residuals)
+            for residuals, weights in task_results:
                 self.add_residuals(residuals, weights)
         else:
-            # if self._scaler.params.scaling_options.nproc: #no mp option yet
-
             self._jacobian = None
 
-            for block_id, block in enumerate(blocks):
-                self._scaler.update_for_minimisation(self._parameters, block_id)
-                residuals, jacobian, weights = self._target.compute_residuals_and_gradients(
-                    block
-                )
+            task_results = self.evaluate_blocks(
+                blocks, self._target.compute_residuals_and_gradients
+            )
+            for residuals, jacobian, weights in task_results:
                 self.add_equations(residuals, jacobian, weights)
-            """task_results = easy_mp.pool_map(
-        fixed_func=self._target.compute_residuals_and_gradients,
-        iterable=blocks,
-        processes=self._scaler.params.scaling_options.nproc
-        )
-      for result in task_results:
-        self.add_equations(result[0], result[1], result[2])"""
 
         restraints = self._target.compute_restraints_residuals_and_gradients(
             self._parameters
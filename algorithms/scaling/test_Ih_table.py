@@ -316,6 +316,23 @@ def test_IhTableblock_twodatasets(large_reflection_table, test_sg):
     assert new_block.h_expand_matrix[1, 1] == 1
     assert new_block.h_expand_matrix[0, 2] == 1
 
+    assert list(block.group_index) == [0, 1, 3, 4, 4, 0, 2]
+    assert list(new_block.group_index) == [0, 1, 0]
+    assert new_block.n_groups == 2
+    assert list(block.sum_in_groups(block.intensities)) == list(
+        block.intensities * block.h_index_matrix
+    )
+
+    # Test select on groups, which should renumber the remaining groups
+    group_block = block.select_on_groups(flex.bool([False, True, True, False, True]))
+    assert list(group_block.group_index) == [0, 2, 2, 1]
+    assert group_block.n_groups == 3
+    assert list(group_block.block_selections[0]) == [1, 3, 4]
+    assert list(group_block.block_selections[1]) == [1]
+    assert list(group_block.calc_nh()) == [1, 2, 2, 1]
+    isel_block = block.select_on_groups_isel(flex.size_t([1, 2, 4]))
+    assert list(isel_block.group_index) == list(group_block.group_index)
+
 
 def test_IhTable_split_into_blocks(
     large_reflection_table, small_reflection_table, test_sg
@@ -2,6 +2,7 @@
 import pytest
 from mock import Mock, MagicMock
 from scitbx import sparse
+from dials_scaling_ext import sparse_matrix_as_triplets, sparse_matrix_from_triplets
 from libtbx import phil
 from libtbx.test_utils import approx_equal
 from dxtbx.model.experiment_list import ExperimentList
@@ -12,6 +13,8 @@
 from dials.algorithms.scaling.scaler_factory import create_scaler
 from dials.algorithms.scaling.basis_functions import basis_function
 from dials.algorithms.scaling.parameter_handler import create_apm_factory
+from dials.algorithms.scaling.scaling_refiner import ScalingGaussNewtonIterations
+from dials.algorithms.scaling.target_function import ScalingTarget
 from dials.algorithms.scaling.scaling_utilities import calculate_prescaling_correction
 from dials.algorithms.scaling.scaler import (
     SingleScaler,
@@ -762,3 +765,63 @@ def test_multiscaler_update_for_minimisation():
     assert block_list[1].inverse_scale_factors == expected_scales_for_block_2
     assert block_list[1].derivatives == expected_derivatives_for_block_2
     assert block_list[0].derivatives == expected_derivatives_for_block_1
+
+    # the datasets were evaluated in separate processes, check the same result
+    # is obtained serially
+    multiscaler.params.scaling_options.nproc = 1
+    multiscaler.update_for_minimisation(apm, 0)
+    assert block_list[0].inverse_scale_factors == expected_scales_for_block_1
+    assert block_list[0].derivatives == expected_derivatives_for_block_1
+
+
+def test_multiscaler_build_up_blocks_in_processes():
+    """Test that evaluating the blocks in separate processes gives the same
+    equations."""
+
+    p, e = (generated_param(), generated_exp(2))
+    p.reflection_selection.method = "use_all"
+    r1 = generated_refl(id_=0)
+    r1["intensity.sum.value"] = r1["intensity"]
+    r1["intensity.sum.variance"] = r1["variance"]
+    r2 = generated_refl(id_=1)
+    r2["intensity.sum.value"] = r2["intensity"]
+    r2["intensity.sum.variance"] = r2["variance"]
+    p.scaling_options.nproc = 2
+    p.model = "physical"
+    exp = create_scaling_model(p, e, [r1, r2])
+    singlescaler1 = create_scaler(p, [exp[0]], [r1])
+    singlescaler2 = create_scaler(p, [exp[1]], [r2])
+    multiscaler = MultiScaler(p, exp, [singlescaler1, singlescaler2])
+    assert len(multiscaler.Ih_table.blocked_data_list) == 2
+
+    apm = create_apm_factory(multiscaler).make_next_apm()
+    equations = []
+    for nproc in [2, 1]:
+        multiscaler.params.scaling_options.nproc = nproc
+        refinery = ScalingGaussNewtonIterations(
+            multiscaler, target=ScalingTarget(), prediction_parameterisation=apm
+        )
+        refinery.build_up()
+        equations.append(
+            (
+                refinery.objective(),
+                list(refinery.normal_matrix_packed_u()),
+                list(refinery.step_equations().right_hand_side()),
+            )
+        )
+    assert equations[0] == equations[1]
+
+
+def test_sparse_matrix_triplets():
+    """Test the conversion of a sparse matrix to and from pickleable arrays."""
+    m = sparse.matrix(4, 3)
+    m[0, 0] = 1.0
+    m[2, 0] = 2.0
+    m[1, 2] = 3.0
+    m[3, 2] = 4.0
+    rows, cols, values = sparse_matrix_as_triplets(m)
+    assert list(rows) == [0, 2, 1, 3]
+    assert list(cols) == [0, 0, 2, 2]
+    assert list(values) == [1.0, 2.0, 3.0, 4.0]
+    m2 = sparse_matrix_from_triplets(4, 3, rows, cols, values)
+    assert m2.as_dense_matrix().all_eq(m.as_dense_matrix())
@@ -13,9 +13,10 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
-from collections import defaultdict
 from math import sqrt, floor
 
+import numpy
+
 from cctbx import miller
 from cctbx import crystal, uctbx
 from dials.array_family import flex
@@ -69,85 +70,64 @@ def nbins(self):
         """
         return self._nbins
 
-    def index(self, h):
+    def indices(self, miller_indices):
         """
-        Get the bin index from the miller index
+        Get the bin indices for an array of miller indices
 
-        :param h: The miller index
-        :returns: The bin index
+        :param miller_indices: The flex array of miller indices
+        :returns: A numpy array of bin indices
 
         """
-        d = self._unit_cell.d(h)
+        d = self._unit_cell.d(miller_indices).as_numpy_array()
         d2 = 1 / d ** 2
-        bin_index = int(floor((d2 - self._xmin) / self._bin_size))
-        if bin_index >= self._nbins:
-            bin_index = self._nbins - 1
-        if bin_index < 0:
-            bin_index = 0
-        return bin_index
-
+        bin_index = numpy.floor((d2 - self._xmin) / self._bin_size).astype(int)
+        return numpy.clip(bin_index, 0, self._nbins - 1)
 
-class ReflectionSum(object):
-    """
-    A helper class to store sums of X and X**2
 
+def _bin_contributions(sum_x, sum_x2, n):
     """
+    Compute the contributions of unique reflections to the sums needed for the
+    CC 1/2 of a resolution bin. Only reflections with more than one observation
+    contribute.
 
-    def __init__(self, sum_x=0, sum_x2=0, n=0):
-        self.sum_x = sum_x
-        self.sum_x2 = sum_x2
-        self.n = n
+    :param sum_x: Array of Sum(X) for each reflection
+    :param sum_x2: Array of Sum(X^2) for each reflection
+    :param n: Array of the number of observations of each reflection
+    :returns: Array with rows of the count, mean and variance on the mean
 
-
-class BinData(object):
     """
-    A helper class to store mean and variance
+    use = n > 1
+    n = numpy.where(use, n, 2)
+    mean = sum_x / n
+    var = (sum_x2 - sum_x ** 2 / n) / (n - 1) / n
+    return numpy.array([numpy.ones(len(n)), mean, var]) * use
 
-    """
 
-    def __init__(self):
-        self.mean = []
-        self.var = []
-
-
-def compute_cchalf(mean, var):
+def _mean_of_means(count, sum_mean):
     """
-    Compute the CC 1/2 using the formular from Assmann, Brehm and Diederichs 2016
-
-    :param mean: The list of mean intensities
-    :param var: The list of variances on the half set of mean intensities
-    :returns: The CC 1/2
+    Compute the mean of the reflection means in each bin, or zero for bins
+    without reflections
 
     """
-    assert len(mean) == len(var)
-    n = len(mean)
-    mean_of_means = sum(mean) / n
-    sigma_e = sum(var) / n
-    sigma_y = sum([(m - mean_of_means) ** 2 for m in mean]) / (n - 1)
-    cchalf = (sigma_y - sigma_e) / (sigma_y + sigma_e)
-    return cchalf
+    return sum_mean / numpy.where(count > 0, count, 1)
 
 
-def compute_mean_cchalf_in_bins(bin_data):
+def _mean_cchalf_from_bin_sums(count, sum_var, sum_sq_dev):
     """
-    Compute the mean cchalf averaged across resolution bins
-
-    :param bin_data: The mean and variance in each bin
-    :returns: The mean CC 1/2
+    Compute the mean CC 1/2 averaged across resolution bins using the formula
+    from Assmann, Brehm and Diederichs 2016, from the count, sum of variances
+    and sum of squared deviations of the means from the mean of means in each
+    bin. Bins with fewer than two reflections are ignored. The bins are the last
+    axis of the arrays, so that any leading axes are computed at once.
 
     """
-    mean_cchalf = 0
-    count = 0
-    for bin_i in bin_data:
-        mean = bin_i.mean
-        var = bin_i.var
-        n = len(mean)
-        if n > 1:
-            cchalf = compute_cchalf(mean, var)
-            mean_cchalf += n * cchalf
-            count += n
-    mean_cchalf /= count
-    return mean_cchalf
+    use = count > 1
+    count = numpy.where(use, count, 2)
+    sigma_e = sum_var / count
+    sigma_y = sum_sq_dev / (count - 1)
+    cchalf = (sigma_y - sigma_e) / (sigma_y + sigma_e)
+    weights = count * use
+    return (weights * cchalf).sum(axis=-1) / weights.sum(axis=-1)
 
 
 class PerImageCChalfStatistics(object):
@@ -218,7 +198,7 @@ def __init__(
             hkl = miller_index.select(selection)
 
             # Compute resolution
-            d = flex.double([uc.d(h) for h in hkl])
+            d = uc.d(hkl)
             D.set_selected(selection, d)
 
             # Compute asu miller index
@@ -227,7 +207,7 @@ def __init__(
             ms_asu = ms.map_to_asu()
             miller_index.set_selected(selection, ms_asu.indices())
 
-        assert all(d > 0 for d in D)
+        assert D.all_gt(0)
 
         # Filter by dmin and dmax
         if dmin is not None:
@@ -264,32 +244,61 @@ def __init__(
             self._dmax = max(D)
         binner = ResolutionBinner(mean_unit_cell, self._dmin, self._dmax, nbins)
 
-        # Create lookups for elements by miller index
-        index_lookup = defaultdict(list)
-        for i, h in enumerate(miller_index):
-            index_lookup[h].append(i)
+        # Group the observations by unique miller index, by sorting an integer
+        # key for each index
+        hkl = miller_index.as_vec3_double().as_double().as_numpy_array()
+        hkl = hkl.reshape(-1, 3).astype(numpy.int64)
+        hkl -= hkl.min(axis=0)
+        shape = hkl.max(axis=0) + 1
+        key = (hkl[:, 0] * shape[1] + hkl[:, 1]) * shape[2] + hkl[:, 2]
+        _, first, self._unique_index = numpy.unique(
+            key, return_index=True, return_inverse=True
+        )
+        unique_miller_index = miller_index.select(flex.size_t(first.tolist()))
+        self._bin_index = binner.indices(unique_miller_index)
+        self._nbins = binner.nbins()
 
         # Compute the Overall Sum(X) and Sum(X^2) for each unique reflection
-        reflection_sums = defaultdict(ReflectionSum)
-        for h in index_lookup:
-            I = [intensity[i] for i in index_lookup[h]]
-            n = len(I)
-            sum_x = sum(I)
-            sum_x2 = sum(II ** 2 for II in I)
-            reflection_sums[h] = ReflectionSum(sum_x, sum_x2, n)
+        self._intensity_np = intensity.as_numpy_array()
+        num_unique = len(first)
+        self._sum_x = numpy.bincount(
+            self._unique_index, weights=self._intensity_np, minlength=num_unique
+        )
+        self._sum_x2 = numpy.bincount(
+            self._unique_index, weights=self._intensity_np ** 2, minlength=num_unique
+        )
+        self._n = numpy.bincount(self._unique_index, minlength=num_unique)
 
         # Compute some numbers
         self._num_datasets = len(set(dataset))
         self._num_reflections = len(miller_index)
-        self._num_unique = len(reflection_sums)
+        self._num_unique = num_unique
 
         logger.info("")
         logger.info("# Datasets: %s" % self._num_datasets)
         logger.info("# Reflections: %s" % self._num_reflections)
         logger.info("# Unique: %s" % self._num_unique)
 
-        # Compute the CC 1/2 for all the data
-        self._cchalf_mean = self._compute_cchalf(reflection_sums, binner)
+        # Compute the CC 1/2 for all the data, with the squared deviations of the
+        # means taken from the mean of means of each bin in a second pass
+        self._contributions = _bin_contributions(self._sum_x, self._sum_x2, self._n)
+        self._bin_sums = numpy.array(
+            [
+                numpy.bincount(self._bin_index, weights=c, minlength=self._nbins)
+                for c in self._contributions
+            ]
+        )
+        count, sum_mean, sum_var = self._bin_sums
+        self._mean_of_means = _mean_of_means(count, sum_mean)
+        use, mean = self._contributions[:2]
+        self._sum_sq_dev = numpy.bincount(
+            self._bin_index,
+            weights=use * (mean - self._mean_of_means[self._bin_index]) ** 2,
+            minlength=self._nbins,
+        )
+        self._cchalf_mean = float(
+            _mean_cchalf_from_bin_sums(count, sum_var, self._sum_sq_dev)
+        )
         logger.info("CC 1/2 mean: %.3f" % (100 * self._cchalf_mean))
 
         # override dataset here with a batched-dependent
@@ -318,82 +327,78 @@ def __init__(
                     )
                     self.expid_to_image_groups[id_].append(counter)
                     counter += 1
-            self._cchalf = self._compute_cchalf_excluding_each_dataset(
-                reflection_sums, binner, miller_index, image_groups, intensity
-            )
+            self._cchalf = self._compute_cchalf_excluding_each_dataset(image_groups)
 
         else:
-            self._cchalf = self._compute_cchalf_excluding_each_dataset(
-                reflection_sums, binner, miller_index, dataset, intensity
-            )
+            self._cchalf = self._compute_cchalf_excluding_each_dataset(dataset)
 
-    def _compute_cchalf(self, reflection_sums, binner):
+    def _compute_cchalf_excluding_each_dataset(self, dataset):
         """
-        Compute the CC 1/2 by computing the CC 1/2 in resolution bins and then
-        computing the weighted mean of the binned CC 1/2 values
+        Compute the CC 1/2 with each dataset (or image group) excluded.
 
-        """
-        # Compute Mean and variance of reflection intensities
-        bin_data = [BinData() for _ in range(binner.nbins())]
-        for h in reflection_sums:
-            sum_x = reflection_sums[h].sum_x
-            sum_x2 = reflection_sums[h].sum_x2
-            n = reflection_sums[h].n
-
-            if n > 1:
-                mean = sum_x / n
-                var = (sum_x2 - (sum_x) ** 2 / n) / (n - 1)
-                var = var / n
-                index = binner.index(h)
-                bin_data[index].mean.append(mean)
-                bin_data[index].var.append(var)
-
-        # Compute the mean cchalf in resolution bins
-        return compute_mean_cchalf_in_bins(bin_data)
-
-    def _compute_cchalf_excluding_each_dataset(
-        self, reflection_sums, binner, miller_index, dataset, intensity
-    ):
-        """
-        Compute the CC 1/2 with an image excluded.
-
-        For each image, update the sums by removing the contribution from the image
-        and then compute the CC 1/2 of the remaining data
+        The sums for each reflection are computed once per dataset, so that the
+        bin sums without each dataset are found by subtracting the contributions
+        of the affected reflections from the bin sums for all the data, for all
+        datasets at once.
 
         """
+        # Index the datasets and the (dataset, reflection) pairs present
+        datasets, dataset_index = numpy.unique(
+            dataset.as_numpy_array(), return_inverse=True
+        )
+        num_datasets = len(datasets)
+        num_unique = len(self._n)
+        pairs, pair_index = numpy.unique(
+            dataset_index * num_unique + self._unique_index, return_inverse=True
+        )
+        pair_dataset = pairs // num_unique
+        pair_unique = pairs % num_unique
+
+        # Compute the Sum(X), Sum(X^2) and count of each dataset's observations
+        # of each reflection, and the reflection sums excluding these
+        sum_x = numpy.bincount(pair_index, weights=self._intensity_np)
+        sum_x2 = numpy.bincount(pair_index, weights=self._intensity_np ** 2)
+        n = numpy.bincount(pair_index)
+        excluded = _bin_contributions(
+            self._sum_x[pair_unique] - sum_x,
+            self._sum_x2[pair_unique] - sum_x2,
+            self._n[pair_unique] - n,
+        )
+        delta = excluded - self._contributions[:, pair_unique]
+
+        # Accumulate the changes to the bin sums for each dataset
+        bins = pair_dataset * self._nbins + self._bin_index[pair_unique]
+        size = num_datasets * self._nbins
+
+        def accumulate(weights):
+            return numpy.bincount(bins, weights=weights, minlength=size).reshape(
+                num_datasets, self._nbins
+            )
 
-        # Create a lookup table for each reflection by dataset
-        dataset_lookup = defaultdict(list)
-        for i, b in enumerate(dataset):
-            dataset_lookup[b].append(i)
+        count, sum_mean, sum_var = (
+            accumulate(d) + total for d, total in zip(delta, self._bin_sums)
+        )
+
+        # Compute the squared deviations of the means from the new mean of means
+        # of each bin. Those of the unchanged reflections are shifted from the
+        # overall mean of means, and those of the changed reflections replaced.
+        mean_of_means = _mean_of_means(count, sum_mean)
+        pair_mean_of_means = mean_of_means.ravel()[bins]
+        use, mean = self._contributions[:2, pair_unique]
+        use_excluded, mean_excluded = excluded[:2]
+        sum_sq_dev = (
+            self._sum_sq_dev
+            + self._bin_sums[0] * (self._mean_of_means - mean_of_means) ** 2
+            - accumulate(use * (mean - pair_mean_of_means) ** 2)
+            + accumulate(use_excluded * (mean_excluded - pair_mean_of_means) ** 2)
+        )
 
         # Compute CC1/2 minus each dataset
+        cchalf = _mean_cchalf_from_bin_sums(count, sum_var, sum_sq_dev)
         cchalf_i = {}
-        for dataset in dataset_lookup:
-
-            # Find all observations from this dataset and create a lookup based on
-            # miller index
-            index_lookup = defaultdict(list)
-            for i in dataset_lookup[dataset]:
-                index_lookup[miller_index[i]].append(i)
-
-            # Loop through all the reflections and remove the contribution of
-            # reflections from the current dataset
-            dataset_reflection_sums = defaultdict(ReflectionSum)
-            for h in reflection_sums:
-                sum_x = reflection_sums[h].sum_x
-                sum_x2 = reflection_sums[h].sum_x2
-                n = reflection_sums[h].n
-                for i in index_lookup[h]:
-                    sum_x -= self._intensity[i]
-                    sum_x2 -= self._intensity[i] ** 2
-                    n -= 1
-                dataset_reflection_sums[h] = ReflectionSum(sum_x, sum_x2, n)
-
-            # Compute the CC 1/2 without the reflections from the current dataset
-            cchalf = self._compute_cchalf(dataset_reflection_sums, binner)
-            cchalf_i[dataset] = cchalf
-            logger.info("CC 1/2 excluding dataset %d: %.3f" % (dataset, 100 * cchalf))
+        for dataset, value in zip(datasets.tolist(), cchalf.tolist()):
+            cchalf_i[dataset] = value
+            logger.info("CC 1/2 excluding dataset %d: %.3f" % (dataset, 100 * value))
 
         return cchalf_i
 
@@ -141,9 +141,12 @@ def __init__(
         k1=2,
         k2=2,
         k3=100,
+        random_generator=None,
     ):
         """data expected to be a list of flex.double arrays of the same length,
-        representing the vectors of observations in each dimension"""
+        representing the vectors of observations in each dimension. The random
+        samples are drawn from random_generator, a flex.mersenne_twister, or from
+        the global flex generator if that is None"""
 
         # the full dataset as separate vectors
         self._data = data
@@ -181,6 +184,14 @@ def __init__(
         self._k2 = k2
         self._k3 = k3
 
+        # source of random samples
+        if random_generator is None:
+            self._random_selection = flex.random_selection
+            self._random_permutation = flex.random_permutation
+        else:
+            self._random_selection = random_generator.random_selection
+            self._random_permutation = random_generator.random_permutation
+
         # correction factors
         self._consistency_fac = mcd_consistency(self._p, self._h / self._n)
         self._finite_samp_fac = mcd_finite_sample(self._p, self._n, self._alpha)
@@ -226,13 +237,12 @@ def means_and_covariance(vecs):
         covmat = cov(*vecs)
         return (center, covmat)
 
-    @staticmethod
-    def sample_data(data, sample_size):
+    def sample_data(self, data, sample_size):
         """sample (without replacement) the data vectors to select the same
         sample_size rows from each."""
 
         n = len(data[0])
-        rows = flex.random_selection(n, sample_size)
+        rows = self._random_selection(n, sample_size)
         cols = [e.select(rows) for e in data]
         return cols
 
@@ -244,7 +254,7 @@ def split_into_groups(self, sample, ngroups):
         sample_size = len(sample[0])
 
         # random permutation
-        p = flex.random_permutation(sample_size)
+        p = self._random_permutation(sample_size)
         permuted = [col.select(p) for col in sample]
 
         # determine groups
@@ -268,7 +278,7 @@ def form_initial_subset(self, h, data):
         """Method 2 of subsection 3.1 of R&vD"""
 
         # permutation of input data for sampling
-        p = flex.random_permutation(len(data[0]))
+        p = self._random_permutation(len(data[0]))
         permuted = [col.select(p) for col in data]
 
         # draw random p+1 subset J (or larger if required)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function
 
+from scipy import sparse
 from scitbx.array_family import flex
 
 
@@ -64,7 +65,10 @@ def plot_rij_histogram(rij_matrix, key="cosym_rij_histogram"):
       If this is not defined then the plot is displayed in interactive mode.
 
   """
-    rij = rij_matrix.as_1d()
+    if sparse.issparse(rij_matrix):
+        rij = flex.double(rij_matrix.tocsr().data)
+    else:
+        rij = rij_matrix.as_1d()
     rij = rij.select(rij != 0)
     hist = flex.histogram(
         rij,
@@ -1,11 +1,12 @@
 """Target function for cosym analysis."""
 from __future__ import absolute_import, division, print_function
 
+import collections
 import copy
 import logging
-import math
 
 import cctbx.sgtbx.cosets
+import numpy as np
 from cctbx import miller
 from cctbx import sgtbx
 from cctbx.array_family import flex
@@ -147,164 +148,211 @@ def _generate_twin_operators(self, lattice_symmetry_max_delta=5.0):
 
         return operators
 
-    def _lattice_lower_upper_index(self, lattice_id):
-        lower_index = self._lattices[lattice_id]
-        upper_index = None
-        if lattice_id < len(self._lattices) - 1:
-            upper_index = self._lattices[lattice_id + 1]
-        else:
-            assert lattice_id == len(self._lattices) - 1
-        return lower_index, upper_index
-
     def _compute_rij_wij(self, use_cache=True):
-        """Compute the rij_wij matrix."""
-        n_lattices = self._lattices.size()
-        n_sym_ops = len(self._sym_ops)
+        """Compute the rij_wij matrix.
 
-        NN = n_lattices * n_sym_ops
+        The reindexed asymmetric unit indices of every reflection are computed
+        once for each symmetry operation and encoded as integers. For each
+        symmetry operation, the (centred) intensities are then arranged in
+        sparse lattice x index matrices, such that the sums required for the
+        correlation coefficients between all pairs of lattices are given by
+        sparse matrix products. These are evaluated in blocks of rows to bound
+        the memory usage and the resulting correlation coefficients are
+        accumulated as a sparse matrix.
 
-        self.rij_matrix = flex.double(flex.grid(NN, NN), 0.0)
-        if self._weights is None:
-            self.wij_matrix = None
-        else:
-            self.wij_matrix = flex.double(flex.grid(NN, NN), 0.0)
+        The rij and wij matrices are kept as scipy sparse matrices, as they
+        are only non-zero for pairs of lattices with common reflections.
+
+        Args:
+          use_cache (bool): Only compute the correlation coefficients once for
+            each pair of symmetry operations with the same relative operation
+            :math:`k^{-1} kk`.
+        """
+        n_lattices = self._lattices.size()
+        sym_ops = [sgtbx.change_of_basis_op(cb_op) for cb_op in self._sym_ops]
+        n_sym_ops = len(sym_ops)
+        NN = n_lattices * n_sym_ops
 
-        indices = {}
+        # The lattice of each reflection
+        n_refl = self._data.size()
+        lattice_bounds = np.append(np.array(self._lattices, dtype=np.int64), n_refl)
+        counts = np.diff(lattice_bounds)
+        lattice = np.repeat(np.arange(n_lattices), counts)
+
+        # Centre the intensities for each lattice. The correlation coefficient
+        # is invariant to this, but it avoids loss of precision in the sums
+        intensities = self._data.data().as_numpy_array()
+        means = np.bincount(lattice, weights=intensities, minlength=n_lattices)
+        means /= np.maximum(counts, 1)
+        intensities = intensities - means[lattice]
+
+        # Reindex the miller indices for each symmetry operation and encode
+        # them as integers, along with the selection of non-centric reflections
         space_group_type = self._data.space_group().type()
-        for cb_op in self._sym_ops:
-            cb_op = sgtbx.change_of_basis_op(cb_op)
+        hkl = []
+        epsilon_one = []
+        for cb_op in sym_ops:
             indices_reindexed = cb_op.apply(self._data.indices())
             miller.map_to_asu(space_group_type, False, indices_reindexed)
-            indices[cb_op.as_xyz()] = indices_reindexed
-
-        def _compute_rij_matrix_one_row_block(i):
-            rij_cache = {}
-
-            n_sym_ops = len(self._sym_ops)
-            NN = n_lattices * n_sym_ops
-
-            rij_row = []
-            rij_col = []
-            rij_data = []
-            if self._weights is not None:
-                wij_row = []
-                wij_col = []
-                wij_data = []
-            else:
-                wij = None
-
-            i_lower, i_upper = self._lattice_lower_upper_index(i)
-            intensities_i = self._data.data()[i_lower:i_upper]
-
-            for j in range(n_lattices):
-
-                j_lower, j_upper = self._lattice_lower_upper_index(j)
-                intensities_j = self._data.data()[j_lower:j_upper]
-
-                for k, cb_op_k in enumerate(self._sym_ops):
-                    cb_op_k = sgtbx.change_of_basis_op(cb_op_k)
-
-                    indices_i = indices[cb_op_k.as_xyz()][i_lower:i_upper]
-
-                    for kk, cb_op_kk in enumerate(self._sym_ops):
-                        if i == j and k == kk:
-                            # don't include correlation of dataset with itself
-                            continue
-                        cb_op_kk = sgtbx.change_of_basis_op(cb_op_kk)
-
-                        ik = i + (n_lattices * k)
-                        jk = j + (n_lattices * kk)
-
-                        key = (i, j, str(cb_op_k.inverse() * cb_op_kk))
-                        if use_cache and key in rij_cache:
-                            cc, n = rij_cache[key]
-                        else:
-                            indices_j = indices[cb_op_kk.as_xyz()][j_lower:j_upper]
-
-                            matches = miller.match_indices(indices_i, indices_j)
-                            pairs = matches.pairs()
-                            isel_i = pairs.column(0)
-                            isel_j = pairs.column(1)
-                            isel_i = isel_i.select(
-                                self._patterson_group.epsilon(indices_i.select(isel_i))
-                                == 1
-                            )
-                            isel_j = isel_j.select(
-                                self._patterson_group.epsilon(indices_j.select(isel_j))
-                                == 1
-                            )
-                            corr = flex.linear_correlation(
-                                intensities_i.select(isel_i),
-                                intensities_j.select(isel_j),
-                            )
-
-                            if corr.is_well_defined():
-                                cc = corr.coefficient()
-                                n = corr.n()
-                                rij_cache[key] = (cc, n)
-                            else:
-                                cc = None
-                                n = None
-
-                        if (
-                            n is None
-                            or cc is None
-                            or (self._min_pairs is not None and n < self._min_pairs)
-                        ):
-                            continue
-
-                        if self._weights == "count":
-                            wij_row.extend([ik, jk])
-                            wij_col.extend([jk, ik])
-                            wij_data.extend([n, n])
-                        elif self._weights == "standard_error":
-                            assert n > 2
-                            # http://www.sjsu.edu/faculty/gerstman/StatPrimer/correlation.pdf
-                            se = math.sqrt((1 - cc ** 2) / (n - 2))
-                            wij = 1 / se
-                            wij_row.extend([ik, jk])
-                            wij_col.extend([jk, ik])
-                            wij_data.extend([wij, wij])
-
-                        rij_row.append(ik)
-                        rij_col.append(jk)
-                        rij_data.append(cc)
-
-            rij = sparse.coo_matrix((rij_data, (rij_row, rij_col)), shape=(NN, NN))
-            if self._weights is not None:
-                wij = sparse.coo_matrix((wij_data, (wij_row, wij_col)), shape=(NN, NN))
-
-            return rij, wij
-
-        args = [(i,) for i in range(n_lattices)]
+            hkl.append(indices_reindexed.as_vec3_double().as_numpy_array())
+            epsilon_one.append(
+                (self._patterson_group.epsilon(indices_reindexed) == 1).as_numpy_array()
+            )
+        hkl = np.rint(np.concatenate(hkl)).astype(np.int64)
+        unique_hkl, codes = np.unique(hkl, axis=0, return_inverse=True)
+        codes = codes.reshape(n_sym_ops, n_refl)
+        n_codes = len(unique_hkl)
+
+        # The lattice x index matrices for each symmetry operation
+        def lattice_index_matrix(k, values):
+            sel = epsilon_one[k]
+            return sparse.csr_matrix(
+                (values[sel], (lattice[sel], codes[k][sel])),
+                shape=(n_lattices, n_codes),
+            )
+
+        ones = np.ones(n_refl)
+        matrices = [
+            (
+                lattice_index_matrix(k, ones),
+                lattice_index_matrix(k, intensities),
+                lattice_index_matrix(k, intensities ** 2),
+            )
+            for k in range(n_sym_ops)
+        ]
+
+        # Group the pairs of symmetry operations by the relative operation
+        pairs = collections.OrderedDict()
+        for k, cb_op_k in enumerate(sym_ops):
+            for kk, cb_op_kk in enumerate(sym_ops):
+                if use_cache:
+                    key = str(cb_op_k.inverse() * cb_op_kk)
+                else:
+                    key = (k, kk)
+                pairs.setdefault(key, []).append((k, kk))
+
+        # Compute the correlation coefficients between all lattices for the
+        # first pair of symmetry operations in each group
+        block_size = max(1, 10 ** 7 // max(1, n_lattices))
+
+        def _compute_rij_one_relative_op(k, kk):
+            M_k, A_k, A2_k = matrices[k]
+            M_kk, A_kk, A2_kk = matrices[kk]
+            M_kk_T, A_kk_T, A2_kk_T = M_kk.T.tocsc(), A_kk.T.tocsc(), A2_kk.T.tocsc()
+            rows = []
+            cols = []
+            ccs = []
+            ns = []
+            for i0 in range(0, n_lattices, block_size):
+                i1 = min(i0 + block_size, n_lattices)
+                n = M_k[i0:i1].dot(M_kk_T).toarray()
+                sel_i, sel_j = np.nonzero(n > 1)
+                if len(sel_i) == 0:
+                    continue
+                n = n[sel_i, sel_j]
+                sx = A_k[i0:i1].dot(M_kk_T).toarray()[sel_i, sel_j]
+                sy = M_k[i0:i1].dot(A_kk_T).toarray()[sel_i, sel_j]
+                sxx = A2_k[i0:i1].dot(M_kk_T).toarray()[sel_i, sel_j]
+                syy = M_k[i0:i1].dot(A2_kk_T).toarray()[sel_i, sel_j]
+                sxy = A_k[i0:i1].dot(A_kk_T).toarray()[sel_i, sel_j]
+                vx = n * sxx - sx ** 2
+                vy = n * syy - sy ** 2
+                well_defined = (vx > 0) & (vy > 0)
+                cc = (n * sxy - sx * sy)[well_defined] / np.sqrt(
+                    vx[well_defined] * vy[well_defined]
+                )
+                rows.append(sel_i[well_defined] + i0)
+                cols.append(sel_j[well_defined])
+                ccs.append(cc)
+                ns.append(n[well_defined])
+            if not rows:
+                return (np.array([], dtype=np.int64),) * 2 + (np.array([]),) * 2
+            return (
+                np.concatenate(rows),
+                np.concatenate(cols),
+                np.concatenate(ccs),
+                np.concatenate(ns),
+            )
+
+        args = [pairs[key][0] for key in pairs]
         results = easy_mp.parallel_map(
-            _compute_rij_matrix_one_row_block,
+            _compute_rij_one_relative_op,
             args,
             processes=self._nproc,
             iterable_type=easy_mp.posiargs,
             method="multiprocessing",
         )
 
-        rij_matrix = None
-        wij_matrix = None
-        for i, (rij, wij) in enumerate(results):
-            if rij_matrix is None:
-                rij_matrix = rij
-            else:
-                rij_matrix += rij
-            if wij is not None:
-                if wij_matrix is None:
-                    wij_matrix = wij
-                else:
-                    wij_matrix += wij
+        # Map the correlation coefficients for each group onto every pair of
+        # symmetry operations in the group
+        rij_row = []
+        rij_col = []
+        rij_data = []
+        wij_data = []
+        for key, (i, j, cc, n) in zip(pairs, results):
+            if self._min_pairs is not None:
+                sel = n >= self._min_pairs
+                i, j, cc, n = i[sel], j[sel], cc[sel], n[sel]
+            if self._weights == "count":
+                wij = n
+            elif self._weights == "standard_error":
+                assert (n > 2).all()
+                # http://www.sjsu.edu/faculty/gerstman/StatPrimer/correlation.pdf
+                se = np.sqrt((1 - cc ** 2) / (n - 2))
+                wij = 1 / se
+            for k, kk in pairs[key]:
+                sel = np.ones(len(i), dtype=bool)
+                if k == kk:
+                    # don't include correlation of dataset with itself
+                    sel = i != j
+                rij_row.append(i[sel] + n_lattices * k)
+                rij_col.append(j[sel] + n_lattices * kk)
+                rij_data.append(cc[sel])
+                if self._weights is not None:
+                    wij_data.append(wij[sel])
+
+        rij_row = np.concatenate(rij_row)
+        rij_col = np.concatenate(rij_col)
+        self.rij_matrix = sparse.coo_matrix(
+            (np.concatenate(rij_data), (rij_row, rij_col)), shape=(NN, NN)
+        ).tocsr()
+        if self._weights is None:
+            self.wij_matrix = None
+        else:
+            # The weights are symmetric
+            wij_data = np.concatenate(wij_data)
+            self.wij_matrix = sparse.coo_matrix(
+                (
+                    np.concatenate([wij_data, wij_data]),
+                    (
+                        np.concatenate([rij_row, rij_col]),
+                        np.concatenate([rij_col, rij_row]),
+                    ),
+                ),
+                shape=(NN, NN),
+            ).tocsr()
+
+        # The non-zero elements that contribute to the target function
+        if self.wij_matrix is None:
+            elements = self.rij_matrix.tocoo()
+            weights = None
+        else:
+            elements = self.wij_matrix.tocoo()
+            weights = elements.data
+        rij = np.asarray(self.rij_matrix[elements.row, elements.col]).ravel()
+        self._elements = (elements.row, elements.col, rij, weights)
 
-        self.rij_matrix = flex.double(rij_matrix.todense())
-        if wij_matrix is not None:
-            import numpy as np
+        return self.rij_matrix, self.wij_matrix
 
-            self.wij_matrix = flex.double(wij_matrix.todense().astype(np.float64))
+    def _coordinates(self, x):
+        """Reshape the flattened coordinates `x` to a (dim, NN) array."""
+        assert (x.size() // self.dim) == (self._lattices.size() * len(self._sym_ops))
+        return x.as_numpy_array().reshape(self.dim, -1)
 
-        return self.rij_matrix, self.wij_matrix
+    def _residuals(self, coords):
+        """Compute the residuals rij - xi.xj for the non-zero elements."""
+        rows, cols, rij, _ = self._elements
+        return rij - np.einsum("ij,ij->j", coords[:, rows], coords[:, cols])
 
     def compute_functional(self, x):
         """Compute the target function at coordinates `x`.
@@ -319,18 +367,19 @@ def compute_functional(self, x):
           f (float): The value of the target function at coordinates `x`.
 
         """
-        assert (x.size() // self.dim) == (self._lattices.size() * len(self._sym_ops))
-        inner = self.rij_matrix.deep_copy()
-        NN = x.size() // self.dim
-        for i in range(self.dim):
-            coord = x[i * NN : (i + 1) * NN]
-            outer_prod = coord.matrix_outer_product(coord)
-            inner -= outer_prod
-        elements = inner * inner
-        if self.wij_matrix is not None:
-            elements = self.wij_matrix * elements
-        f = 0.5 * flex.sum(elements)
-        return f
+        coords = self._coordinates(x)
+        rows, cols, rij, wij = self._elements
+        residuals = self._residuals(coords)
+        if wij is not None:
+            return 0.5 * np.sum(wij * residuals ** 2)
+        # Without weights, every element contributes to the target function.
+        # The sum of squares of the outer product over all elements is given
+        # by the (dim, dim) product of the coordinates, so only subtract it
+        # for the non-zero elements of rij rather than forming it in full.
+        outer = rij - residuals
+        coords_coords_t = coords.dot(coords.T)
+        f = np.sum(residuals ** 2) - np.sum(outer ** 2) + np.sum(coords_coords_t ** 2)
+        return 0.5 * f
 
     def compute_gradients_fd(self, x, eps=1e-6):
         """Compute the gradients at coordinates `x` using finite differences.
@@ -373,35 +422,24 @@ def compute_functional_and_gradients(self, x):
 
         """
         f = self.compute_functional(x)
-        grad = flex.double()
-        if self.wij_matrix is not None:
-            wrij_matrix = self.wij_matrix * self.rij_matrix
+        coords = self._coordinates(x)
+        rows, cols, rij, wij = self._elements
+        NN = coords.shape[1]
+
+        if wij is None:
+            # Every element of rij contributes, so use the full outer product
+            grad = self.rij_matrix.dot(coords.T) - coords.T.dot(coords.dot(coords.T))
         else:
-            wrij_matrix = self.rij_matrix
-
-        coords = []
-        NN = x.size() // self.dim
-        for i in range(self.dim):
-            coords.append(x[i * NN : (i + 1) * NN])
-
-        # term 1
-        for i in range(self.dim):
-            grad.extend(wrij_matrix.matrix_multiply(coords[i]))
-
-        for i in range(self.dim):
-            tmp_array = flex.double()
-            tmp = coords[i].matrix_outer_product(coords[i])
-            if self.wij_matrix is not None:
-                tmp = self.wij_matrix * tmp
-            for j in range(self.dim):
-                tmp_array.extend(tmp.matrix_multiply(coords[j]))
-            grad -= tmp_array
+            residuals = wij * self._residuals(coords)
+            grad = sparse.csr_matrix((residuals, (rows, cols)), shape=(NN, NN)).dot(
+                coords.T
+            )
         grad *= -2
 
         # grad_fd = self.compute_gradients_fd(x)
         # assert grad.all_approx_equal_relatively(grad_fd, relative_error=1e-4)
 
-        return f, grad
+        return f, flex.double(np.ascontiguousarray(grad.T).ravel())
 
     def curvatures(self, x):
         """Compute the curvature of the target function.
@@ -416,21 +454,16 @@ def curvatures(self, x):
           curvs (scitbx.array_family.flex.double):
           The curvature of the target function with respect to the parameters.
         """
-        coords = []
-        NN = x.size() // self.dim
-        for i in range(self.dim):
-            coords.append(x[i * NN : (i + 1) * NN])
-
-        curvs = flex.double()
+        coords = self._coordinates(x)
         if self.wij_matrix is not None:
-            wij = self.wij_matrix
+            curvs = self.wij_matrix.dot((coords ** 2).T)
         else:
-            wij = flex.double(self.rij_matrix.accessor(), 1)
-        for i in range(self.dim):
-            curvs.extend(wij.matrix_multiply(coords[i] * coords[i]))
+            curvs = np.repeat(
+                np.sum(coords ** 2, axis=1)[np.newaxis], coords.shape[1], 0
+            )
         curvs *= 2
 
-        return curvs
+        return flex.double(np.ascontiguousarray(curvs.T).ravel())
 
     def curvatures_fd(self, x, eps=1e-6):
         """Compute the curvatures at coordinates `x` using finite differences.
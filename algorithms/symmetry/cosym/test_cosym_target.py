@@ -28,7 +28,7 @@ def test_cosym_target(space_group):
         m = len(t.get_sym_ops())
         n = len(datasets)
         assert t.dim == m
-        assert t.rij_matrix.all() == (n * m, n * m)
+        assert t.rij_matrix.shape == (n * m, n * m)
         x = flex.random_double(n * m * t.dim)
         x_orig = x.deep_copy()
         f0, g = t.compute_functional_and_gradients(x)
@@ -48,3 +48,62 @@ def test_cosym_target(space_group):
         assert f < f0
         assert pytest.approx(g, abs=1e-3) == [0] * len(g)
         assert pytest.approx(g_fd, abs=1e-3) == [0] * len(g)
+
+
+@pytest.mark.parametrize("space_group", ["P2", "P6", "I23"])
+def test_cosym_target_rij_matrix(space_group):
+    from cctbx import miller
+
+    datasets, expected_reindexing_ops = generate_test_data(
+        space_group=sgtbx.space_group_info(symbol=space_group).group(), sample_size=8
+    )
+
+    intensities = datasets[0]
+    dataset_ids = flex.double(intensities.size(), 0)
+    for i, d in enumerate(datasets[1:]):
+        intensities = intensities.concatenate(d, assert_is_similar_symmetry=False)
+        dataset_ids.extend(flex.double(d.size(), i + 1))
+
+    t = target.Target(intensities, dataset_ids, weights="count")
+    sym_ops = [sgtbx.change_of_basis_op(op) for op in t.get_sym_ops()]
+    n_lattices = len(datasets)
+    NN = n_lattices * len(sym_ops)
+    assert t.rij_matrix.shape == (NN, NN)
+
+    # Compare against a direct calculation for each pair of lattices
+    data = t._data
+    bounds = list(t._lattices) + [data.size()]
+    space_group_type = data.space_group().type()
+    for i in range(n_lattices):
+        for j in range(n_lattices):
+            for k, cb_op_k in enumerate(sym_ops):
+                for kk, cb_op_kk in enumerate(sym_ops):
+                    ik = i + n_lattices * k
+                    jk = j + n_lattices * kk
+                    if i == j and k == kk:
+                        assert t.rij_matrix[ik, jk] == 0
+                        continue
+                    indices = []
+                    for lattice, cb_op in ((i, cb_op_k), (j, cb_op_kk)):
+                        reindexed = cb_op.apply(
+                            data.indices()[bounds[lattice] : bounds[lattice + 1]]
+                        )
+                        miller.map_to_asu(space_group_type, False, reindexed)
+                        indices.append(reindexed)
+                    pairs = miller.match_indices(indices[0], indices[1]).pairs()
+                    isel_i = pairs.column(0)
+                    isel_j = pairs.column(1)
+                    sel = t._patterson_group.epsilon(indices[0].select(isel_i)) == 1
+                    corr = flex.linear_correlation(
+                        data.data()[bounds[i] : bounds[i + 1]].select(
+                            isel_i.select(sel)
+                        ),
+                        data.data()[bounds[j] : bounds[j + 1]].select(
+                            isel_j.select(sel)
+                        ),
+                    )
+                    if corr.is_well_defined():
+                        assert t.rij_matrix[ik, jk] == pytest.approx(corr.coefficient())
+                        assert t.wij_matrix[ik, jk] == 2 * corr.n()
+                    else:
+                        assert t.rij_matrix[ik, jk] == 0
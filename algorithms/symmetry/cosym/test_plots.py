@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 from dials.algorithms.symmetry.cosym import plots
+from scipy import sparse
 from scitbx.array_family import flex
 
 
@@ -22,3 +23,7 @@ def test_plot_rij_histogram():
     d = plots.plot_rij_histogram(rij_matrix)
     assert "cosym_rij_histogram" in d
     assert sum(d["cosym_rij_histogram"]["data"][0]["y"]) == 16
+
+    rij_matrix = sparse.random(8, 8, density=0.25, format="csr")
+    d = plots.plot_rij_histogram(rij_matrix)
+    assert sum(d["cosym_rij_histogram"]["data"][0]["y"]) == 16
@@ -0,0 +1,524 @@
+"""
+A columnar on-disk format for reflection tables.
+
+A file consists of one or more row groups, each holding a contiguous block of
+rows. Within a row group each column is stored as an independent
+msgpack-encoded single column reflection table. A JSON index (footer) gives the
+number of rows and the byte offset and size of each column in each row group,
+along with the experiment identifiers. The file layout is:
+
+    MAGIC | group 0 columns | group 1 columns | ... | index | index size | MAGIC
+
+Since the index is at the end, tables can be written incrementally, one row
+group and one column at a time, without holding the whole serialised table in
+memory. Reading memory-maps the file so that only the columns (and row groups)
+which are requested are ever read from disk and deserialised; e.g. the
+intensities of an integrated dataset can be loaded without touching the
+shoeboxes, or a very large file can be processed a chunk at a time.
+
+Columns may optionally be compressed. The serialised column is split into
+fixed size blocks which are compressed independently, so that encoding and
+decoding of large columns (typically the shoeboxes) can be spread over several
+threads. The compression codec and compressed block sizes are recorded per
+column in the index.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import json
+import mmap
+import struct
+import zlib
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+MAGIC = b"DIALSCOL"
+VERSION = 1
+
+_footer = struct.Struct("<Q8s")
+
+# The size of the blocks in which columns are compressed
+BLOCK_SIZE = 1 << 22
+
+# The default number of rows in each row group, which bounds the memory needed
+# to read the file a chunk at a time
+ROW_GROUP_SIZE = 100000
+
+
+def _zlib_compress(data):
+    return zlib.compress(data, 1)
+
+
+def _lz4_compress(data):
+    return lz4.block.compress(data, store_size=True)
+
+
+def _lz4_decompress(data):
+    return lz4.block.decompress(data)
+
+
+_codecs = {"zlib": (_zlib_compress, zlib.decompress)}
+if lz4 is not None:
+    _codecs["lz4"] = (_lz4_compress, _lz4_decompress)
+
+
+def available_compression():
+    """
+    :return: The names of the available compression codecs
+
+    """
+    return sorted(_codecs.keys())
+
+
+def _map_blocks(func, blocks, nthreads):
+    """
+    Apply a (de)compression function to a list of blocks, optionally using a
+    pool of threads. Both zlib and lz4 release the GIL while working.
+
+    """
+    if nthreads > 1 and len(blocks) > 1:
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(nthreads, len(blocks))
+        ) as executor:
+            return list(executor.map(func, blocks))
+    return [func(block) for block in blocks]
+
+
+def compress_blocks(data, codec, nthreads=1):
+    """
+    Compress data in independent blocks.
+
+    :param data: The bytes to compress
+    :param codec: The name of the compression codec
+    :param nthreads: The number of threads to use
+    :return: A list of compressed blocks
+
+    """
+    compress = _codecs[codec][0]
+    blocks = [data[i : i + BLOCK_SIZE] for i in range(0, len(data), BLOCK_SIZE)]
+    return _map_blocks(compress, blocks, nthreads)
+
+
+def decompress_blocks(blocks, codec, nthreads=1):
+    """
+    Decompress a list of independently compressed blocks.
+
+    :param blocks: The list of compressed blocks
+    :param codec: The name of the compression codec
+    :param nthreads: The number of threads to use
+    :return: The decompressed bytes
+
+    """
+    decompress = _codecs[codec][1]
+    return b"".join(_map_blocks(decompress, blocks, nthreads))
+
+
+def is_columnar_file(filename):
+    """
+    Check if a file is in the columnar reflection table format.
+
+    :param filename: The filename
+    :return: True/False the file is a columnar file
+
+    """
+    try:
+        with open(filename, "rb") as infile:
+            return infile.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def write_columnar_file(table, filename, chunk_size=None, compression=None, nthreads=1):
+    """
+    Write a reflection table to file in the columnar format.
+
+    :param table: The reflection table
+    :param filename: The output filename
+    :param chunk_size: The number of rows in each row group (default
+                       ROW_GROUP_SIZE)
+    :param compression: The compression codec (default none)
+    :param nthreads: The number of threads to use for compression
+
+    """
+    if chunk_size is None:
+        chunk_size = ROW_GROUP_SIZE
+    assert chunk_size > 0, "Chunk size must be > 0"
+    with ColumnarReflectionWriter(
+        filename, compression=compression, nthreads=nthreads
+    ) as writer:
+        writer.add_experiment_identifiers(table)
+        if len(table) == 0:
+            writer.write(table)
+        for i in range(0, len(table), chunk_size):
+            writer.write(table[i : i + chunk_size])
+
+
+class ColumnarReflectionWriter(object):
+    """
+    An incremental writer for reflection tables in the columnar format.
+
+    Each call to write appends a row group to the file, so a table can be
+    written in bounded memory a chunk at a time. All chunks must have the same
+    columns. The index is written when the writer is closed.
+
+    """
+
+    def __init__(self, filename, compression=None, nthreads=1):
+        """
+        Open the file for writing.
+
+        :param filename: The output filename
+        :param compression: The compression codec (default none)
+        :param nthreads: The number of threads to use for compression
+
+        """
+        if compression is not None and compression not in _codecs:
+            raise RuntimeError(
+                "Unknown compression %s (available: %s)"
+                % (compression, ", ".join(available_compression()))
+            )
+        assert nthreads > 0, "Invalid number of threads"
+        self.compression = compression
+        self.nthreads = nthreads
+        self.filename = filename
+        self._file = open(filename, "wb")
+        self._file.write(MAGIC)
+        self._keys = None
+        self._groups = []
+        self._identifiers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def nrows(self):
+        """
+        :return: The number of rows written so far
+
+        """
+        return sum(group["nrows"] for group in self._groups)
+
+    def add_experiment_identifiers(self, table):
+        """
+        Merge the experiment identifiers of a table into those of the file.
+
+        :param table: The reflection table
+
+        """
+        for i, identifier in zip(
+            table.experiment_identifiers().keys(),
+            table.experiment_identifiers().values(),
+        ):
+            if self._identifiers.setdefault(i, identifier) != identifier:
+                raise RuntimeError("Inconsistent experiment identifiers for id %d" % i)
+
+    def write(self, table):
+        """
+        Append a chunk of rows to the file.
+
+        :param table: The reflection table chunk
+
+        """
+        from dials.array_family import flex
+
+        assert not self._file.closed, "Writer is closed"
+        keys = sorted(table.keys())
+        if self._keys is None:
+            self._keys = keys
+        elif keys != self._keys:
+            raise RuntimeError(
+                "Columns of chunk do not match: %s != %s" % (keys, self._keys)
+            )
+
+        self.add_experiment_identifiers(table)
+
+        # Write each column in turn
+        columns = []
+        for key in keys:
+            column = flex.reflection_table(table.nrows())
+            column[key] = table[key]
+            data = column.as_msgpack()
+            del column
+            offset = self._file.tell()
+            if self.compression is None:
+                columns.append([key, offset, len(data)])
+                self._file.write(data)
+            else:
+                blocks = compress_blocks(data, self.compression, self.nthreads)
+                sizes = [len(block) for block in blocks]
+                columns.append([key, offset, sum(sizes), self.compression, sizes])
+                for block in blocks:
+                    self._file.write(block)
+                del blocks
+            del data
+        self._groups.append({"nrows": table.nrows(), "columns": columns})
+
+    def close(self):
+        """
+        Write the index and close the file.
+
+        """
+        if self._file.closed:
+            return
+        index = json.dumps(
+            {
+                "version": VERSION,
+                "nrows": self.nrows(),
+                "identifiers": {str(k): v for k, v in self._identifiers.items()},
+                "row_groups": self._groups,
+            }
+        ).encode("utf-8")
+        self._file.write(index)
+        self._file.write(_footer.pack(len(index), MAGIC))
+        self._file.close()
+
+
+class ColumnarReflectionFile(object):
+    """
+    A lazy reader for reflection tables in the columnar format.
+
+    The file is memory mapped on construction and only the index is parsed.
+    Individual columns and row groups are deserialised on request.
+
+    """
+
+    def __init__(self, filename, nthreads=1):
+        """
+        Open the file and read the index.
+
+        :param filename: The filename
+        :param nthreads: The number of threads to use for decompression
+
+        """
+        assert nthreads > 0, "Invalid number of threads"
+        self.nthreads = nthreads
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self._file.close()
+            raise RuntimeError("%s is not a columnar reflection file" % filename)
+        try:
+            if self._map[: len(MAGIC)] != MAGIC or len(self._map) < (
+                len(MAGIC) + _footer.size
+            ):
+                raise RuntimeError("%s is not a columnar reflection file" % filename)
+            index_size, magic = _footer.unpack(self._map[-_footer.size :])
+            if magic != MAGIC:
+                raise RuntimeError("%s is truncated or corrupt" % filename)
+            index_end = len(self._map) - _footer.size
+            index = json.loads(
+                self._map[index_end - index_size : index_end].decode("utf-8")
+            )
+            if index["version"] != VERSION:
+                raise RuntimeError(
+                    "%s: expected version %d, got %s"
+                    % (filename, VERSION, index["version"])
+                )
+        except Exception:
+            self.close()
+            raise
+        self._nrows = index["nrows"]
+        self._identifiers = {int(k): v for k, v in index["identifiers"].items()}
+        self._groups = [
+            (
+                group["nrows"],
+                collections.OrderedDict(
+                    (column[0], tuple(column[1:])) for column in group["columns"]
+                ),
+            )
+            for group in index["row_groups"]
+        ]
+
+    def close(self):
+        """
+        Close the file.
+
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """
+        :return: The number of rows
+
+        """
+        return self._nrows
+
+    def nrows(self):
+        """
+        :return: The number of rows
+
+        """
+        return self._nrows
+
+    def keys(self):
+        """
+        :return: The names of the columns
+
+        """
+        if not self._groups:
+            return []
+        return list(self._groups[0][1].keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def experiment_identifiers(self):
+        """
+        :return: A dictionary of experiment id to identifier
+
+        """
+        return dict(self._identifiers)
+
+    def column_size(self, key):
+        """
+        :param key: The column name
+        :return: The size of the serialised column in bytes
+
+        """
+        return sum(columns[key][1] for nrows, columns in self._groups)
+
+    def num_row_groups(self):
+        """
+        :return: The number of row groups in the file
+
+        """
+        return len(self._groups)
+
+    def _read_column(self, group, key):
+        """
+        Read a column of a row group as a single column reflection table.
+
+        """
+        from dials.array_family import flex
+
+        nrows, columns = self._groups[group]
+        if key not in columns:
+            raise KeyError(key)
+        offset, size = columns[key][0:2]
+        if len(columns[key]) == 2:
+            data = self._map[offset : offset + size]
+        else:
+            codec, sizes = columns[key][2:4]
+            if codec not in _codecs:
+                raise RuntimeError(
+                    "Column %s is compressed with unavailable codec %s" % (key, codec)
+                )
+            blocks = []
+            for block_size in sizes:
+                blocks.append(self._map[offset : offset + block_size])
+                offset += block_size
+            data = decompress_blocks(blocks, codec, self.nthreads)
+            del blocks
+        column = flex.reflection_table.from_msgpack(data)
+        assert column.nrows() == nrows, "Inconsistent number of rows"
+        return column
+
+    def __getitem__(self, key):
+        """
+        Read a single column.
+
+        :param key: The column name
+        :return: The column data
+
+        """
+        if key not in self:
+            raise KeyError(key)
+        column = self._read_column(0, key)
+        for group in range(1, len(self._groups)):
+            column.extend(self._read_column(group, key))
+        return column[key]
+
+    def row_group(self, group, columns=None):
+        """
+        Read a single row group.
+
+        :param group: The row group index
+        :param columns: The columns to read (default all)
+        :return: The reflection table
+
+        """
+        from dials.array_family import flex
+
+        if columns is None:
+            columns = self.keys()
+        table = flex.reflection_table(self._groups[group][0])
+        for key in columns:
+            table[key] = self._read_column(group, key)[key]
+        self._set_identifiers(table)
+        return table
+
+    def iter_chunks(self, nrows=None, columns=None):
+        """
+        Iterate through the file in chunks of rows. Only a single chunk (plus at
+        most one row group) is held in memory at any time.
+
+        :param nrows: The number of rows per chunk (default one row group)
+        :param columns: The columns to read (default all)
+        :return: An iterator of reflection tables
+
+        """
+        if nrows is None:
+            for group in range(len(self._groups)):
+                yield self.row_group(group, columns)
+            return
+        assert nrows > 0, "Chunk size must be > 0"
+        pending = None
+        for group in range(len(self._groups)):
+            table = self.row_group(group, columns)
+            if pending is not None:
+                pending.extend(table)
+                table = pending
+            start = 0
+            while len(table) - start >= nrows:
+                chunk = table[start : start + nrows]
+                self._set_identifiers(chunk)
+                yield chunk
+                start += nrows
+            pending = table[start:] if start < len(table) else None
+        if pending is not None:
+            self._set_identifiers(pending)
+            yield pending
+
+    def as_reflection_table(self, columns=None):
+        """
+        Create a reflection table from the file.
+
+        :param columns: The columns to read (default all)
+        :return: The reflection table
+
+        """
+        from dials.array_family import flex
+
+        if columns is None:
+            columns = self.keys()
+        table = flex.reflection_table(self._nrows)
+        for key in columns:
+            table[key] = self[key]
+        self._set_identifiers(table)
+        return table
+
+    def _set_identifiers(self, table):
+        for i, identifier in self._identifiers.items():
+            table.experiment_identifiers()[i] = identifier
@@ -174,12 +174,13 @@ def from_predictions_multi(
         return result
 
     @staticmethod
-    def from_observations(experiments, params=None):
+    def from_observations(experiments, params=None, mask_generator=None):
         """
         Construct a reflection table from observations.
 
         :param experiments: The experiments
         :param params: The input parameters
+        :param mask_generator: Use this mask generator instead of the default
         :return: The reflection table of observations
 
         """
@@ -209,6 +210,8 @@ def from_observations(experiments, params=None):
         find_spots = SpotFinderFactory.from_parameters(
             experiments=experiments, params=params
         )
+        if mask_generator is not None:
+            find_spots.mask_generator = mask_generator
 
         # Find the spots
         return find_spots(experiments)
@@ -270,6 +273,90 @@ def from_msgpack_file(filename):
             pass
         return reflection_table.from_msgpack(infile_data)
 
+    def as_columnar_file(self, filename, chunk_size=None, compression=None, nthreads=1):
+        """
+        Write the reflection table to file in the columnar format, in which each
+        column can be read independently of the others.
+
+        :param filename: The output filename
+        :param chunk_size: The number of rows in each row group (default
+                           100000), which bounds the memory used to read the
+                           file in chunks
+        :param compression: Compress the columns with zlib or lz4 (default none)
+        :param nthreads: The number of threads to use for compression
+
+        """
+        from dials.array_family.columnar import write_columnar_file
+
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+
+        # Clean up any removed experiments from the identifiers map
+        self.clean_experiment_identifiers_map()
+        write_columnar_file(
+            self,
+            filename,
+            chunk_size=chunk_size,
+            compression=compression,
+            nthreads=nthreads,
+        )
+
+    @staticmethod
+    def from_columnar_file(filename, columns=None, nthreads=1):
+        """
+        Read the reflection table from file in the columnar format. The file is
+        memory mapped and only the requested columns are deserialised.
+
+        :param filename: The input filename
+        :param columns: The list of columns to read (default all)
+        :param nthreads: The number of threads to use for decompression
+        :return: The reflection table
+
+        """
+        from dials.array_family.columnar import ColumnarReflectionFile
+
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        with ColumnarReflectionFile(filename, nthreads=nthreads) as infile:
+            return infile.as_reflection_table(columns)
+
+    @staticmethod
+    def iter_chunks(filename, nrows=None, columns=None):
+        """
+        Iterate through a reflection file in chunks of rows. For files in the
+        columnar format only one chunk is held in memory at a time; other formats
+        must be read in full and are then split into chunks. Chunks can be
+        written incrementally with
+        dials.array_family.columnar.ColumnarReflectionWriter.
+
+        :param filename: The input filename
+        :param nrows: The number of rows per chunk (default one row group)
+        :param columns: The list of columns to read (default all)
+        :return: An iterator of reflection tables
+
+        """
+        from dials.array_family.columnar import (
+            ColumnarReflectionFile,
+            is_columnar_file,
+        )
+
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        if is_columnar_file(filename):
+            with ColumnarReflectionFile(filename) as infile:
+                for chunk in infile.iter_chunks(nrows=nrows, columns=columns):
+                    yield chunk
+            return
+        table = reflection_table.from_file(filename)
+        if columns is not None:
+            for key in list(table.keys()):
+                if key not in columns:
+                    del table[key]
+        if nrows is None:
+            nrows = max(1, len(table))
+        for i in range(0, len(table), nrows):
+            yield table[i : i + nrows]
+
     @staticmethod
     def from_h5(filename):
         """
@@ -288,10 +375,13 @@ def from_h5(filename):
 
     def as_file(self, filename):
         """
-        Write the reflection table to file in either msgpack or pickle format
+        Write the reflection table to file in either columnar, msgpack or pickle
+        format
 
         """
-        if os.getenv("DIALS_USE_MESSAGEPACK"):
+        if os.getenv("DIALS_USE_COLUMNAR"):
+            self.as_columnar_file(filename)
+        elif os.getenv("DIALS_USE_MESSAGEPACK"):
             self.as_msgpack_file(filename)
         else:
             self.as_pickle(filename)
@@ -299,9 +389,15 @@ def as_file(self, filename):
     @staticmethod
     def from_file(filename):
         """
-        Read the reflection table from either pickle or msgpack
+        Read the reflection table from either columnar, pickle or msgpack
 
         """
+        from dials.array_family.columnar import is_columnar_file
+
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        if is_columnar_file(filename):
+            return reflection_table.from_columnar_file(filename)
         try:
             return reflection_table.from_msgpack_file(filename)
         except RuntimeError:
@@ -24,6 +24,13 @@ def work(host, port, filename, params):
     return conn.getresponse().read()
 
 
+def work_batch(host, port, filenames, params):
+    conn = httplib.HTTPConnection(host, port)
+    body = json.dumps({"filenames": filenames, "params": params})
+    conn.request("POST", "/", body, {"Content-type": "application/json"})
+    return conn.getresponse().read()
+
+
 def _nproc():
     from libtbx.introspection import number_of_processors
 
@@ -90,21 +97,27 @@ def work_all(
     json_file=None,
     grid=None,
     nproc=None,
+    batch=False,
 ):
     from multiprocessing.pool import ThreadPool as thread_pool
 
-    if nproc is None:
-        nproc = _nproc()
-    pool = thread_pool(processes=nproc)
-    threads = {}
-    for filename in filenames:
-        threads[filename] = pool.apply_async(work, (host, port, filename, params))
-    results = []
-    for filename in filenames:
-        response = threads[filename].get()
-        d = json.loads(response)
-        results.append(d)
-        print(response_to_xml(d))
+    if batch:
+        results = json.loads(work_batch(host, port, filenames, params))
+        for d in results:
+            print(response_to_xml(d))
+    else:
+        if nproc is None:
+            nproc = _nproc()
+        pool = thread_pool(processes=nproc)
+        threads = {}
+        for filename in filenames:
+            threads[filename] = pool.apply_async(work, (host, port, filename, params))
+        results = []
+        for filename in filenames:
+            response = threads[filename].get()
+            d = json.loads(response)
+            results.append(d)
+            print(response_to_xml(d))
 
     if json_file is not None:
         "Writing results to %s" % json_file
@@ -202,6 +215,9 @@ def stop(host, port, nproc):
   .type = path
 grid = None
   .type = ints(size=2, value_min=1)
+batch = False
+  .type = bool
+  .help = "Send all the images to the server in a single request"
 """
 )
 
@@ -258,4 +274,5 @@ def stop(host, port, nproc):
                 json_file=params.json,
                 grid=params.grid,
                 nproc=nproc,
+                batch=params.batch,
             )
@@ -1,14 +1,17 @@
 from __future__ import absolute_import, division, print_function
 
 import BaseHTTPServer as server_base
+import copy
+import json
 import logging
 import os
 import sys
 import time
-from multiprocessing import Process
+from collections import OrderedDict
 
 import libtbx.load_env
 import libtbx.phil
+from six.moves import socketserver
 
 from dials.util import Sorry
 
@@ -60,17 +63,23 @@
 
   dials.find_spots_client stop [host=hostname] [port=1234]
 
-"""
+The server handles each request in a separate thread and passes the work to a
+persistent pool of nproc worker processes. Each worker caches the parsed
+parameters and the static parts of the image mask between requests, so
+repeated requests for images from the same dataset avoid most of the setup
+cost. Several images may be sent in a single request with::
 
-stop = False
+  dials.find_spots_client batch=True /path/to/image_*.cbf
 
+which POSTs a JSON document of the form
+``{"filenames": [...], "params": [...]}`` and returns a JSON list of results.
 
-def work(filename, cl=None):
-    if cl is None:
-        cl = []
+"""
 
-    phil_scope = libtbx.phil.parse(
-        """\
+stop = False
+
+work_phil_scope = libtbx.phil.parse(
+    """\
 ice_rings {
   filter = True
     .type = bool
@@ -84,35 +93,77 @@ def work(filename, cl=None):
 indexing_min_spots = 10
   .type = int(value_min=1)
 """
-    )
+)
+
+# The parsed parameters for recent requests, which persist in each worker
+# process between requests
+_parameter_cache = OrderedDict()
+max_parameter_cache_size = 16
+
+
+def _parse_parameters(cl):
+    """
+    Parse the server and spot finding parameters, reusing the result of a
+    previous request with the same command line parameters.
+
+    :param cl: The list of command line parameters
+    :return: A tuple of (server params, spot finding params, unhandled
+             parameters, mask generator)
+    """
+    key = tuple(cl)
+    if key in _parameter_cache:
+        cached = _parameter_cache.pop(key)
+    else:
+        from dials.command_line.find_spots import phil_scope as find_spots_phil_scope
+        from dials.util.masking import CachedMaskGenerator
+
+        interp = work_phil_scope.command_line_argument_interpreter()
+        params, unhandled = interp.process_and_fetch(
+            cl, custom_processor="collect_remaining"
+        )
+        server_params = params.extract()
+
+        interp = find_spots_phil_scope.command_line_argument_interpreter()
+        phil_scope, unhandled = interp.process_and_fetch(
+            unhandled, custom_processor="collect_remaining"
+        )
+        logger.info("The following spotfinding parameters have been modified:")
+        logger.info(find_spots_phil_scope.fetch_diff(source=phil_scope).as_str())
+        params = phil_scope.extract()
+        # no need to write the hot mask in the server/client
+        params.spotfinder.write_hot_mask = False
+        mask_generator = CachedMaskGenerator(params.spotfinder.filter)
+        cached = (server_params, params, unhandled, mask_generator)
+        while len(_parameter_cache) >= max_parameter_cache_size:
+            _parameter_cache.popitem(last=False)
+    _parameter_cache[key] = cached
+
+    # The spot finder modifies its parameters, so give each request a copy
+    server_params, params, unhandled, mask_generator = cached
+    return server_params, copy.deepcopy(params), list(unhandled), mask_generator
+
+
+def work(filename, cl=None):
+    if cl is None:
+        cl = []
+
     if not os.access(filename, os.R_OK):
         raise RuntimeError("Server does not have read access to file %s" % filename)
-    interp = phil_scope.command_line_argument_interpreter()
-    params, unhandled = interp.process_and_fetch(
-        cl, custom_processor="collect_remaining"
-    )
-    filter_ice = params.extract().ice_rings.filter
-    ice_rings_width = params.extract().ice_rings.width
-    index = params.extract().index
-    integrate = params.extract().integrate
-    indexing_min_spots = params.extract().indexing_min_spots
+    server_params, params, unhandled, mask_generator = _parse_parameters(cl)
+    filter_ice = server_params.ice_rings.filter
+    ice_rings_width = server_params.ice_rings.width
+    index = server_params.index
+    integrate = server_params.integrate
+    indexing_min_spots = server_params.indexing_min_spots
 
-    from dials.command_line.find_spots import phil_scope as find_spots_phil_scope
     from dxtbx.model.experiment_list import ExperimentListFactory
     from dials.array_family import flex
 
-    interp = find_spots_phil_scope.command_line_argument_interpreter()
-    phil_scope, unhandled = interp.process_and_fetch(
-        unhandled, custom_processor="collect_remaining"
-    )
-    logger.info("The following spotfinding parameters have been modified:")
-    logger.info(find_spots_phil_scope.fetch_diff(source=phil_scope).as_str())
-    params = phil_scope.extract()
-    # no need to write the hot mask in the server/client
-    params.spotfinder.write_hot_mask = False
     experiments = ExperimentListFactory.from_filenames([filename])
     t0 = time.time()
-    reflections = flex.reflection_table.from_observations(experiments, params)
+    reflections = flex.reflection_table.from_observations(
+        experiments, params, mask_generator=mask_generator
+    )
     t1 = time.time()
     logger.info("Spotfinding took %.2f seconds" % (t1 - t0))
     from dials.algorithms.spot_finding import per_image_analysis
@@ -267,6 +318,23 @@ def work(filename, cl=None):
     return stats
 
 
+def work_wrapper(args):
+    """
+    Process a single image in a worker process.
+
+    :param args: A tuple of (filename, params)
+    :return: The dictionary of results
+    """
+    filename, params = args
+    d = {"image": filename}
+    try:
+        stats = work(filename, params)
+        d.update(stats)
+    except Exception as e:
+        d["error"] = str(e)
+    return d
+
+
 class handler(server_base.BaseHTTPRequestHandler):
     def do_GET(s):
         """Respond to a GET request."""
@@ -280,21 +348,39 @@ def do_GET(s):
         filename = s.path.split(";")[0]
         params = s.path.split(";")[1:]
 
-        d = {"image": filename}
+        d = s.server.pool.apply(work_wrapper, ((filename, params),))
 
-        try:
-            stats = work(filename, params)
-            d.update(stats)
+        response = json.dumps(d)
+        s.wfile.write(response)
 
+    def do_POST(s):
+        """Respond to a POST request with a batch of images."""
+        try:
+            length = int(s.headers.get("Content-Length", 0))
+            request = json.loads(s.rfile.read(length))
+            filenames = request["filenames"]
+            params = request.get("params", [])
         except Exception as e:
-            d["error"] = str(e)
+            s.send_error(400, "Invalid batch request: %s" % e)
+            return
+        s.send_response(200)
+        s.send_header("Content-type", "application/json")
+        s.end_headers()
 
-        import json
+        results = s.server.pool.map(
+            work_wrapper, [(filename, params) for filename in filenames]
+        )
 
-        response = json.dumps(d)
+        response = json.dumps(results)
         s.wfile.write(response)
 
 
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, server_base.HTTPServer):
+    """An HTTP server which handles each request in a new thread."""
+
+    daemon_threads = True
+
+
 def serve(httpd):
     try:
         while not stop:
@@ -314,16 +400,22 @@ def serve(httpd):
 
 
 def main(nproc, port):
-    server_class = server_base.HTTPServer
-    httpd = server_class(("", port), handler)
+    from multiprocessing import Pool
+
+    # Start the workers before the server so they don't inherit the socket
+    pool = Pool(processes=nproc)
+    httpd = ThreadedHTTPServer(("", port), handler)
+    httpd.pool = pool
+    # Wake up regularly to check whether the server has been stopped
+    httpd.timeout = 1
     print(time.asctime(), "Serving %d processes on port %d" % (nproc, port))
 
-    for j in range(nproc - 1):
-        proc = Process(target=serve, args=(httpd,))
-        proc.daemon = True
-        proc.start()
-    serve(httpd)
-    httpd.server_close()
+    try:
+        serve(httpd)
+    finally:
+        httpd.server_close()
+        pool.terminate()
+        pool.join()
     print(time.asctime(), "done")
 
 
@@ -54,8 +54,16 @@
       .type = str
       .help = "The image template"
 
+    write_images = True
+      .type = bool
+      .help = "Write the raw image data to the output directory"
+
   }
 
+  find_spots = False
+    .type = bool
+    .help = "Decode each image as it arrives and find the strong pixels"
+
   verbosity = 0
     .type = int(value_min=0)
     .help = "The verbosity level"
@@ -70,12 +78,45 @@
       .type = int
       .help = "The input port"
 
+    buffer_size = 16
+      .type = int(value_min=1)
+      .help = "The maximum number of messages to receive ahead of processing.
+               When the buffer is full the stream is not read, so the sender
+               is slowed down instead of the images accumulating in memory."
+
   }
 
-"""
+  include scope dials.algorithms.spot_finding.factory.phil_scope
+
+""",
+    process_includes=True,
 )
 
 
+class StreamSpotFinder(object):
+    """ Find the strong pixels on images decoded from the stream. """
+
+    def __init__(self, experiments, params):
+        """ Configure the threshold algorithm from the parameters. """
+        from dials.algorithms.spot_finding.factory import SpotFinderFactory
+
+        self.detector = experiments[0].detector
+        self.threshold_function = SpotFinderFactory.configure_threshold(
+            params, experiments
+        )
+
+    def __call__(self, count, data):
+        """ Find the strong pixels on an image and return the number found. """
+        assert len(self.detector) == 1, "Expected a single panel detector"
+        low, high = self.detector[0].get_trusted_range()
+        image = data.as_double()
+        mask = (image > low) & (image < high)
+        threshold_mask = self.threshold_function.compute_threshold(image, mask)
+        num_strong = threshold_mask.count(True)
+        logger.info("Found %d strong pixels on image %d" % (num_strong, count + 1))
+        return num_strong
+
+
 class Script(object):
     """ Class to parse the command line options. """
 
@@ -95,7 +136,7 @@ def run(self):
         from dials.util import log
         import libtbx
         from uuid import uuid4
-        from dials.util.stream import ZMQStream, Decoder
+        from dials.util.stream import ZMQStream, Decoder, StreamReceiver
         from os.path import join, exists
         import os
         import json
@@ -137,14 +178,18 @@ def run(self):
         # Make the directory
         os.mkdir(params.output.directory)
 
-        # Initialise the stream
-        stream = ZMQStream(params.input.host, params.input.port)
+        # Initialise the stream, receiving messages in a background thread
+        stream = ZMQStream(
+            params.input.host, params.input.port, hwm=params.input.buffer_size
+        )
+        receiver = StreamReceiver(stream, maxsize=params.input.buffer_size)
         decoder = Decoder(params.output.directory, params.output.image_template)
         imageset = None
+        spot_finder = None
         while True:
 
             # Get the frames from zmq
-            frames = stream.receive()
+            frames = receiver.receive()
 
             # Decode the frames
             obj = decoder.decode(frames)
@@ -157,19 +202,25 @@ def run(self):
                 imageset = obj.as_imageset(filename)
                 experiments = ExperimentListFactory.from_imageset(imageset)
                 self.write_experiments(experiments, params)
+                if params.find_spots:
+                    spot_finder = StreamSpotFinder(experiments, params)
             elif obj.is_image():
                 assert imageset is not None
-                filename = join(
-                    params.output.directory, params.output.image_template % obj.count
-                )
-                with open(filename, "wb") as outfile:
-                    outfile.write(obj.data)
-                filename = join(
-                    params.output.directory,
-                    "%s.info" % (params.output.image_template % obj.count),
-                )
-                with open(filename, "w") as outfile:
-                    json.dump(obj.info, outfile)
+                if params.output.write_images:
+                    filename = join(
+                        params.output.directory,
+                        params.output.image_template % obj.count,
+                    )
+                    with open(filename, "wb") as outfile:
+                        outfile.write(obj.data)
+                    filename = join(
+                        params.output.directory,
+                        "%s.info" % (params.output.image_template % obj.count),
+                    )
+                    with open(filename, "w") as outfile:
+                        json.dump(obj.info, outfile)
+                if spot_finder is not None:
+                    spot_finder(obj.count, obj.as_flex())
             elif obj.is_endofseries():
                 assert imageset is not None
                 break
@@ -177,6 +228,7 @@ def run(self):
                 raise RuntimeError("Unknown object")
 
         # Close the stream
+        receiver.join()
         stream.close()
 
     def write_experiments(self, experiments, params):
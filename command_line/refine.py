@@ -29,6 +29,7 @@
 """
 
 from __future__ import absolute_import, division, print_function
+import copy
 import sys
 import logging
 from time import time
@@ -39,6 +40,10 @@
 from dials.algorithms.refinement import RefinerFactory
 from dials.algorithms.refinement import DialsRefineConfigError, DialsRefineRuntimeError
 from dials.algorithms.refinement.corrgram import create_correlation_plots
+from dials.algorithms.refinement.engine import Journal
+from dials.algorithms.refinement.parameterisation.configure import (
+    independent_experiment_groups,
+)
 from dials.util import Sorry
 
 logger = logging.getLogger("dials.command_line.refine")
@@ -95,6 +100,16 @@
     .type = int(value_min=1)
     .help = "Number of macro-cycles of static refinement to perform"
 
+  independent_groups = False
+    .type = bool
+    .help = "Split the experiments into groups that share no refined models,"
+            "and refine each group separately, using up to"
+            "refinement.mp.nproc processes to refine groups concurrently."
+            "Outputs that describe a single refinement run (centroids,"
+            "parameter_table, matches and correlation_plot) are not available"
+            "in this mode."
+    .expert_level = 1
+
   include scope dials.algorithms.refinement.refiner.phil_scope
 """,
     process_includes=True,
@@ -258,6 +273,117 @@ def run_macrocycle(params, reflections, experiments):
     return refiner, reflections, history
 
 
+def _select_experiment_group(experiments, reflections, group):
+    """Select the experiments in a group and their reflections, with the
+    reflection ids renumbered to match the selected experiments."""
+
+    from dxtbx.model.experiment_list import ExperimentList
+
+    sub_experiments = ExperimentList([experiments[i] for i in group])
+
+    sel = flex.bool(len(reflections), False)
+    for i in group:
+        sel |= reflections["id"] == i
+    sub_reflections = reflections.select(sel)
+
+    ids = sub_reflections["id"]
+    new_ids = flex.int(len(sub_reflections), -1)
+    identifiers = reflections.experiment_identifiers()
+    sub_identifiers = sub_reflections.experiment_identifiers()
+    for k in list(sub_identifiers.keys()):
+        del sub_identifiers[k]
+    for new_id, old_id in enumerate(group):
+        new_ids.set_selected(ids == old_id, new_id)
+        if old_id in identifiers.keys():
+            sub_identifiers[new_id] = identifiers[old_id]
+    sub_reflections["id"] = new_ids
+
+    return sub_experiments, sub_reflections, sel
+
+
+def run_independent_groups(experiments, reflections, params, groups):
+    """Refine groups of experiments that share no refined models separately.
+
+    The groups are refined concurrently using up to refinement.mp.nproc
+    processes, then the refined models and updated reflections are merged
+    back into the input experiments and reflection table.
+
+    Args:
+        experiments: The initial dxtbx experimental geometry models
+        reflections: A reflection table containing observed centroids
+        params: The working PHIL parameters
+        groups: A list of lists of experiment indices, one list for each group
+
+    Returns:
+        tuple: The refined experiments, the updated reflection table and the
+            combined refinement history object.
+    """
+    from dxtbx.model.experiment_list import ExperimentListFactory
+    from libtbx import easy_mp
+
+    # each group is refined in a single process
+    group_params = copy.deepcopy(params)
+    group_params.independent_groups = False
+    group_params.refinement.mp.nproc = 1
+    group_params.output.correlation_plot.filename = None
+
+    def refine_group(group):
+        sub_experiments, sub_reflections, _ = _select_experiment_group(
+            experiments, reflections, group
+        )
+        sub_experiments, sub_reflections, _, history = run_dials_refine(
+            sub_experiments, sub_reflections, copy.deepcopy(group_params)
+        )
+        return sub_experiments.to_dict(), sub_reflections, history
+
+    nproc = min(params.refinement.mp.nproc, len(groups))
+    logger.info(
+        "Refining {} independent groups of experiments using {} processes".format(
+            len(groups), nproc
+        )
+    )
+    if nproc > 1:
+        results = easy_mp.parallel_map(
+            func=refine_group,
+            iterable=groups,
+            processes=nproc,
+            method="multiprocessing",
+            preserve_exception_message=True,
+        )
+    else:
+        results = [refine_group(group) for group in groups]
+
+    # merge the refined models and reflections back in. Only replace refined
+    # models, so that fixed models remain shared between the groups
+    options = params.refinement.parameterisation
+    reflections = reflections.copy()
+    histories = []
+    for group, (expt_dict, sub_reflections, history) in zip(groups, results):
+        sub_experiments = ExperimentListFactory.from_dict(expt_dict, check_format=False)
+        for i, expt in zip(group, sub_experiments):
+            if "all" not in options.beam.fix:
+                experiments[i].beam = expt.beam
+            if options.crystal.fix != "all":
+                experiments[i].crystal = expt.crystal
+            if options.detector.fix != "all":
+                experiments[i].detector = expt.detector
+            if "all" not in options.goniometer.fix:
+                experiments[i].goniometer = expt.goniometer
+
+        ids = sub_reflections["id"]
+        old_ids = flex.int(len(sub_reflections), -1)
+        for new_id, old_id in enumerate(group):
+            old_ids.set_selected(ids == new_id, old_id)
+        sub_reflections["id"] = old_ids
+        for k in list(sub_reflections.experiment_identifiers().keys()):
+            del sub_reflections.experiment_identifiers()[k]
+        _, _, sel = _select_experiment_group(experiments, reflections, group)
+        reflections.set_selected(sel, sub_reflections)
+        histories.append(history)
+
+    return experiments, reflections, Journal.combine(histories)
+
+
 def run_dials_refine(experiments, reflections, params):
     """Functional interface to tasks performed by the program dials.refine.
 
@@ -277,9 +403,21 @@ def run_dials_refine(experiments, reflections, params):
 
     Returns:
         tuple: The refined experiments, the updated reflection table, the
-            Refiner object and the refinement history object.
+            Refiner object and the refinement history object. The Refiner is
+            None if independent groups of experiments were refined separately.
     """
 
+    # Refine independent groups of experiments separately, if requested
+    if params.independent_groups:
+        groups = independent_experiment_groups(
+            params.refinement.parameterisation, experiments
+        )
+        if len(groups) > 1:
+            experiments, reflections, history = run_independent_groups(
+                experiments, reflections, params, groups
+            )
+            return experiments, reflections, None, history
+
     # Modify options if necessary
     if params.output.correlation_plot.filename is not None:
         params.refinement.refinery.journal.track_parameter_correlation = True
@@ -388,7 +526,7 @@ def run(args=None, phil=working_phil):
         logger.info(diff_phil)
 
     # Warn about potentially unhelpful options
-    if params.refinement.mp.nproc > 1:
+    if params.refinement.mp.nproc > 1 and not params.independent_groups:
         logger.warning(
             "WARNING: setting nproc > 1 is only helpful in rare "
             "circumstances. It is not recommended for typical data processing "
@@ -407,6 +545,17 @@ def run(args=None, phil=working_phil):
         logger.info("Final refined crystal model:")
         logger.info(crystals[0])
 
+    # Outputs that describe a single refinement run are not available when
+    # independent groups were refined separately
+    if refiner is None:
+        for option in ("centroids", "parameter_table", "matches"):
+            if getattr(params.output, option):
+                logger.info(
+                    "Not writing {} output for independent groups".format(option)
+                )
+                setattr(params.output, option, None)
+        params.output.correlation_plot.filename = None
+
     # Write table of centroids to file, if requested
     if params.output.centroids:
         logger.info(
@@ -136,6 +136,14 @@
     nproc = 1
       .type = int(value_min=1)
       .help = "The number of processes to use."
+    scheduler = static *dynamic
+      .type = choice
+      .help = How images are distributed between processes. With static, the  \
+              images are split into fixed chunks up front. With dynamic, each  \
+              process takes the next image from a shared queue as soon as it   \
+              is free, so that processes given many slow images do not hold up \
+              the whole job. For MPI, dynamic scheduling uses rank 0 to hand   \
+              out images and needs more than two ranks.
     glob = None
       .type = str
       .help = For MPI, for multifile data, mandatory blobs giving file paths
@@ -256,6 +264,104 @@ def do_import(filename, load_models=True):
     return experiments
 
 
+def work_queue_items(queue, iterable):
+    """Yield items of iterable as their indices are taken from the queue, until
+    a None sentinel is taken"""
+
+    while True:
+        i = queue.get()
+        if i is None:
+            return
+        yield iterable[i]
+
+
+def _work_queue_worker(do_work, i, queue, iterable):
+    """Call do_work(i, items) in a worker process, where items are taken from
+    the queue. The generator is created here, as it cannot be passed to a new
+    process."""
+
+    do_work(i, work_queue_items(queue, iterable))
+
+
+def run_work_queue(do_work, iterable, nproc):
+    """Process the items of iterable with nproc worker processes. Rather than
+    splitting the items into fixed chunks up front, each worker takes the next
+    item from a shared queue as soon as it is free. Worker i calls
+    do_work(i, items), where items yields the items taken by that worker.
+    Return a list of error messages for workers that failed."""
+
+    import multiprocessing
+
+    # only the indices of the items are queued
+    queue = multiprocessing.Queue()
+    for i in range(len(iterable)):
+        queue.put(i)
+    for i in range(nproc):
+        queue.put(None)
+
+    workers = [
+        multiprocessing.Process(
+            target=_work_queue_worker, args=(do_work, i, queue, iterable)
+        )
+        for i in range(nproc)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return [
+        "Process %d exited with code %d" % (i, worker.exitcode)
+        for i, worker in enumerate(workers)
+        if worker.exitcode != 0
+    ]
+
+
+# The MPI tag of the messages of the work queue, so that they cannot be confused
+# with other messages between ranks, such as the composite outputs gathered by
+# Processor.finalize
+MPI_WORK_QUEUE_TAG = 42
+
+
+def serve_mpi_work_queue(comm, iterable):
+    """On the server rank, send each item of iterable to the next client rank
+    that asks for work, then send a stop command to each client"""
+
+    from mpi4py import MPI
+
+    for item in iterable:
+        logger.debug("Getting next available process")
+        rankreq = comm.recv(source=MPI.ANY_SOURCE, tag=MPI_WORK_QUEUE_TAG)
+        logger.debug("Process %s is ready, sending %s", rankreq, item[0])
+        comm.send(item, dest=rankreq, tag=MPI_WORK_QUEUE_TAG)
+    # send a stop command to each process
+    logger.debug("MPI DONE, sending stops")
+    for rankreq in range(comm.Get_size() - 1):
+        rankreq = comm.recv(source=MPI.ANY_SOURCE, tag=MPI_WORK_QUEUE_TAG)
+        logger.debug("Sending stop to %d", rankreq)
+        comm.send("endrun", dest=rankreq, tag=MPI_WORK_QUEUE_TAG)
+    logger.debug("All stops sent.")
+
+
+def mpi_work_queue_items(comm):
+    """On a client rank, yield items received from the server rank, asking for
+    the next item each time the previous one has been processed"""
+
+    rank = comm.Get_rank()
+    while True:
+        # inform the server this process is ready for an event
+        logger.debug("Rank %d getting next task", rank)
+        comm.send(rank, dest=0, tag=MPI_WORK_QUEUE_TAG)
+        logger.debug("Rank %d waiting for response", rank)
+        item = comm.recv(source=0, tag=MPI_WORK_QUEUE_TAG)
+        if item == "endrun":
+            logger.debug("Rank %d received endrun", rank)
+            return
+        logger.debug("Rank %d beginning processing", rank)
+        yield item
+        logger.debug("Rank %d event processed", rank)
+
+
 class Script(object):
     """A class for running the script."""
 
@@ -402,40 +508,34 @@ def run(self):
                     split_experiments2.append(split_experiments[i])
             split_experiments = split_experiments2
 
-            # Wrapper function
-            def do_work(i, item_list):
-                processor = Processor(
-                    copy.deepcopy(params), composite_tag="%04d" % i, rank=i
-                )
-
-                for item in item_list:
-                    try:
-                        assert len(item[1]) == 1
-                        experiment = item[1][0]
-                        experiment.load_models()
-                        imageset = experiment.imageset
-                        update_geometry(imageset)
-                        experiment.beam = imageset.get_beam()
-                        experiment.detector = imageset.get_detector()
-                    except RuntimeError as e:
-                        logger.warning(
-                            "Error updating geometry on item %s, %s"
-                            % (str(item[0]), str(e))
-                        )
-                        continue
+            # Process a single item
+            def process_item(processor, item):
+                try:
+                    assert len(item[1]) == 1
+                    experiment = item[1][0]
+                    experiment.load_models()
+                    imageset = experiment.imageset
+                    update_geometry(imageset)
+                    experiment.beam = imageset.get_beam()
+                    experiment.detector = imageset.get_detector()
+                except RuntimeError as e:
+                    logger.warning(
+                        "Error updating geometry on item %s, %s"
+                        % (str(item[0]), str(e))
+                    )
+                    return
 
-                    if self.reference_detector is not None:
-                        from dxtbx.model import Detector
+                if self.reference_detector is not None:
+                    from dxtbx.model import Detector
 
-                        experiment = item[1][0]
-                        imageset = experiment.imageset
-                        imageset.set_detector(
-                            Detector.from_dict(self.reference_detector.to_dict())
-                        )
-                        experiment.detector = imageset.get_detector()
+                    experiment = item[1][0]
+                    imageset = experiment.imageset
+                    imageset.set_detector(
+                        Detector.from_dict(self.reference_detector.to_dict())
+                    )
+                    experiment.detector = imageset.get_detector()
 
-                    processor.process_experiments(item[0], item[1])
-                processor.finalize()
+                processor.process_experiments(item[0], item[1])
 
             iterable = list(zip(tags, split_experiments))
 
@@ -459,50 +559,43 @@ def do_work(i, item_list):
                     all_paths2.append(all_paths[i])
             all_paths = all_paths2
 
-            # Wrapper function
-            def do_work(i, item_list):
-                processor = Processor(
-                    copy.deepcopy(params), composite_tag="%04d" % i, rank=i
-                )
-                for item in item_list:
-                    tag, filename = item
+            # Process a single item
+            def process_item(processor, item):
+                tag, filename = item
 
-                    experiments = do_import(filename, load_models=True)
-                    imagesets = experiments.imagesets()
-                    if len(imagesets) == 0 or len(imagesets[0]) == 0:
-                        logger.info("Zero length imageset in file: %s" % filename)
-                        return
-                    if len(imagesets) > 1:
-                        raise Abort(
-                            "Found more than one imageset in file: %s" % filename
-                        )
-                    if len(imagesets[0]) > 1:
-                        raise Abort(
-                            "Found a multi-image file. Run again with pre_import=True"
-                        )
+                experiments = do_import(filename, load_models=True)
+                imagesets = experiments.imagesets()
+                if len(imagesets) == 0 or len(imagesets[0]) == 0:
+                    logger.info("Zero length imageset in file: %s" % filename)
+                    return
+                if len(imagesets) > 1:
+                    raise Abort("Found more than one imageset in file: %s" % filename)
+                if len(imagesets[0]) > 1:
+                    raise Abort(
+                        "Found a multi-image file. Run again with pre_import=True"
+                    )
 
-                    try:
-                        update_geometry(imagesets[0])
-                        experiment = experiments[0]
-                        experiment.beam = imagesets[0].get_beam()
-                        experiment.detector = imagesets[0].get_detector()
-                    except RuntimeError as e:
-                        logger.warning(
-                            "Error updating geometry on item %s, %s" % (tag, str(e))
-                        )
-                        continue
+                try:
+                    update_geometry(imagesets[0])
+                    experiment = experiments[0]
+                    experiment.beam = imagesets[0].get_beam()
+                    experiment.detector = imagesets[0].get_detector()
+                except RuntimeError as e:
+                    logger.warning(
+                        "Error updating geometry on item %s, %s" % (tag, str(e))
+                    )
+                    return
 
-                    if self.reference_detector is not None:
-                        from dxtbx.model import Detector
+                if self.reference_detector is not None:
+                    from dxtbx.model import Detector
 
-                        imageset = experiments[0].imageset
-                        imageset.set_detector(
-                            Detector.from_dict(self.reference_detector.to_dict())
-                        )
-                        experiments[0].detector = imageset.get_detector()
+                    imageset = experiments[0].imageset
+                    imageset.set_detector(
+                        Detector.from_dict(self.reference_detector.to_dict())
+                    )
+                    experiments[0].detector = imageset.get_detector()
 
-                    processor.process_experiments(tag, experiments)
-                processor.finalize()
+                processor.process_experiments(tag, experiments)
 
             iterable = list(zip(tags, all_paths))
 
@@ -512,6 +605,23 @@ def do_work(i, item_list):
                 print(tag)
             return
 
+        # Wrapper function. Items may be taken from a work queue as they are
+        # needed, in which case item_list is a generator. Each process uses a
+        # single Processor, so non-composite outputs are written as each image is
+        # processed and composite outputs when the process has finished.
+        def do_work(i, item_list, catch_errors=False):
+            processor = Processor(
+                copy.deepcopy(params), composite_tag="%04d" % i, rank=i
+            )
+            for item in item_list:
+                try:
+                    process_item(processor, item)
+                except Exception as e:
+                    if not catch_errors:
+                        raise
+                    print("Rank %d unhandled exception processing event" % i, str(e))
+            processor.finalize()
+
         # Process the data
         if params.mp.method == "mpi":
             from mpi4py import MPI
@@ -548,7 +658,8 @@ def do_work(i, item_list):
 
             log.config(params.verbosity, info=info_path, debug=debug_path)
 
-            if size <= 2:  # client/server only makes sense for n>2
+            # client/server only makes sense for n>2
+            if size <= 2 or params.mp.scheduler == "static":
                 subset = [
                     item for i, item in enumerate(iterable) if (i + rank) % size == 0
                 ]
@@ -556,43 +667,26 @@ def do_work(i, item_list):
             else:
                 if rank == 0:
                     # server process
-                    for item in iterable:
-                        print("Getting next available process")
-                        rankreq = comm.recv(source=MPI.ANY_SOURCE)
-                        print("Process %s is ready, sending %s\n" % (rankreq, item[0]))
-                        comm.send(item, dest=rankreq)
-                    # send a stop command to each process
-                    print("MPI DONE, sending stops\n")
-                    for rankreq in range(size - 1):
-                        rankreq = comm.recv(source=MPI.ANY_SOURCE)
-                        print("Sending stop to %d\n" % rankreq)
-                        comm.send("endrun", dest=rankreq)
-                    print("All stops sent.")
+                    serve_mpi_work_queue(comm, iterable)
+                    if params.mp.composite_stride is not None:
+                        # take part in gathering composite outputs
+                        do_work(rank, [])
                 else:
                     # client process
-                    while True:
-                        # inform the server this process is ready for an event
-                        print("Rank %d getting next task" % rank)
-                        comm.send(rank, dest=0)
-                        print("Rank %d waiting for response" % rank)
-                        item = comm.recv(source=0)
-                        if item == "endrun":
-                            print("Rank %d received endrun" % rank)
-                            break
-                        print("Rank %d beginning processing" % rank)
-                        try:
-                            do_work(rank, [item])
-                        except Exception as e:
-                            print(
-                                "Rank %d unhandled exception processing event" % rank,
-                                str(e),
-                            )
-                        print("Rank %d event processed" % rank)
+                    do_work(rank, mpi_work_queue_items(comm), catch_errors=True)
         else:
             from dxtbx.command_line.image_average import splitit
 
             if params.mp.nproc == 1:
                 do_work(0, iterable)
+            elif params.mp.scheduler == "dynamic":
+                error_list = run_work_queue(do_work, iterable, params.mp.nproc)
+                if error_list:
+                    print(
+                        "Some processes failed excecution. Not all images may have processed. Error messages:"
+                    )
+                    for error in error_list:
+                        print(error)
             else:
                 result = list(
                     easy_mp.multi_core_run(
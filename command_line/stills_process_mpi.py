@@ -18,6 +18,10 @@
 from dials.command_line.stills_process import Script as base_script
 from dials.command_line.stills_process import do_import, phil_scope
 from dials.command_line.stills_process import Processor
+from dials.command_line.stills_process import (
+    mpi_work_queue_items,
+    serve_mpi_work_queue,
+)
 from dials.util.options import OptionParser
 
 logger = logging.getLogger("dials.command_line.stills_process_mpi")
@@ -108,10 +112,18 @@ def assign_work(self):
                 tags.append("%s_%05d" % (basename, i))
             else:
                 tags.append(basename)
-        iterable = zip(tags, all_paths)
+        self.iterable = list(zip(tags, all_paths))
+
+        # with dynamic scheduling, rank 0 hands out images as the other ranks
+        # become free, which only makes sense for more than two ranks
+        self.dynamic = self.params.mp.scheduler == "dynamic" and self.size > 2
+        if self.dynamic:
+            return
 
         self.subset = [
-            item for i, item in enumerate(iterable) if (i + self.rank) % self.size == 0
+            item
+            for i, item in enumerate(self.iterable)
+            if (i + self.rank) % self.size == 0
         ]
         print("DELEGATE %d of %d: %s" % (self.rank, self.size, self.subset[0:10]))
 
@@ -124,7 +136,8 @@ def run(self):
         # Import stuff
         # no preimport for MPI multifile specialization
 
-        # Wrapper function
+        # Wrapper function. With dynamic scheduling item_list is a generator
+        # that takes the next item from rank 0 when the previous one is done
         def do_work(i, item_list):
             processor = Processor(copy.deepcopy(self.params), composite_tag="%04d" % i)
             for item in item_list:
@@ -134,7 +147,7 @@ def do_work(i, item_list):
                 imagesets = experiments.imagesets()
                 if len(imagesets) == 0 or len(imagesets[0]) == 0:
                     logger.info("Zero length imageset in file: %s" % filename)
-                    return
+                    continue
                 if len(imagesets) > 1:
                     raise Abort("Found more than one imageset in file: %s" % filename)
                 if len(imagesets[0]) > 1:
@@ -155,7 +168,15 @@ def do_work(i, item_list):
         # Process the data
         assert self.params.mp.method == "mpi"
 
-        do_work(self.rank, self.subset)
+        if not self.dynamic:
+            do_work(self.rank, self.subset)
+        elif self.rank == 0:
+            serve_mpi_work_queue(self.comm, self.iterable)
+            if self.params.mp.composite_stride is not None:
+                # take part in gathering composite outputs
+                do_work(self.rank, [])
+        else:
+            do_work(self.rank, mpi_work_queue_items(self.comm))
 
         # Total Time
         logger.info("")
@@ -0,0 +1 @@
+``dials.stills_process``: images are now handed to processes from a work queue as they become free (``mp.scheduler=dynamic``, the new default), instead of being split into fixed chunks up front. Set ``mp.scheduler=static`` for the previous behaviour.
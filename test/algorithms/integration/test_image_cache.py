@@ -0,0 +1,63 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from dials.algorithms.integration.image_cache import ImageCache
+from dials.array_family import flex
+
+
+def _make_frame(value, image_size):
+    data = []
+    mask = []
+    for fast, slow in image_size:
+        d = flex.double(flex.grid(slow, fast), value)
+        d[0] = -1
+        m = flex.bool(flex.grid(slow, fast), True)
+        m[1] = False
+        data.append(d)
+        mask.append(m)
+    return tuple(data), tuple(mask)
+
+
+def test_image_cache_round_trip(tmpdir):
+    image_size = [(5, 4), (3, 2)]
+    cache = ImageCache.create(directory=tmpdir.strpath, max_size=1e9)
+    assert os.path.isdir(cache.directory)
+    assert cache.get(0, 10, image_size) is None
+
+    data, mask = _make_frame(3.5, image_size)
+    cache.put(0, 10, data, mask)
+    cached_data, cached_mask = cache.get(0, 10, image_size)
+    assert len(cached_data) == 2
+    assert len(cached_mask) == 2
+    for d1, d2, m1, m2 in zip(data, cached_data, mask, cached_mask):
+        assert d2.all() == d1.all()
+        assert m2.all() == m1.all()
+        assert list(d2) == list(d1)
+        assert list(m2) == list(m1)
+
+    # A frame with the wrong image size is treated as a miss
+    assert cache.get(0, 10, [(5, 4)]) is None
+    assert cache.get(1, 10, image_size) is None
+
+    cache.destroy()
+    assert not os.path.exists(cache.directory)
+
+
+def test_image_cache_evicts_least_recently_used(tmpdir):
+    image_size = [(10, 10)]
+    frame_size = 9 * 100
+    cache = ImageCache.create(directory=tmpdir.strpath, max_size=2 * frame_size)
+    data, mask = _make_frame(1, image_size)
+    cache.put(0, 0, data, mask)
+    os.utime(cache.filename(0, 0), (1, 1))
+    cache.put(0, 1, data, mask)
+    os.utime(cache.filename(0, 1), (2, 2))
+
+    # Touch frame 0 so that frame 1 becomes the least recently used
+    assert cache.get(0, 0, image_size) is not None
+    cache.put(0, 2, data, mask)
+    assert cache.get(0, 0, image_size) is not None
+    assert cache.get(0, 1, image_size) is None
+    assert cache.get(0, 2, image_size) is not None
+    cache.destroy()
@@ -574,3 +574,51 @@ def approx_equal_dict(a, b, k):
     for r1, r3 in zip(expected1, expected3):
         assert approx_equal_dict(r1, r3, "intensity.sum.value")
         assert approx_equal_dict(r1, r3, "intensity.sum.variance")
+
+
+def test_plan_blocks_for_memory(dials_data, monkeypatch):
+    from dxtbx.model.experiment_list import ExperimentListFactory
+    from dials.algorithms.profile_model.gaussian_rs import Model
+    from dials.algorithms.integration.processor import ManagerRot, Parameters
+    from dials.array_family import flex
+    from math import pi
+    import libtbx.introspection
+
+    path = dials_data("centroid_test_data").join("experiments.json").strpath
+
+    exlist = ExperimentListFactory.from_json_file(path)
+    exlist[0].profile = Model(
+        None, n_sigma=3, sigma_b=0.024 * pi / 180.0, sigma_m=0.044 * pi / 180.0
+    )
+
+    rlist = flex.reflection_table.from_predictions(exlist[0])
+    rlist["id"] = flex.int(len(rlist), 0)
+    rlist.compute_bbox(exlist)
+
+    params = Parameters()
+    params.mp.nproc = 4
+    manager = ManagerRot(exlist, rlist, params)
+    manager.compute_blocks()
+    assert manager.min_block_size is not None
+    block_size = params.block.size
+
+    # Find the memory needed for the smallest allowed blocks
+    params.block.size = manager.min_block_size
+    manager.compute_jobs()
+    min_memory = manager.compute_max_shoebox_memory()
+
+    # Give just enough memory for 4 processes with the smallest blocks
+    class MemoryInfo(object):
+        def memory_total(self):
+            return (4 * min_memory + 1) / params.block.max_memory_usage
+
+    monkeypatch.setattr(libtbx.introspection, "machine_memory_info", MemoryInfo)
+
+    params.block.size = block_size
+    manager.compute_jobs()
+    manager.plan_blocks_for_memory()
+    assert manager.min_block_size <= params.block.size <= block_size
+    assert manager.compute_max_shoebox_memory() <= min_memory
+    manager.split_reflections()
+    manager.compute_processors()
+    assert params.mp.nproc == 4
@@ -37,3 +37,37 @@ def test_centroid_outlier(dials_regression, method, colnames, expected_nout):
     outliers = residuals.get_flags(residuals.flags.centroid_outlier)
 
     assert outliers.count(True) == expected_nout
+
+
+@pytest.mark.parametrize("method", ["tukey", "mcd"])
+def test_centroid_outlier_nproc(dials_regression, method):
+
+    data_dir = os.path.join(
+        dials_regression, "refinement_test_data", "centroid_outlier"
+    )
+    params = phil_scope.extract()
+    params.outlier.algorithm = method
+    params.outlier.block_width = 5.0
+
+    selections = []
+    for nproc in (1, 2):
+        residuals = flex.reflection_table.from_file(
+            os.path.join(data_dir, "residuals.refl")
+        )
+        params.outlier.nproc = nproc
+        # the global random state should not affect the results
+        flex.set_random_seed(nproc)
+        outlier_detector = CentroidOutlierFactory.from_parameters_and_colnames(
+            params, ("x_resid", "y_resid", "phi_resid")
+        )
+        outlier_detector(residuals)
+        outliers = residuals.get_flags(residuals.flags.centroid_outlier)
+        selections.append(outliers.iselection())
+
+        # nor should the outlier detection change the global random state
+        after = flex.random_double()
+        flex.set_random_seed(nproc)
+        assert after == flex.random_double()
+
+    assert len(selections[0]) > 0
+    assert list(selections[0]) == list(selections[1])
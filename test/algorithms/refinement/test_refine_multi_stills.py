@@ -5,7 +5,9 @@
 import os
 
 from dxtbx.model.experiment_list import ExperimentListFactory
+import numpy
 import procrunner
+import pytest
 
 
 def test1(dials_regression, run_in_tmpdir):
@@ -91,3 +93,133 @@ def test_multi_process_refinement_gives_same_results_as_single_process_refinemen
             slow_axis_tolerance=5e-5,
             origin_tolerance=5e-5,
         )
+
+
+def test_incremental_prediction_gives_same_results_as_full_prediction(
+    dials_regression, run_in_tmpdir
+):
+    data_dir = os.path.join(dials_regression, "refinement_test_data", "multi_stills")
+    cmd = [
+        "dials.refine",
+        os.path.join(data_dir, "combined_experiments.json"),
+        os.path.join(data_dir, "combined_reflections.pickle"),
+        "beam.fix=all",
+        "detector.fix=all",
+        "output.reflections=None",
+    ]
+    result = procrunner.run(
+        cmd
+        + [
+            "output.experiments=refined_incremental.expt",
+            "incremental_prediction=True",
+        ]
+    )
+    assert not result.returncode and not result.stderr
+
+    result = procrunner.run(cmd + ["output.experiments=refined_full.expt"])
+    assert not result.returncode and not result.stderr
+
+    # load results
+    full = ExperimentListFactory.from_json_file("refined_full.expt", check_format=False)
+    incremental = ExperimentListFactory.from_json_file(
+        "refined_incremental.expt", check_format=False
+    )
+
+    # compare results
+    for c1, c2 in zip(full.crystals(), incremental.crystals()):
+        assert c1.is_similar_to(c2)
+
+
+def test_schur_engine_gives_same_results_as_levmar(dials_regression, run_in_tmpdir):
+    data_dir = os.path.join(dials_regression, "refinement_test_data", "multi_stills")
+    cmd = [
+        "dials.refine",
+        os.path.join(data_dir, "combined_experiments.json"),
+        os.path.join(data_dir, "combined_reflections.pickle"),
+        "outlier.algorithm=null",
+        "output.reflections=None",
+    ]
+    result = procrunner.run(
+        cmd + ["output.experiments=refined_schur.expt", "engine=SchurLevMar"]
+    )
+    assert not result.returncode and not result.stderr
+
+    result = procrunner.run(
+        cmd + ["output.experiments=refined_levmar.expt", "engine=LevMar"]
+    )
+    assert not result.returncode and not result.stderr
+
+    # load results
+    levmar = ExperimentListFactory.from_json_file(
+        "refined_levmar.expt", check_format=False
+    )
+    schur = ExperimentListFactory.from_json_file(
+        "refined_schur.expt", check_format=False
+    )
+
+    # compare results
+    for b1, b2 in zip(levmar.beams(), schur.beams()):
+        assert b1.is_similar_to(b2)
+    for c1, c2 in zip(levmar.crystals(), schur.crystals()):
+        assert c1.is_similar_to(c2)
+    for d1, d2 in zip(levmar.detectors(), schur.detectors()):
+        assert d1.is_similar_to(
+            d2,
+            fast_axis_tolerance=5e-5,
+            slow_axis_tolerance=5e-5,
+            origin_tolerance=5e-5,
+        )
+
+
+def test_schur_engine_normal_equations(dials_regression):
+    from libtbx.phil import parse
+    from dials.array_family import flex
+    from dials.algorithms.refinement.refiner import phil_scope, RefinerFactory
+
+    data_dir = os.path.join(dials_regression, "refinement_test_data", "multi_stills")
+
+    def build_refiner(engine):
+        experiments = ExperimentListFactory.from_json_file(
+            os.path.join(data_dir, "combined_experiments.json"), check_format=False
+        )
+        reflections = flex.reflection_table.from_file(
+            os.path.join(data_dir, "combined_reflections.pickle")
+        )
+        params = phil_scope.fetch(
+            source=parse(
+                "refinement.reflections.outlier.algorithm=null\n"
+                "refinement.refinery.engine=%s" % engine
+            )
+        ).extract()
+        return RefinerFactory.from_parameters_data_experiments(
+            params, reflections, experiments
+        )
+
+    schur = build_refiner("SchurLevMar")._refinery
+    levmar = build_refiner("LevMar")._refinery
+    assert list(schur.x) == list(levmar.x)
+
+    schur.build_up()
+    levmar.build_up()
+
+    # assemble the full normal matrix from the global and crystal blocks
+    n = len(schur.x)
+    normal = numpy.zeros((n, n))
+    glob = schur._global_indices
+    normal[numpy.ix_(glob, glob)] = schur._normal_global
+    for block in schur._blocks:
+        normal[numpy.ix_(glob, block.indices)] = block.B
+        normal[numpy.ix_(block.indices, glob)] = block.B.T
+        normal[numpy.ix_(block.indices, block.indices)] = block.D
+
+    expected = (
+        levmar.normal_matrix_packed_u()
+        .matrix_packed_u_as_symmetric()
+        .as_numpy_array()
+        .reshape(n, n)
+    )
+    assert normal == pytest.approx(expected, rel=1e-8, abs=1e-10)
+
+    gradient = -levmar.opposite_of_gradient().as_numpy_array()
+    assert schur._gradient == pytest.approx(gradient, rel=1e-8, abs=1e-10)
+    assert schur._objective == pytest.approx(levmar.objective())
@@ -44,3 +44,28 @@ def test_multi_panel_parameterisations(
         params, reflections, experiments
     )
     assert refiner.experiment_type == "stills"
+
+
+def test_independent_experiment_groups(dials_regression):
+    from dials.algorithms.refinement.parameterisation.configure import (
+        independent_experiment_groups,
+    )
+
+    data_dir = os.path.join(dials_regression, "refinement_test_data", "multi_stills")
+    exp_file = os.path.join(data_dir, "combined_experiments.json")
+    experiments = ExperimentListFactory.from_json_file(exp_file, check_format=False)
+    assert len(experiments.beams()) == 1
+    assert len(experiments.detectors()) == 1
+
+    # The shared beam and detector link all the experiments by default
+    params = phil_scope.fetch(source=phil.parse("")).extract()
+    options = params.refinement.parameterisation
+    groups = independent_experiment_groups(options, experiments)
+    assert groups == [list(range(len(experiments)))]
+
+    # With these fixed, the crystals can be refined independently
+    options.beam.fix = ["all"]
+    options.detector.fix = "all"
+    groups = independent_experiment_groups(options, experiments)
+    assert len(groups) == len(experiments.crystals())
+    assert sorted(i for g in groups for i in g) == list(range(len(experiments)))
@@ -0,0 +1,33 @@
+from __future__ import absolute_import, division, print_function
+
+import random
+
+import pytest
+
+from scitbx import sparse
+from dials.array_family import flex
+from dials.algorithms.refinement.target import Target, SparseGradientsMixin
+
+
+def test_sparse_gradient_and_curvature():
+    nref = 50
+    w_resid = flex.random_double(3 * nref) - 0.5
+    weights = flex.random_double(3 * nref)
+
+    # a sparse gradient vector for each type of residual
+    grads = []
+    for _ in range(3):
+        g = sparse.vector(nref)
+        for i in random.sample(range(nref), 10):
+            g[i] = random.uniform(-1, 1)
+        grads.append(g)
+
+    dense_dL_dp, dense_curv = Target._gradient_and_curvature(
+        [g.as_dense_vector() for g in grads],
+        *Target._split_by_residual_type(w_resid, weights, nref)
+    )
+    sparse_dL_dp, sparse_curv = SparseGradientsMixin._gradient_and_curvature(
+        grads, *SparseGradientsMixin._split_by_residual_type(w_resid, weights, nref)
+    )
+    assert sparse_dL_dp == pytest.approx(dense_dL_dp)
+    assert sparse_curv == pytest.approx(dense_curv)
@@ -1132,6 +1132,162 @@ def compare(a, b):
     assert all(tuple(compare(a, b) for a, b in zip(new_table["col11"], c11)))
 
 
+def test_to_from_columnar_file(tmpdir):
+    from dials.array_family.columnar import ColumnarReflectionFile, is_columnar_file
+    from dials.model.data import Shoebox
+
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 0, 1, 1])
+    table["intensity.prf.value"] = flex.double([1.5, 2.5, 3.5, 4.5])
+    table["miller_index"] = flex.miller_index(
+        [(1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 1, 1)]
+    )
+    shoeboxes = flex.shoebox(4)
+    for i in range(4):
+        shoeboxes[i] = Shoebox(0, (0, 2, 0, 2, i, i + 1))
+        shoeboxes[i].allocate()
+    table["shoebox"] = shoeboxes
+    table.experiment_identifiers()[0] = "abcd"
+    table.experiment_identifiers()[1] = "efgh"
+
+    filename = tmpdir.join("reflections.refl").strpath
+    table.as_columnar_file(filename)
+    assert is_columnar_file(filename)
+
+    # Read everything back through from_file
+    new_table = flex.reflection_table.from_file(filename)
+    assert new_table.is_consistent()
+    assert new_table.nrows() == 4
+    assert sorted(new_table.keys()) == sorted(table.keys())
+    assert list(new_table["id"]) == list(table["id"])
+    assert list(new_table["intensity.prf.value"]) == list(table["intensity.prf.value"])
+    assert list(new_table["miller_index"]) == list(table["miller_index"])
+    assert [sbox.bbox for sbox in new_table["shoebox"]] == [
+        sbox.bbox for sbox in shoeboxes
+    ]
+    assert dict(new_table.experiment_identifiers()) == {0: "abcd", 1: "efgh"}
+
+    # Only read a subset of the columns
+    new_table = flex.reflection_table.from_columnar_file(
+        filename, columns=["id", "miller_index"]
+    )
+    assert sorted(new_table.keys()) == ["id", "miller_index"]
+    assert new_table.nrows() == 4
+    assert list(new_table.experiment_identifiers().keys()) == [0, 1]
+
+    with ColumnarReflectionFile(filename) as infile:
+        assert len(infile) == 4
+        assert "shoebox" in infile
+        assert list(infile["intensity.prf.value"]) == [1.5, 2.5, 3.5, 4.5]
+        with pytest.raises(KeyError):
+            infile["intensity.sum.value"]
+
+    # Non-columnar files are still read through the fallback
+    table.as_pickle(filename)
+    assert not is_columnar_file(filename)
+    assert flex.reflection_table.from_file(filename).nrows() == 4
+
+
+def test_iter_chunks(tmpdir):
+    from dials.array_family.columnar import ColumnarReflectionWriter
+
+    table = flex.reflection_table()
+    table["id"] = flex.int(10, 0)
+    table["intensity.sum.value"] = flex.double(range(10))
+    table["miller_index"] = flex.miller_index([(i, 0, 0) for i in range(10)])
+    table.experiment_identifiers()[0] = "abcd"
+
+    # Write incrementally in chunks of 4 rows
+    filename = tmpdir.join("chunks.refl").strpath
+    with ColumnarReflectionWriter(filename) as writer:
+        for i in range(0, 10, 4):
+            writer.write(table[i : i + 4])
+        assert writer.nrows() == 10
+
+    # Read back one row group at a time
+    chunks = list(flex.reflection_table.iter_chunks(filename))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+    assert list(chunks[1]["intensity.sum.value"]) == [4, 5, 6, 7]
+
+    # Read back in different sized chunks and a subset of columns
+    chunks = list(
+        flex.reflection_table.iter_chunks(
+            filename, nrows=3, columns=["intensity.sum.value"]
+        )
+    )
+    assert [len(c) for c in chunks] == [3, 3, 3, 1]
+    assert all(list(c.keys()) == ["intensity.sum.value"] for c in chunks)
+    assert [x for c in chunks for x in c["intensity.sum.value"]] == list(range(10))
+    assert all(c.experiment_identifiers()[0] == "abcd" for c in chunks)
+
+    # Whole-column reads concatenate the row groups
+    new_table = flex.reflection_table.from_file(filename)
+    assert len(new_table) == 10
+    assert list(new_table["miller_index"]) == list(table["miller_index"])
+
+    # Mismatched columns are rejected
+    with pytest.raises(RuntimeError):
+        with ColumnarReflectionWriter(filename) as writer:
+            writer.write(table)
+            del table["id"]
+            writer.write(table)
+
+    # Non-columnar files fall back to reading the whole table
+    table.as_pickle(filename)
+    chunks = list(flex.reflection_table.iter_chunks(filename, nrows=6))
+    assert [len(c) for c in chunks] == [6, 4]
+
+
+def test_columnar_file_default_row_groups(tmpdir, monkeypatch):
+    from dials.array_family import columnar
+
+    monkeypatch.setattr(columnar, "ROW_GROUP_SIZE", 4)
+    table = flex.reflection_table()
+    table["intensity.sum.value"] = flex.double(range(10))
+    filename = tmpdir.join("groups.refl").strpath
+    table.as_columnar_file(filename)
+
+    # Tables are written in bounded row groups by default
+    chunks = list(flex.reflection_table.iter_chunks(filename))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+    chunks = list(flex.reflection_table.iter_chunks(filename, nrows=3))
+    assert [len(c) for c in chunks] == [3, 3, 3, 1]
+    assert [x for c in chunks for x in c["intensity.sum.value"]] == list(range(10))
+
+
+@pytest.mark.parametrize("nthreads", [1, 4])
+def test_columnar_file_compression(tmpdir, monkeypatch, nthreads):
+    from dials.array_family import columnar
+    from dials.model.data import Shoebox
+
+    # Use small blocks so that each column is split over several blocks
+    monkeypatch.setattr(columnar, "BLOCK_SIZE", 256)
+
+    table = flex.reflection_table()
+    table["id"] = flex.int(20, 0)
+    shoeboxes = flex.shoebox(20)
+    for i in range(20):
+        shoeboxes[i] = Shoebox(0, (0, 5, 0, 5, 0, 2))
+        shoeboxes[i].allocate()
+        shoeboxes[i].data[0, 1, 2] = i
+    table["shoebox"] = shoeboxes
+
+    plain = tmpdir.join("plain.refl").strpath
+    table.as_columnar_file(plain)
+    for codec in columnar.available_compression():
+        filename = tmpdir.join("%s.refl" % codec).strpath
+        table.as_columnar_file(filename, compression=codec, nthreads=nthreads)
+        assert os.path.getsize(filename) < os.path.getsize(plain)
+        new_table = flex.reflection_table.from_columnar_file(
+            filename, nthreads=nthreads
+        )
+        assert list(new_table["id"]) == list(table["id"])
+        assert [sbox.data[0, 1, 2] for sbox in new_table["shoebox"]] == list(range(20))
+
+    with pytest.raises(RuntimeError):
+        table.as_columnar_file(plain, compression="unknown")
+
+
 def test_experiment_identifiers():
     from dxtbx.model import ExperimentList, Experiment
 
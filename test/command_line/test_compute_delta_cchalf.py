@@ -3,9 +3,14 @@
 
 import copy
 import os
+from collections import defaultdict
 
 import procrunner
-from dials.algorithms.statistics.delta_cchalf import PerImageCChalfStatistics
+import pytest
+from dials.algorithms.statistics.delta_cchalf import (
+    PerImageCChalfStatistics,
+    ResolutionBinner,
+)
 from iotbx.reflection_file_reader import any_reflection_file
 
 
@@ -30,8 +35,9 @@ def test_compute_delta_cchalf_scaled_data(dials_data, tmpdir):
     assert tmpdir.join("filtered.refl").check()
 
 
-def test_compute_delta_cchalf(dials_regression):
-    """Test compute delta cchalf on an integrated mtz."""
+def _read_test_mtz(dials_regression):
+    """Read the arguments of PerImageCChalfStatistics from an integrated mtz,
+    with each batch as a dataset."""
     filename = os.path.join(
         dials_regression, "delta_cchalf_test_data", "test.XDS_ASCII.mtz"
     )
@@ -73,6 +79,95 @@ def test_compute_delta_cchalf(dials_regression):
     # Add in dummy images for now
     images = copy.deepcopy(batch)
 
+    return (
+        miller_index,
+        identifiers,
+        dataset,
+        images,
+        intensity,
+        variance,
+        unit_cell_list,
+        space_group,
+    )
+
+
+def _mean_cchalf_per_dataset_loop(miller_index, dataset, intensity, bin_index):
+    """Compute the mean CC 1/2 and the CC 1/2 excluding each dataset by looping
+    over the datasets and the unique reflections, as PerImageCChalfStatistics
+    did before its sums were vectorised."""
+
+    def mean_cchalf(excluded_dataset):
+        bin_data = defaultdict(lambda: ([], []))
+        for h, observations in index_lookup.items():
+            I = [intensity[i] for i in observations if dataset[i] != excluded_dataset]
+            n = len(I)
+            if n > 1:
+                mean = sum(I) / n
+                var = sum((x - mean) ** 2 for x in I) / (n - 1) / n
+                bin_data[bin_lookup[h]][0].append(mean)
+                bin_data[bin_lookup[h]][1].append(var)
+        total = 0
+        count = 0
+        for means, variances in bin_data.values():
+            n = len(means)
+            if n > 1:
+                mean_of_means = sum(means) / n
+                sigma_e = sum(variances) / n
+                sigma_y = sum((m - mean_of_means) ** 2 for m in means) / (n - 1)
+                total += n * (sigma_y - sigma_e) / (sigma_y + sigma_e)
+                count += n
+        return total / count
+
+    index_lookup = defaultdict(list)
+    bin_lookup = {}
+    for i, (h, b) in enumerate(zip(miller_index, bin_index)):
+        index_lookup[h].append(i)
+        bin_lookup[h] = b
+
+    return (
+        mean_cchalf(None),
+        {d: mean_cchalf(d) for d in set(dataset)},
+    )
+
+
+def test_compute_delta_cchalf_matches_per_dataset_loop(dials_regression):
+    """Compare the CC 1/2 values excluding each of many datasets, in several
+    resolution bins, with a loop over the datasets."""
+    args = _read_test_mtz(dials_regression)
+    statistics = PerImageCChalfStatistics(*args, nbins=10)
+
+    # The reflections used, with asu miller indices
+    miller_index = statistics._miller_index
+    dataset = statistics._dataset
+    intensity = statistics._intensity
+    unit_cell = args[6][0]
+    d = unit_cell.d(miller_index)
+    binner = ResolutionBinner(unit_cell, min(d), max(d), 10, output=False)
+    bin_index = binner.indices(miller_index)
+    assert len(set(dataset)) > 2
+
+    mean_cchalf, cchalf_i = _mean_cchalf_per_dataset_loop(
+        miller_index, dataset, intensity, bin_index
+    )
+    assert statistics.mean_cchalf() == pytest.approx(mean_cchalf)
+    assert sorted(statistics.cchalf_i()) == sorted(cchalf_i)
+    for i, value in cchalf_i.items():
+        assert statistics.cchalf_i()[i] == pytest.approx(value)
+
+
+def test_compute_delta_cchalf(dials_regression):
+    """Test compute delta cchalf on an integrated mtz."""
+    (
+        miller_index,
+        identifiers,
+        dataset,
+        images,
+        intensity,
+        variance,
+        unit_cell_list,
+        space_group,
+    ) = _read_test_mtz(dials_regression)
+
     # Compute the CC 1/2 Stats
     statistics = PerImageCChalfStatistics(
         miller_index,
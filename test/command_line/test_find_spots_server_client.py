@@ -134,3 +134,16 @@ def exercise_client(port, filenames):
         ]
     )
     assert d_min == sorted([1.45, 1.47, 1.55, 1.55, 1.56, 1.59, 1.61, 1.61, 1.64])
+
+    # The same images in a single batched request
+    result = procrunner.run(client_command + ["batch=True"])
+    assert not result.returncode and not result.stderr
+    out = "<document>%s</document>" % result["stdout"]
+
+    xmldoc = minidom.parseString(out)
+    images = xmldoc.getElementsByTagName("image")
+    assert [node.childNodes[0].data for node in images] == filenames
+    assert sorted(
+        int(node.childNodes[0].data)
+        for node in xmldoc.getElementsByTagName("spot_count")
+    ) == sorted([203, 196, 205, 209, 195, 205, 203, 207, 189])
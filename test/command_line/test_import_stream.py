@@ -0,0 +1,29 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy
+
+from dials.command_line.import_stream import StreamSpotFinder, phil_scope
+from dials.util.stream import decode_image_data
+from dxtbx.model import Detector
+from dxtbx.model.experiment_list import Experiment, ExperimentList
+
+
+def test_stream_spot_finder():
+    detector = Detector()
+    panel = detector.add_panel()
+    panel.set_image_size((50, 40))
+    panel.set_pixel_size((0.1, 0.1))
+    panel.set_trusted_range((-1, 65535))
+    experiments = ExperimentList([Experiment(detector=detector)])
+    params = phil_scope.extract()
+
+    # A flat background with a single 3x3 spot and a flagged bad pixel
+    data = numpy.full((40, 50), 10, dtype="uint16")
+    data[20:23, 30:33] = 1000
+    data[5, 5] = numpy.iinfo("uint16").max
+    info = {"type": "uint16", "encoding": "<"}
+    image = decode_image_data(memoryview(data.tobytes()), info, (50, 40))
+    assert image[5, 5] == -1
+
+    spot_finder = StreamSpotFinder(experiments, params)
+    assert spot_finder(0, image) == 9
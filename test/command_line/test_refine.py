@@ -178,3 +178,39 @@ def test3(dials_regression, tmpdir):
     assert unit_cell == pytest.approx(
         [42.27482, 42.27482, 39.66893, 90.00000, 90.00000, 90.00000], abs=1e-3
     )
+
+
+def test_independent_groups(dials_regression, tmpdir):
+    # multiple stills with a shared beam and detector, which are fixed so that
+    # the crystals can be refined independently
+    data_dir = os.path.join(dials_regression, "refinement_test_data", "multi_stills")
+    result = procrunner.run(
+        [
+            "dials.refine",
+            os.path.join(data_dir, "combined_experiments.json"),
+            os.path.join(data_dir, "combined_reflections.pickle"),
+            "beam.fix=all",
+            "detector.fix=all",
+            "independent_groups=True",
+            "nproc=2",
+            "output.history=history.json",
+        ],
+        working_directory=tmpdir,
+    )
+    assert not result.returncode and not result.stderr
+
+    experiments = ExperimentListFactory.from_json_file(
+        os.path.join(data_dir, "combined_experiments.json"), check_format=False
+    )
+    refined = ExperimentListFactory.from_json_file(
+        tmpdir.join("refined.expt").strpath, check_format=False
+    )
+    assert len(refined) == len(experiments)
+    assert len(refined.detectors()) == 1
+    assert len(refined.beams()) == 1
+
+    history = Journal.from_json_file(tmpdir.join("history.json").strpath)
+    assert set(history["group"]) == set(range(len(experiments.crystals())))
+
+    reflections = flex.reflection_table.from_file(tmpdir.join("refined.refl").strpath)
+    assert reflections.get_flags(reflections.flags.used_in_refinement).count(True)
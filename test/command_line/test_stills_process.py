@@ -11,7 +11,7 @@
 from libtbx import easy_run
 from libtbx.phil import parse
 
-from dials.command_line.stills_process import phil_scope, Processor
+from dials.command_line.stills_process import phil_scope, Processor, run_work_queue
 from dials.array_family import flex
 
 
@@ -143,3 +143,20 @@ def test_sacla_h5(dials_regression, run_in_tmpdir, use_mpi, in_memory=False):
         assert len(table) in n_refls, (result_filename, len(table))
         assert "id" in table
         assert (table["id"] == 0).count(False) == 0
+
+
+def test_run_work_queue(run_in_tmpdir):
+    iterable = [("tag%d" % i, i) for i in range(20)]
+
+    def do_work(i, item_list):
+        with open("worker%d.txt" % i, "w") as f:
+            for tag, item in item_list:
+                f.write(tag + "\n")
+
+    assert run_work_queue(do_work, iterable, 3) == []
+
+    tags = []
+    for i in range(3):
+        with open("worker%d.txt" % i) as f:
+            tags.extend(f.read().split())
+    assert sorted(tags) == sorted(tag for tag, item in iterable)
@@ -105,3 +105,30 @@ def test_filter_shadowed_reflections(dials_regression):
         )
         assert shadowed.count(True) == 17
         assert shadowed.count(False) == 674
+
+
+def test_cached_mask_generator(dials_data):
+    from dials.util.masking import CachedMaskGenerator, MaskGenerator
+    from dials.util.masking import phil_scope as masking_phil_scope
+
+    params = masking_phil_scope.extract()
+    params.d_min = 2.0
+    params.ice_rings.filter = True
+    generator = MaskGenerator(params)
+    cached_generator = CachedMaskGenerator(params)
+
+    filenames = [
+        f.strpath
+        for f in dials_data("centroid_test_data").listdir("centroid_*.cbf", sort=True)
+    ]
+    for filename in filenames[:3]:
+        experiments = ExperimentListFactory.from_filenames([filename])
+        imageset = experiments.imagesets()[0]
+        expected = generator.generate(imageset)
+        mask = cached_generator.generate(imageset)
+        assert len(mask) == len(expected)
+        for m1, m2 in zip(mask, expected):
+            assert (m1 == m2).count(False) == 0
+
+    # All the images share the same models so only one mask is cached
+    assert len(cached_generator._cache) == 1
@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function
+
+import sys
+
+import pytest
+
+from dials.util.mp import streaming_parallel_map
+
+
+def _square(x):
+    return x * x
+
+
+def _identity(x):
+    return x
+
+
+def _fail_on_three(x):
+    if x == 3:
+        raise ValueError("three")
+    return x
+
+
+def test_streaming_parallel_map_preserves_order():
+    def generate():
+        for i in range(20):
+            yield i
+
+    assert streaming_parallel_map(_square, generate(), processes=2) == [
+        i * i for i in range(20)
+    ]
+
+    results = []
+    assert (
+        streaming_parallel_map(
+            _square, range(10), processes=3, max_in_flight=4, callback=results.append
+        )
+        is None
+    )
+    assert results == [i * i for i in range(10)]
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Requires forked worker processes"
+)
+def test_streaming_parallel_map_closure():
+    offset = 3
+
+    def add_offset(x):
+        return x + offset
+
+    results = streaming_parallel_map(add_offset, range(5), processes=2)
+    assert results == [x + offset for x in range(5)]
+
+
+def test_streaming_parallel_map_consumes_lazily():
+    consumed = []
+
+    def generate():
+        for i in range(10):
+            consumed.append(i)
+            yield i
+
+    def callback(result):
+        # Never more than max_in_flight items ahead of the returned results
+        assert len(consumed) - result <= 3
+
+    streaming_parallel_map(
+        _identity, generate(), processes=1, max_in_flight=3, callback=callback
+    )
+    assert consumed == list(range(10))
+
+
+def test_streaming_parallel_map_max_in_flight_below_processes():
+    results = []
+    streaming_parallel_map(
+        _square, range(8), processes=4, max_in_flight=1, callback=results.append
+    )
+    assert results == [i * i for i in range(8)]
+
+
+def test_streaming_parallel_map_raises():
+    with pytest.raises(ValueError):
+        streaming_parallel_map(_fail_on_three, range(6), processes=2)
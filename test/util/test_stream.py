@@ -0,0 +1,53 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+
+import numpy
+import pytest
+
+from dials.util.stream import Decoder, StreamReceiver, decode_image_data
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16", "uint32"])
+def test_decode_image_data(dtype):
+    data = numpy.arange(12, dtype=dtype)
+    data[3] = numpy.iinfo(dtype).max
+    info = {"type": dtype, "encoding": "<"}
+    image = decode_image_data(memoryview(data.tobytes()), info, (4, 3))
+    assert image.all() == (3, 4)
+    assert list(image) == [0, 1, 2, -1] + list(range(4, 12))
+
+    with pytest.raises(RuntimeError):
+        decode_image_data(data.tobytes(), {"type": dtype, "encoding": "?"}, (4, 3))
+
+
+def test_decode_image_data_lz4():
+    lz4_block = pytest.importorskip("lz4.block")
+    data = numpy.arange(12, dtype="uint16")
+    compressed = lz4_block.compress(data.tobytes(), store_size=False)
+    info = {"type": "uint16", "encoding": "lz4<"}
+    image = decode_image_data(compressed, info, (4, 3))
+    assert list(image) == list(range(12))
+
+
+class _Frame(object):
+    def __init__(self, htype):
+        self.bytes = json.dumps({"htype": htype})
+
+
+class _Stream(object):
+    def __init__(self, messages):
+        self.messages = messages
+
+    def receive(self):
+        return self.messages.pop(0)
+
+
+def test_stream_receiver():
+    messages = [[_Frame("dimage-1.0")] for i in range(5)]
+    messages.append([_Frame("dseries_end-1.0")])
+    stream = _Stream(messages)
+    receiver = StreamReceiver(stream, maxsize=2)
+    types = [Decoder.message_type(receiver.receive()) for i in range(6)]
+    receiver.join()
+    assert types == ["dimage-1.0"] * 5 + ["dseries_end-1.0"]
@@ -11,6 +11,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+import copy
 import logging
 import math
 
@@ -280,3 +281,51 @@ def __call__(self):
 
         # Return the mask
         return tuple(masks)
+
+
+class CachedMaskGenerator(object):
+    """
+    Generate masks, reusing the parts of the mask which only depend on the
+    detector and beam models for imagesets with the same models.
+
+    The trusted range mask depends on the image data so is recomputed for
+    every imageset and combined with the cached border, untrusted region,
+    resolution and ice ring masks.
+    """
+
+    def __init__(self, params, max_size=10):
+        """ Set the parameters and the maximum number of cached masks. """
+        self.params = params
+        self.max_size = max_size
+        static_params = copy.deepcopy(params)
+        static_params.use_trusted_range = False
+        self._generator = MaskGenerator(static_params)
+        self._cache = []
+
+    def generate(self, imageset):
+        """ Generate the mask. """
+        detector = imageset.get_detector()
+        beam = imageset.get_beam()
+
+        # Find the static mask for these models, most recently used first
+        for i, (d, b, static_mask) in enumerate(self._cache):
+            if d == detector and b == beam:
+                self._cache.insert(0, self._cache.pop(i))
+                break
+        else:
+            static_mask = self._generator.generate(imageset)
+            self._cache.insert(0, (detector, beam, static_mask))
+            del self._cache[self.max_size :]
+
+        if not self.params.use_trusted_range:
+            return tuple(mask.deep_copy() for mask in static_mask)
+
+        # Combine with the trusted range mask for the first image
+        image = imageset.get_raw_data(0)
+        assert len(detector) == len(image)
+        masks = []
+        for im, panel, mask in zip(image, detector, static_mask):
+            low, high = panel.get_trusted_range()
+            imd = im.as_double()
+            masks.append((imd > low) & (imd < high) & mask)
+        return tuple(masks)
@@ -2,8 +2,11 @@
 
 import future.moves.itertools as itertools
 import libtbx.easy_mp
+import logging
 import warnings
 
+logger = logging.getLogger(__name__)
+
 
 def parallel_map(
     func,
@@ -159,6 +162,87 @@ def multi_node_parallel_map(
     return [item for rlist in result for item in rlist]
 
 
+_worker_func = None
+
+
+def _set_worker_func(func):
+    """Set the function called by _call_worker_func in a worker process."""
+    global _worker_func
+    _worker_func = func
+
+
+def _call_worker_func(item):
+    return _worker_func(item)
+
+
+def streaming_parallel_map(
+    func, iterable, processes=1, max_in_flight=None, callback=None
+):
+    """
+    A parallel map which lazily consumes the iterable and bounds the number of
+    items submitted to the worker pool at any one time. Results are passed to
+    the callback (and returned) in the order of the input iterable as soon as
+    they become available, so the parent process never holds more than
+    max_in_flight pickled items in memory and the workers can start as soon as
+    the first item has been generated.
+
+    :param func: The function to call on each item
+    :param iterable: The (possibly lazy) iterable of items
+    :param processes: The number of worker processes
+    :param max_in_flight: The maximum number of items submitted but not yet
+                          returned (defaults to 2 * processes, and is at least
+                          processes)
+    :param callback: A function to call with each result
+    :return: The list of results (None if a callback is given)
+    """
+    import collections
+    import multiprocessing
+
+    assert processes > 0, "Invalid number of processes"
+    if max_in_flight is None:
+        max_in_flight = 2 * processes
+    if max_in_flight < processes:
+        logger.debug(
+            "Increasing max_in_flight from %d to the number of processes (%d)",
+            max_in_flight,
+            processes,
+        )
+        max_in_flight = processes
+
+    results = []
+
+    def process_result(result):
+        if callback is not None:
+            callback(result)
+        else:
+            results.append(result)
+
+    # Pass the function to the workers once, when they start, rather than with
+    # every item. Where the workers are forked this also allows closures.
+    pool = multiprocessing.Pool(
+        processes=processes, initializer=_set_worker_func, initargs=(func,)
+    )
+    try:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(pool.apply_async(_call_worker_func, (item,)))
+            del item
+            if len(pending) >= max_in_flight:
+                process_result(pending.popleft().get())
+        while pending:
+            process_result(pending.popleft().get())
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if callback is not None:
+        return None
+    return results
+
+
 def batch_parallel_map(
     func=None, iterable=None, processes=None, callback=None, method=None, chunksize=1
 ):
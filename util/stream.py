@@ -11,13 +11,16 @@ class ZMQStream:
 
     """
 
-    def __init__(self, host, port=9999):
+    def __init__(self, host, port=9999, hwm=None):
         """
         create stream listener object
 
+        :param hwm: The maximum number of messages to queue on the socket
+
         """
         self.host = host
         self.port = port
+        self.hwm = hwm
 
         # Connect to the stream
         self.connect()
@@ -40,6 +43,8 @@ def connect(self):
 
         # Create the reciever
         self.receiver = context.socket(zmq.PULL)
+        if self.hwm is not None:
+            self.receiver.setsockopt(zmq.RCVHWM, self.hwm)
         self.receiver.connect(url)
         return self.receiver
 
@@ -61,6 +66,123 @@ def close(self):
         return self.receiver.close()
 
 
+class StreamReceiver(object):
+    """
+    A class to receive messages from a stream in a background thread
+
+    Received messages are held in a queue of at most maxsize messages. When the
+    queue is full the thread stops reading from the stream, so a consumer which
+    falls behind pushes back on the sender rather than buffering an unbounded
+    number of images in memory. The thread stops after the end of series
+    message, after which the stream may be closed.
+
+    """
+
+    def __init__(self, stream, maxsize=16):
+        """
+        Start receiving messages
+
+        """
+        import threading
+        from six.moves import queue
+
+        self.stream = stream
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        """
+        Receive messages until the end of the series
+
+        """
+        try:
+            while True:
+                frames = self.stream.receive()
+                self.queue.put(frames)
+                if Decoder.message_type(frames).startswith("dseries_end"):
+                    break
+        except Exception as e:
+            self.queue.put(e)
+
+    def receive(self):
+        """
+        Return the next message, waiting for it if necessary
+
+        """
+        frames = self.queue.get()
+        if isinstance(frames, Exception):
+            raise frames
+        return frames
+
+    def join(self):
+        """
+        Wait for the receiving thread to finish
+
+        """
+        self.thread.join()
+
+
+def frame_buffer(frame):
+    """
+    Return a buffer for the frame data, without copying it if possible
+
+    """
+    return getattr(frame, "buffer", frame)
+
+
+def decode_image_data(data, info, image_size):
+    """
+    Decode stream image data into a flex array
+
+    The compressed data are read in place from the message buffer and
+    decompressed once. Raw, lz4 and bitshuffle-lz4 encodings are supported;
+    the latter two need the optional lz4 and bitshuffle packages.
+
+    :param data: The buffer containing the image data
+    :param info: The image info dictionary with the type and encoding
+    :param image_size: The (fast, slow) size of the image
+    :return: The image as a flex.int array
+
+    """
+    import numpy
+    from dials.array_family import flex
+
+    fast, slow = image_size
+    dtype = numpy.dtype(info["type"]).newbyteorder("<")
+    encoding = info["encoding"]
+    if encoding == "<":
+        array = numpy.frombuffer(data, dtype=dtype)
+    elif encoding == "lz4<":
+        import lz4.block
+
+        raw = lz4.block.decompress(data, uncompressed_size=fast * slow * dtype.itemsize)
+        array = numpy.frombuffer(raw, dtype=dtype)
+    elif encoding.startswith("bs") and encoding.endswith("-lz4<"):
+        import bitshuffle
+
+        # The data start with the total size (uint64) and the block size
+        # (uint32) in bytes, both big endian
+        buf = numpy.frombuffer(data, dtype=numpy.uint8)
+        block_size = int(buf[8:12].view(">u4")[0]) // dtype.itemsize
+        array = bitshuffle.decompress_lz4(buf[12:], (fast * slow,), dtype, block_size)
+    else:
+        raise RuntimeError("Unknown image encoding %s" % encoding)
+    assert len(array) == fast * slow, "Image data has the wrong size"
+
+    # Bad pixels are flagged with the maximum value of the type; view 32 bit
+    # data as signed so these become -1. Smaller types are widened in a single
+    # conversion and the flagged pixels are then set in the flex array.
+    if dtype.itemsize == 4:
+        result = flex.int(array.view(numpy.int32))
+    else:
+        result = flex.int(numpy.ascontiguousarray(array, dtype=numpy.int32))
+        result.set_selected(result == numpy.iinfo(dtype).max, -1)
+    result.reshape(flex.grid(slow, fast))
+    return result
+
+
 class Result(object):
     """
     A class to represent a result
@@ -171,10 +293,10 @@ def __init__(self, frames, header):
 
         super(Image, self).__init__()
 
-        # Load stuff
+        # Load stuff, keeping a reference to the image data in the message
         head = json.loads(frames[0].bytes)
         info = json.loads(frames[1].bytes)
-        data = frames[2].bytes
+        data = frame_buffer(frames[2])
         time = json.loads(frames[3].bytes)
 
         # The image number and data
@@ -196,6 +318,7 @@ def __init__(self, frames, header):
         # Check the sizes
         assert shape[1] == header.header["configuration"]["x_pixels_in_detector"]
         assert shape[0] == header.header["configuration"]["y_pixels_in_detector"]
+        self.image_size = (shape[1], shape[0])
 
         # # Check the image data hash
         # assert hashlib.md5(data).hexdigest() == head['hash']
@@ -213,6 +336,13 @@ def is_image(self):
         """
         return True
 
+    def as_flex(self):
+        """
+        Return the image data as a flex array
+
+        """
+        return decode_image_data(self.data, self.info, self.image_size)
+
 
 class EndOfSeries(Result):
     """
@@ -243,19 +373,27 @@ def __init__(self, directory, image_template):
         self.directory = directory
         self.image_template = image_template
 
-    def decode(self, frames):
+    @staticmethod
+    def message_type(frames):
         """
-        Decode and process EIGER ZMQ stream frames
+        Get the type of an EIGER ZMQ stream message
 
         """
         import json
 
-        header = json.loads(frames[0].bytes)
-        if header["htype"].startswith("dheader-"):
+        return json.loads(frames[0].bytes)["htype"]
+
+    def decode(self, frames):
+        """
+        Decode and process EIGER ZMQ stream frames
+
+        """
+        htype = self.message_type(frames)
+        if htype.startswith("dheader-"):
             return self.decode_header(frames)
-        elif header["htype"].startswith("dimage-"):
+        elif htype.startswith("dimage-"):
             return self.decode_image(frames)
-        elif header["htype"].startswith("dseries_end"):
+        elif htype.startswith("dseries_end"):
             return self.decode_endofseries(frames)
         else:
             raise RuntimeError("No EIGER ZMQ message received")